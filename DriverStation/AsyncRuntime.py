@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+
+import asyncio
+import collections
+import os
+import sys
+import pygame
+
+import DriverStation
+import DriveCurves
+import FrameEncoder
+import ControlScheduler
+import GamepadInput
+import LinkProtocol
+import LinkBudget
+import Telemetry
+import ControlBus
+import InputConditioning
+import StationLog
+
+################################################################################
+## asyncio runtime for the driver station
+##
+## Same control logic as DriverStation.main(), split into tasks that share
+## state through the DriverStationRuntime object instead of module globals:
+##   sampleInput     -- paces the loop and applies gamepad events
+##   computeCommands -- runs the CommandPipeline and decides what to send
+##   transmit        -- writes frames to the serial port without blocking
+##   receive         -- (optional) parses the telemetry and ACKs sent back by the robot
+##
+## Drive frames go through a single "latest wins" slot and reserved-value
+## frames through an ordered queue, as with SerialWriter. Shutdown (stop
+## button, window close, Ctrl-C or a task failing) always tries the neutral
+## burst and closes the port before run() returns; run() then re-raises the
+## failure, if there was one.
+##
+## Usage: python AsyncRuntime.py [--telemetry]
+################################################################################
+
+
+################################################################################
+## @brief  Non-blocking access to a pyserial port from the event loop
+##
+## On POSIX the port's file descriptor is registered with the event loop. Ports
+## without a file descriptor (Windows COM ports) fall back to the default
+## executor, so the event loop itself still never blocks on the port.
+################################################################################
+class SerialTransport:
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.loop = asyncio.get_running_loop()
+        try:
+            self.fd = ser.fileno()
+            ser.nonblocking()
+        except (AttributeError, NotImplementedError, OSError):
+            self.fd = None
+
+    ############################################################
+    ## @brief  Write all of data, waiting for the port to drain as needed
+    ## @param  data - bytes to write
+    ############################################################
+    async def write(self, data):
+        if self.fd is None:
+            await self.loop.run_in_executor(None, self.ser.write, data)
+            return
+
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self.fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                await self.waitFd(self.loop.add_writer, self.loop.remove_writer)
+
+    ############################################################
+    ## @brief  Wait for bytes from the robot
+    ## @return the bytes currently available (at least one)
+    ############################################################
+    async def read(self):
+        if self.fd is None:
+            return await self.loop.run_in_executor(None, self.readBlocking)
+
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+                if data:
+                    return data
+            except BlockingIOError:
+                pass
+            await self.waitFd(self.loop.add_reader, self.loop.remove_reader)
+
+    def readBlocking(self):
+        return self.ser.read(max(1, self.ser.in_waiting))
+
+    ############################################################
+    ## @return bytes in the driver's transmit buffer, or None if the port cannot tell
+    ############################################################
+    def outWaiting(self):
+        try:
+            return self.ser.out_waiting
+        except (AttributeError, NotImplementedError, OSError):
+            return None
+
+    async def waitFd(self, add, remove):
+        ready = self.loop.create_future()
+        add(self.fd, ready.set_result, None)
+        try:
+            await ready
+        finally:
+            remove(self.fd)
+
+    def close(self):
+        self.ser.close()
+
+
+################################################################################
+## @brief  State shared by the driver station tasks
+################################################################################
+class DriverStationRuntime:
+
+    ############################################################
+    ## @brief  Set up the runtime
+    ## @param  transport - SerialTransport (or anything with async write/read and close)
+    ## @param  gamepad - GamepadInput.ControllerState
+    ## @param  pipeline - DriverStation.CommandPipeline
+    ## @param  encoder - FrameEncoder.FrameEncoder or LinkProtocol.FrameEncoderV2
+    ## @param  scheduler - ControlScheduler.ControlScheduler
+    ## @param  telemetry - whether to run the receive task (always on for protocol v2, for the ACKs)
+    ## @param  name - prefix for console output when several robots share the process
+    ## @param  busName - shared memory block to publish the loop state to (ControlBus.py), or None
+    ## @param  log - StationLog.StationLog shared with other runtimes, or None to run one of its own
+    ############################################################
+    def __init__(self, transport, gamepad, pipeline, encoder, scheduler, telemetry=False, name='', busName=None,
+                 log=None):
+        self.transport = transport
+        self.gamepad = gamepad
+        self.pipeline = pipeline
+        self.encoder = encoder
+        self.scheduler = scheduler
+        self.linkV2 = isinstance(encoder, LinkProtocol.FrameEncoderV2)
+        self.telemetry = telemetry or self.linkV2
+        self.receiver = Telemetry.TelemetryReceiver(encoder.ackReceived if self.linkV2 else None)
+        self.name = name
+        self.prefix = name + ": " if name else ""
+        self.bus = None
+        if busName is not None:
+            protocol = LinkProtocol.PROTOCOL_V2 if self.linkV2 else LinkProtocol.PROTOCOL_V1
+            try:
+                self.bus = ControlBus.ControlBusWriter(busName, len(gamepad.axes), len(gamepad.buttons), protocol)
+            except FileExistsError as e:
+                # Another driver station is publishing there; leave its bus alone
+                print(self.prefix + str(e), "-- not publishing the loop state")
+        self.ownLog = log is None
+        if self.ownLog:
+            log = StationLog.StationLog(True, DriverStation.LOG_FILE, DriverStation.LOG_FRAME_SUMMARY_S)
+        self.log = log
+
+        # Transmit channels
+        self.driveFrame = None
+        self.reliable = collections.deque()
+
+        # Created in run() so they belong to the running event loop
+        self.inputReady = None
+        self.txReady = None
+        self.stopped = None
+        self.closing = False
+
+        # Counters
+        self.driveDropped = 0
+        self.framesQueued = 0
+        self.bytesWritten = 0
+        self.bytesReceived = 0
+        self.lastReceived = b''
+
+    ############################################################
+    ## @brief  Run all tasks until the stop button, window close or cancellation
+    ## @param  ownInput - run sampleInput(); false when something else paces the loop,
+    ##                    applies the gamepad events and sets inputReady (see MultiRobot.py)
+    ############################################################
+    async def run(self, ownInput=True):
+        self.inputReady = asyncio.Event()
+        self.txReady = asyncio.Event()
+        self.stopped = asyncio.Event()
+        if self.ownLog:
+            self.log.start()
+
+        tasks = [asyncio.ensure_future(self.computeCommands())]
+        if ownInput:
+            tasks.append(asyncio.ensure_future(self.sampleInput()))
+        if self.telemetry:
+            tasks.append(asyncio.ensure_future(self.receive()))
+        transmitter = asyncio.ensure_future(self.transmit())
+        stopped = asyncio.ensure_future(self.stopped.wait())
+
+        # The tasks run until shutdown, so one that finishes first has failed: stop on it
+        failure = None
+        try:
+            await asyncio.wait(tasks + [transmitter, stopped], return_when=asyncio.FIRST_COMPLETED)
+            failure = firstFailure(tasks + [transmitter])
+            if failure is not None:
+                print(self.prefix + "Stopping, a task failed:", repr(failure))
+        finally:
+            print(self.prefix + "Cleaning up and exiting")
+            stopped.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(stopped, *tasks, return_exceptions=True)
+
+            # Zero all the commands to the robot, flush, and close the port
+            try:
+                self.closing = True
+                if transmitter.done():
+                    await self.transport.write(self.encoder.neutral())
+                else:
+                    self.queueReliable(self.encoder.neutral(), coalesce=True)
+                    await transmitter
+            except Exception as e:
+                print(self.prefix + "Could not send the neutral frames:", repr(e))
+                if failure is None:
+                    failure = e
+            finally:
+                self.transport.close()
+                if self.ownLog:
+                    self.log.close()
+            print(self.prefix + "Loop timing -- ", self.scheduler.summary())
+            if self.pipeline.rateController is not None:
+                print(self.prefix + "Link budget -- ", self.pipeline.rateController.summary())
+            if self.linkV2:
+                print(self.prefix + "Link -- ", self.encoder.summary())
+            if self.telemetry:
+                print(self.prefix + "Robot -- ", self.receiver.summary())
+            if self.bus is not None:
+                self.bus.close()
+        if failure is not None:
+            raise failure
+
+    def stop(self):
+        self.stopped.set()
+
+    ############################################################
+    ## @brief  Task: pace the loop and apply gamepad events
+    ############################################################
+    async def sampleInput(self):
+        scheduler = self.scheduler
+        while True:
+            remaining = scheduler.remainingNs()
+            if remaining > 0:
+                await asyncio.sleep(remaining / float(ControlScheduler.NS_PER_S))
+            scheduler.startCycle()
+            self.gamepad.update()
+            self.inputReady.set()
+
+    ############################################################
+    ## @brief  Task: compute commands from the latest snapshot
+    ############################################################
+    async def computeCommands(self):
+        gamepad = self.gamepad
+        pipeline = self.pipeline
+        scheduler = self.scheduler
+        rate = pipeline.rateController
+
+        while True:
+            await self.inputReady.wait()
+            self.inputReady.clear()
+
+            if gamepad.watchdogTripped():
+                self.queueReliable(self.encoder.neutral(), coalesce=True)
+                if rate is not None:
+                    rate.frameSent(len(self.encoder.neutral()))
+                self.publish(True)
+                continue
+
+            if rate is not None:
+                rate.update(self.transport.outWaiting())
+            frame = pipeline.nextFrame(gamepad.axes, gamepad.buttons, scheduler.keepAliveDue(), self.encoder)
+
+            if pipeline.stopRequested or gamepad.quitRequested:
+                self.stop()
+                return
+
+            # Only send if the commands changed or if the keep-alive interval elapsed
+            if frame is not None:
+                self.log.frame(scheduler.now, pipeline.leftCmd, pipeline.rightCmd, pipeline.armCmd,
+                               pipeline.loopCounter, self.prefix)
+
+                if pipeline.isReliable():
+                    dropped = self.queueReliable(frame)
+                else:
+                    dropped = self.driveFrame is not None
+                    if dropped:
+                        self.driveDropped += 1
+                    self.driveFrame = bytes(frame)
+                    self.txReady.set()
+                if dropped:
+                    self.encoder.resync()  # v2 delta frames assumed the dropped frame arrived
+                self.receiver.noteSent(pipeline.leftCmd, pipeline.rightCmd, pipeline.armCmd)
+                self.framesQueued += 1
+                if rate is not None:
+                    rate.frameSent(len(frame))
+
+                pipeline.markSent()
+                scheduler.markSent()
+
+            self.publish(False)
+
+    ############################################################
+    ## @brief  Publish this cycle's state on the control bus, if there is one
+    ############################################################
+    def publish(self, watchdogTripped):
+        if self.bus is not None:
+            self.bus.publish(self.scheduler.now, self.gamepad, self.pipeline, watchdogTripped, self.framesQueued,
+                             self.bytesWritten, self.driveDropped, self.receiver)
+
+    ############################################################
+    ## @brief  Queue a frame that must reach the wire
+    ## @param  coalesce - skip the frame if it is already at the end of the queue (neutral burst only;
+    ##                    v1 mode-change repeats are identical on purpose)
+    ## @return true if a pending drive frame was discarded to make way for it
+    ############################################################
+    def queueReliable(self, frame, coalesce=False):
+        frame = bytes(frame)
+        # A pending drive frame is older than this one; its arm byte may belong to the old mode
+        dropped = self.driveFrame is not None
+        if dropped:
+            self.driveFrame = None
+            self.driveDropped += 1
+        if not (coalesce and self.reliable and self.reliable[-1] == frame):
+            self.reliable.append(frame)
+        self.txReady.set()
+        return dropped
+
+    ############################################################
+    ## @brief  Task: write reliable frames first, then the latest drive frame
+    ############################################################
+    async def transmit(self):
+        while True:
+            await self.txReady.wait()
+            self.txReady.clear()
+
+            while self.reliable or self.driveFrame is not None:
+                if self.reliable:
+                    frame = self.reliable.popleft()
+                else:
+                    frame = self.driveFrame
+                    self.driveFrame = None
+                await self.transport.write(frame)
+                self.bytesWritten += len(frame)
+
+            if self.closing:
+                return
+
+    ############################################################
+    ## @brief  Task: parse whatever the robot sends back (telemetry, ACKs)
+    ############################################################
+    async def receive(self):
+        while True:
+            data = await self.transport.read()
+            self.bytesReceived += len(data)
+            self.lastReceived = data
+            self.receiver.feed(data)
+
+
+############################################################
+## @brief  Exception of the first task that failed
+## @param  tasks - asyncio tasks
+## @return the exception, or None if none of them has failed
+############################################################
+def firstFailure(tasks):
+    for task in tasks:
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            return task.exception()
+    return None
+
+
+############################################################
+## @brief  Negotiate the link protocol and build the matching encoder and pipeline
+## @param  ser - open serial port
+## @param  protocol - highest protocol version to offer
+## @param  adaptive - throttle small changes as the link fills up (LinkBudget.py)
+## @param  baud - link rate for the rate controller
+## @return (encoder, pipeline)
+############################################################
+def setUpLink(ser, protocol=DriverStation.LINK_PROTOCOL, adaptive=DriverStation.ADAPTIVE_RATE,
+              baud=DriverStation.SERIAL_BAUD):
+    if protocol == LinkProtocol.PROTOCOL_V2:
+        protocol = LinkProtocol.negotiate(ser)
+    if protocol == LinkProtocol.PROTOCOL_V2:
+        encoder = LinkProtocol.FrameEncoderV2(DriverStation.PID_ERROR_OR_MEASUREMENT, DriverStation.pidGains())
+    else:
+        # Each link gets its own encoder: the frame buffer is reused for every frame it packs
+        encoder = FrameEncoder.FrameEncoder(DriverStation.PID_ERROR_OR_MEASUREMENT, DriverStation.pidGains())
+    print("Robot link on", ser.port, ": protocol v" + str(protocol))
+    rate = LinkBudget.RateController(baud) if adaptive else None
+    pipeline = DriverStation.CommandPipeline(DriveCurves.CurveTables(), protocol == LinkProtocol.PROTOCOL_V2, rate,
+                                             InputConditioning.build(DriverStation.CONDITIONING))
+    return (encoder, pipeline)
+
+
+def main():
+
+    telemetry = '--telemetry' in sys.argv[1:]
+
+    # Initialize the gamepad
+    GamepadInput.initJoystickOnly()
+    joysticks = []
+    for i in range(0, pygame.joystick.get_count()):
+        joysticks.append(pygame.joystick.Joystick(i))
+        joysticks[-1].init()
+        print("Detected joystick '",joysticks[-1].get_name(),"'")
+
+    GamepadInput.allowJoystickEventsOnly()
+    gamepad = GamepadInput.ControllerState(joysticks[0])
+    scheduler = ControlScheduler.ControlScheduler(DriverStation.CONTROL_LOOP_RATE_HZ,
+                                                  DriverStation.KEEP_ALIVE_MS)
+    ser = DriverStation.openSerialPort()
+    (encoder, pipeline) = setUpLink(ser)
+
+    async def runAll():
+        runtime = DriverStationRuntime(SerialTransport(ser), gamepad, pipeline,
+                                       encoder, scheduler, telemetry, busName=DriverStation.CONTROL_BUS_NAME)
+        # Reconnect/disconnect lines happen on the loop; keep them off the console there
+        gamepad.report = runtime.log.message
+        await runtime.run()
+
+    try:
+        asyncio.run(runAll())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pygame.quit()
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
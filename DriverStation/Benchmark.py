@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import pygame
+
+import DriverStation
+import DriveCurves
+import GamepadInput
+import LinkProtocol
+import SimHarness
+import StationLog
+import InputConditioning
+
+################################################################################
+## Benchmarks for the driver station hot paths
+##
+## Each benchmark reports:
+##   ns/op      -- mean time over a tight loop of calls
+##   p50/p99    -- per-call latency from individually timed calls
+##   blocks/op  -- net memory blocks still allocated after each call (leaks/growth)
+##   peakB/op   -- peak transient allocation of a single call, in bytes
+##
+## The "cycle" benchmark runs a full input -> compute -> serial write cycle
+## against a pty loopback.
+##
+## Usage: python Benchmark.py [--iterations N] [--out FILE] [--compare FILE]
+################################################################################
+
+DEFAULT_ITERATIONS = 200000
+LATENCY_SAMPLES = 20000
+
+
+############################################################
+## @brief  Time one function
+## @param  fn - function taking no arguments
+## @param  iterations - calls in the throughput loop
+## @return dict of results
+############################################################
+def bench(fn, iterations):
+
+    perfCounter = time.perf_counter_ns
+
+    # Warm up caches and lazily built state
+    for i in range(0, 1000):
+        fn()
+
+    gc.collect()
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        # Throughput
+        start = perfCounter()
+        for i in range(0, iterations):
+            fn()
+        nsPerOp = (perfCounter() - start) / float(iterations)
+
+        # Per-call latency, corrected for the cost of reading the clock
+        overhead = min(-perfCounter() + perfCounter() for i in range(0, 1000))
+        samples = [0] * LATENCY_SAMPLES
+        for i in range(0, LATENCY_SAMPLES):
+            t0 = perfCounter()
+            fn()
+            samples[i] = perfCounter() - t0 - overhead
+        samples.sort()
+
+        # Net blocks left behind per call
+        blocksBefore = sys.getallocatedblocks()
+        for i in range(0, LATENCY_SAMPLES):
+            fn()
+        blocksPerOp = (sys.getallocatedblocks() - blocksBefore) / float(LATENCY_SAMPLES)
+    finally:
+        if gcWasEnabled:
+            gc.enable()
+
+    # Transient allocation of one call
+    tracemalloc.start()
+    fn()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    fn()
+    peakBytes = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    return {'nsPerOp': nsPerOp,
+            'p50Ns': samples[len(samples) // 2],
+            'p99Ns': samples[len(samples) * 99 // 100],
+            'blocksPerOp': blocksPerOp,
+            'peakBytesPerOp': peakBytes}
+
+
+############################################################
+## @brief  Build the benchmark cases
+## @return list of (name, function) pairs
+############################################################
+def benchmarkCases():
+
+    curves = DriveCurves.CurveTables()
+    encoder = DriverStation.encoder
+
+    # Pre-built inputs so the benchmarks do not time input generation
+    samples = SimHarness.generateTrace(10)
+    count = len(samples)
+    state = {'i': 0}
+
+    def nextSample():
+        i = state['i'] + 1
+        if i == count:
+            i = 0
+        state['i'] = i
+        return samples[i]
+
+    def arcadeDrive():
+        axes = nextSample()[1]
+        DriverStation.arcadeDrive(axes[1], -axes[4])
+
+    def arcadeDriveTable():
+        axes = nextSample()[1]
+        curves.drive(axes[1], -axes[4])
+
+    def manualArmDrive():
+        DriverStation.manualArmDrive(nextSample()[1][2])
+
+    def manualArmDriveTable():
+        curves.arm(nextSample()[1][2])
+
+    def armDrive():
+        DriverStation.armDrive(nextSample()[1][2], 1, 0, DriverStation.ArmMode.MANUAL)
+
+    # Input layer: one axis event applied, then the watchdog check (replaces joystickWatchdog)
+    gamepad = GamepadInput.ControllerState(None, len(samples[0][1]), len(samples[0][2]))
+    axisEvents = [pygame.event.Event(pygame.JOYAXISMOTION, instance_id=0, axis=1, value=s[1][1])
+                  for s in samples]
+    eventState = {'i': 0}
+
+    def gamepadWatchdog():
+        i = eventState['i'] + 1
+        if i == count:
+            i = 0
+        eventState['i'] = i
+        gamepad.handleEvent(axisEvents[i])
+        gamepad.watchdogTripped()
+
+    pipeline = DriverStation.CommandPipeline(curves)
+
+    def pipelineNextFrame():
+        sample = nextSample()
+        if pipeline.nextFrame(sample[1], sample[2], False, encoder) is not None:
+            pipeline.markSent()
+
+    # Same, with smoothing on the axes and slew limiting on the motor commands
+    conditionedPipeline = DriverStation.CommandPipeline(curves, conditioning=InputConditioning.build(
+        {'y': [('ema', 0.5)], 'r': [('ema', 0.5)], 'left': [('slew', 20, 127)], 'right': [('slew', 20, 127)]}))
+
+    def conditionedNextFrame():
+        sample = nextSample()
+        if conditionedPipeline.nextFrame(sample[1], sample[2], False, encoder) is not None:
+            conditionedPipeline.markSent()
+
+    def encodeFrame():
+        encoder.command(100, 150, 200)
+
+    encoderV2 = LinkProtocol.FrameEncoderV2()
+    v2State = {'left': 100}
+
+    def encodeFrameV2():
+        # Only the left value changes, so every call packs a one-channel delta frame
+        v2State['left'] ^= 1
+        encoderV2.command(v2State['left'], 150, 200)
+
+    # Queuing a frame record for the log (the consumer is not running; the record is taken back out)
+    log = StationLog.StationLog(False)
+
+    def logFrame():
+        log.frame(0, 100, 150, 200, 1)
+        log.queue.popleft()
+
+    # Full cycle against a pty loopback
+    ptySerial = SimHarness.PtySerial()
+    cycleGamepad = GamepadInput.ControllerState(None, len(samples[0][1]), len(samples[0][2]))
+    cyclePipeline = DriverStation.CommandPipeline(curves)
+
+    def sendCycle():
+        sample = nextSample()
+        SimHarness.applySnapshot(cycleGamepad, sample[1], sample[2])
+        if cycleGamepad.watchdogTripped():
+            return
+        frame = cyclePipeline.nextFrame(cycleGamepad.axes, cycleGamepad.buttons, True, encoder)
+        if frame is not None:
+            ptySerial.write(frame)
+            cyclePipeline.markSent()
+        del ptySerial.output[:]
+
+    return [('arcadeDrive', arcadeDrive),
+            ('arcadeDrive[table]', arcadeDriveTable),
+            ('manualArmDrive', manualArmDrive),
+            ('manualArmDrive[table]', manualArmDriveTable),
+            ('armDrive', armDrive),
+            ('gamepadWatchdog', gamepadWatchdog),
+            ('pipeline.nextFrame', pipelineNextFrame),
+            ('nextFrame[conditioned]', conditionedNextFrame),
+            ('encoder.command', encodeFrame),
+            ('encoderV2.command', encodeFrameV2),
+            ('log.frame', logFrame),
+            ('cycle[pty]', sendCycle)]
+
+
+def main():
+
+    args = sys.argv[1:]
+
+    def option(name, default=None):
+        if name in args:
+            return args[args.index(name) + 1]
+        return default
+
+    iterations = int(option('--iterations', DEFAULT_ITERATIONS))
+
+    previous = None
+    if option('--compare') is not None:
+        with open(option('--compare')) as f:
+            previous = json.load(f)['results']
+
+    results = {}
+    print("{:<24}{:>10}{:>10}{:>10}{:>11}{:>10}".format("benchmark", "ns/op", "p50", "p99",
+                                                     "blocks/op", "peakB/op"))
+    for (name, fn) in benchmarkCases():
+        # The pty cycle makes a syscall per call, so run it fewer times
+        n = iterations // 10 if name.startswith('cycle') else iterations
+        r = bench(fn, n)
+        results[name] = r
+        line = "{:<24}{:>10.0f}{:>10}{:>10}{:>11.3f}{:>10}".format(
+            name, r['nsPerOp'], r['p50Ns'], r['p99Ns'], r['blocksPerOp'], r['peakBytesPerOp'])
+        if previous is not None and name in previous:
+            change = (r['nsPerOp'] / previous[name]['nsPerOp'] - 1.0) * 100.0
+            line += "  ({:+.1f}%)".format(change)
+        print(line)
+
+    if option('--out') is not None:
+        with open(option('--out'), 'w') as f:
+            json.dump({'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       'python': platform.python_version(),
+                       'machine': platform.platform(),
+                       'iterations': iterations,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
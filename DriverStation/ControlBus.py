@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+import collections
+import os
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+################################################################################
+## Shared-memory control-state bus
+##
+## The control loop publishes its state once per cycle to a fixed-layout
+## multiprocessing.shared_memory block, so dashboards, loggers and gamepad
+## visualizers can watch the driver station without opening the gamepad or
+## parsing stdout.
+##
+## Writes are guarded by a seqlock: the writer makes the sequence number odd,
+## packs the state straight into the block with struct.pack_into (no copy, no
+## system call), then makes it even again. Readers copy the state out and
+## retry if the sequence number was odd or changed meanwhile, so a reader can
+## never stall the control loop. (Python has no memory barriers: this relies
+## on the stores landing in program order, which x86 guarantees.)
+##
+## Layout, little-endian:
+##   header  magic 'BBCB', uint16 version, uint8 axes, uint8 buttons, uint32 seq, uint32 writer pid
+##   state   see STATE_FORMAT and State below; axes beyond the gamepad's count are 0,
+##           buttons are a bit mask (bit i = button i)
+##
+## A block whose writer is still running is never taken over, so a second
+## driver station started with the same name gets FileExistsError instead of
+## stealing the bus; one left behind by a crashed run is replaced.
+##
+## Usage: python ControlBus.py [NAME]   (prints the published state)
+################################################################################
+
+MAGIC = b'BBCB'
+VERSION = 1
+
+MAX_AXES = 8
+MAX_BUTTONS = 32
+
+NO_COMMAND = 255            # `command` when no reserved-value command was issued this cycle
+
+# Bits of `flags`
+FLAG_GAMEPAD_CONNECTED = 1
+FLAG_WATCHDOG_TRIPPED = 2
+FLAG_ROBOT_FAILSAFE = 4
+FLAG_TELEMETRY = 8          # the robot telemetry fields are valid
+
+HEADER_FORMAT = struct.Struct('<4sHBBII')
+SEQ_OFFSET = 8
+SEQ_FORMAT = struct.Struct('<I')
+STATE_FORMAT = struct.Struct('<q' + str(MAX_AXES) + 'fI8BfIIIfihhf')
+STATE_OFFSET = HEADER_FORMAT.size
+BUS_SIZE = STATE_OFFSET + STATE_FORMAT.size
+
+READ_RETRIES = 100
+
+State = collections.namedtuple('State', ['seq', 'timestampNs', 'axes', 'buttons',
+                                         'leftCmd', 'rightCmd', 'armCmd', 'armMode', 'command', 'flags',
+                                         'protocol', 'rateLevel', 'utilization',
+                                         'framesSent', 'bytesSent', 'framesDropped',
+                                         'rttMs', 'encoder', 'setpoint', 'robotArmUs', 'telemetryAgeMs'])
+
+
+############################################################
+## @brief  Open an existing block without taking ownership of it
+## @param  name - shared memory name
+############################################################
+def attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        untrack(shm)
+        return shm
+
+
+############################################################
+## @brief  Stop the resource tracker from unlinking a block this process attached to
+##
+## Before Python 3.13 attaching also registers the block with the resource
+## tracker, which would unlink it when this process exits.
+############################################################
+def untrack(shm):
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except (ImportError, AttributeError):
+        pass
+
+
+############################################################
+## @brief  Why an existing block must not be replaced
+## @param  shm - the attached block
+## @return reason, or None if it is a control bus left behind by a writer that is gone
+############################################################
+def blockInUse(shm):
+    if shm.size < HEADER_FORMAT.size:
+        return "is not a control bus"
+    (magic, version, numAxes, numButtons, seq, pid) = HEADER_FORMAT.unpack_from(shm.buf, 0)
+    if magic != MAGIC:
+        return "is not a control bus"
+    if os.name == 'nt':
+        # Windows frees a block with its last handle, so one that exists has a live writer
+        # (and os.kill() would terminate the process rather than probe it)
+        return "is in use by process " + str(pid)
+    if pid == 0:
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return "is in use by process " + str(pid)
+
+
+################################################################################
+## @brief  Publishes the control loop's state (one writer per block)
+################################################################################
+class ControlBusWriter:
+
+    ############################################################
+    ## @brief  Create the shared memory block (replacing one left behind by a crashed run)
+    ## @param  name - shared memory name
+    ## @param  numAxes, numButtons - gamepad size (extra axes/buttons are not published)
+    ## @param  protocol - link protocol version in use
+    ## @param  force - replace the block even if its writer is still running
+    ## @throws FileExistsError if another running writer (or something else) owns the block
+    ############################################################
+    def __init__(self, name, numAxes, numButtons, protocol=1, force=False):
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=BUS_SIZE)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            reason = None if force else blockInUse(stale)
+            if reason is not None:
+                untrack(stale)
+                stale.close()
+                raise FileExistsError("Shared memory block " + name + " " + reason)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=BUS_SIZE)
+        self.name = name
+        self.buf = self.shm.buf
+        self.numAxes = min(numAxes, MAX_AXES)
+        self.numButtons = min(numButtons, MAX_BUTTONS)
+        self.protocol = protocol
+        self.axes = [0.0] * MAX_AXES
+        self.seq = 0
+        HEADER_FORMAT.pack_into(self.buf, 0, MAGIC, VERSION, self.numAxes, self.numButtons, 0, os.getpid())
+
+    ############################################################
+    ## @brief  Publish the state of this cycle
+    ## @param  nowNs - cycle timestamp (monotonic ns)
+    ## @param  gamepad - GamepadInput.ControllerState
+    ## @param  pipeline - DriverStation.CommandPipeline
+    ## @param  watchdogTripped - whether the gamepad watchdog zeroed the robot this cycle
+    ## @param  framesSent, bytesSent, framesDropped - link counters
+    ## @param  telemetry - Telemetry.TelemetryReceiver, or None
+    ############################################################
+    def publish(self, nowNs, gamepad, pipeline, watchdogTripped, framesSent, bytesSent, framesDropped,
+                telemetry=None):
+        axes = self.axes
+        source = gamepad.axes
+        for i in range(0, self.numAxes):
+            axes[i] = source[i]
+        buttons = 0
+        source = gamepad.buttons
+        for i in range(0, self.numButtons):
+            if source[i]:
+                buttons |= 1 << i
+
+        flags = (FLAG_GAMEPAD_CONNECTED if gamepad.connected else 0) | \
+                (FLAG_WATCHDOG_TRIPPED if watchdogTripped else 0)
+        rate = pipeline.rateController
+        sample = telemetry.latest if telemetry is not None else None
+        if sample is not None:
+            flags |= FLAG_TELEMETRY | (FLAG_ROBOT_FAILSAFE if sample.failsafe else 0)
+            robot = (telemetry.rttMs.mean(), sample.encoder, sample.setpoint, sample.armUs,
+                     (nowNs - sample.receivedNs) / 1e6)
+        else:
+            robot = (0.0, 0, 0, 0, 0.0)
+
+        buf = self.buf
+        self.seq += 1
+        SEQ_FORMAT.pack_into(buf, SEQ_OFFSET, self.seq & 0xFFFFFFFF)    # odd: write in progress
+        STATE_FORMAT.pack_into(buf, STATE_OFFSET, nowNs, *axes, buttons,
+                               pipeline.leftCmd, pipeline.rightCmd, pipeline.armCmd, pipeline.armMode.value,
+                               NO_COMMAND if pipeline.command is None else pipeline.command, flags,
+                               self.protocol, rate.level if rate is not None else 0,
+                               rate.utilization if rate is not None else 0.0,
+                               framesSent & 0xFFFFFFFF, bytesSent & 0xFFFFFFFF, framesDropped & 0xFFFFFFFF,
+                               *robot)
+        self.seq += 1
+        SEQ_FORMAT.pack_into(buf, SEQ_OFFSET, self.seq & 0xFFFFFFFF)    # even: consistent
+
+    ############################################################
+    ## @brief  Remove the block (readers keep their mapping until they close)
+    ############################################################
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+################################################################################
+## @brief  Reads the published state; never blocks the writer
+################################################################################
+class ControlBusReader:
+
+    ############################################################
+    ## @param  name - shared memory name the driver station publishes to
+    ############################################################
+    def __init__(self, name):
+        self.shm = attach(name)
+        self.buf = self.shm.buf
+        (magic, version, self.numAxes, self.numButtons, seq, writerPid) = HEADER_FORMAT.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Shared memory block " + name + " is not a version " + str(VERSION) + " control bus")
+        self.lastSeq = None
+        self.tornReads = 0
+
+    ############################################################
+    ## @brief  Copy out a consistent snapshot
+    ## @return State, or None if nothing has been published yet or the writer kept it busy
+    ############################################################
+    def read(self):
+        buf = self.buf
+        for attempt in range(0, READ_RETRIES):
+            (before,) = SEQ_FORMAT.unpack_from(buf, SEQ_OFFSET)
+            if before & 1:
+                self.tornReads += 1
+                continue
+            values = STATE_FORMAT.unpack_from(buf, STATE_OFFSET)
+            (after,) = SEQ_FORMAT.unpack_from(buf, SEQ_OFFSET)
+            if before != after:
+                self.tornReads += 1
+                continue
+            if before == 0:
+                return None
+            buttons = values[1 + MAX_AXES]
+            return State(before // 2, values[0], values[1:1 + self.numAxes],
+                         tuple((buttons >> i) & 1 for i in range(0, self.numButtons)),
+                         *values[2 + MAX_AXES:])
+        return None
+
+    ############################################################
+    ## @brief  Wait for a state newer than the last one returned by this method
+    ## @param  timeoutS - give up after this long
+    ## @param  pollS - how often to look
+    ## @return State, or None on timeout
+    ############################################################
+    def waitNext(self, timeoutS=1.0, pollS=0.005):
+        deadline = time.monotonic() + timeoutS
+        while True:
+            state = self.read()
+            if state is not None and state.seq != self.lastSeq:
+                self.lastSeq = state.seq
+                return state
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(pollS)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+def main():
+    import DriverStation
+
+    args = sys.argv[1:]
+    name = args[0] if args else DriverStation.CONTROL_BUS_NAME
+    reader = ControlBusReader(name)
+    try:
+        while True:
+            state = reader.waitNext()
+            if state is None:
+                print("No updates from", name)
+                continue
+            print("L: {} R: {} A: {} mode: {} cmd: {} flags: {:#x} | frames: {} bytes: {} | rtt: {:.1f}ms "
+                  "enc: {} setpoint: {}".format(state.leftCmd, state.rightCmd, state.armCmd, state.armMode,
+                                                "-" if state.command == NO_COMMAND else state.command,
+                                                state.flags, state.framesSent, state.bytesSent, state.rttMs,
+                                                state.encoder, state.setpoint))
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
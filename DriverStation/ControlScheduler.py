@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import time
+
+################################################################################
+## Fixed-rate scheduler for the driver station control loop
+##
+## Each cycle has an absolute deadline on time.monotonic_ns(). Deadlines advance
+## by exactly one period, so sleep overshoot does not accumulate into drift. If
+## the loop falls more than a full period behind, the missed cycles are counted
+## as overruns and the schedule restarts from the current time instead of
+## running a burst of catch-up cycles.
+##
+## The 50ms keep-alive is tracked separately so a frame still goes out when the
+## commands have not changed.
+################################################################################
+
+NS_PER_MS = 1000000
+NS_PER_S = 1000000000
+
+
+class ControlScheduler:
+
+    ############################################################
+    ## @brief  Set up the scheduler
+    ## @param  rateHz - control loop rate
+    ## @param  keepAliveMs - maximum time between transmitted frames
+    ## @param  clock - monotonic nanosecond clock (replaceable for simulation)
+    ## @param  sleep - sleep function taking seconds (replaceable for simulation)
+    ############################################################
+    def __init__(self, rateHz=100, keepAliveMs=50, clock=time.monotonic_ns, sleep=time.sleep):
+        self.periodNs = int(NS_PER_S / rateHz)
+        self.keepAliveNs = int(keepAliveMs * NS_PER_MS)
+        self.clock = clock
+        self.sleep = sleep
+
+        self.nextDeadline = None
+        self.lastSentNs = None
+        self.now = 0
+
+        # Statistics
+        self.cycles = 0
+        self.overruns = 0
+        self.jitterNs = 0        # lateness of the most recent cycle
+        self.maxJitterNs = 0
+        self.totalJitterNs = 0
+
+    ############################################################
+    ## @brief  Block until the next cycle deadline
+    ## @return the monotonic time (ns) at which the cycle starts
+    ############################################################
+    def waitNextCycle(self):
+        remaining = self.remainingNs()
+        if remaining > 0:
+            self.sleep(remaining / float(NS_PER_S))
+        return self.startCycle()
+
+    ############################################################
+    ## @brief  Time left until the next cycle deadline
+    ## @return nanoseconds to wait (zero or negative if the deadline has passed)
+    ############################################################
+    def remainingNs(self):
+        now = self.clock()
+        if self.nextDeadline is None:
+            self.nextDeadline = now
+        return self.nextDeadline - now
+
+    ############################################################
+    ## @brief  Start a cycle once its deadline has been reached
+    ## @return the monotonic time (ns) at which the cycle starts
+    ############################################################
+    def startCycle(self):
+
+        now = self.clock()
+        if self.nextDeadline is None:
+            self.nextDeadline = now
+
+        # How late this cycle started relative to its deadline
+        late = now - self.nextDeadline
+        if late < 0:
+            late = 0
+        self.jitterNs = late
+        self.totalJitterNs += late
+        if late > self.maxJitterNs:
+            self.maxJitterNs = late
+
+        # Advance on the fixed grid; resync if we have missed whole periods
+        self.nextDeadline += self.periodNs
+        if now >= self.nextDeadline:
+            missed = (now - self.nextDeadline) // self.periodNs + 1
+            self.overruns += missed
+            self.nextDeadline += missed * self.periodNs
+
+        self.cycles += 1
+        self.now = now
+        return now
+
+    ############################################################
+    ## @brief  Check whether the keep-alive interval has elapsed
+    ## @return true if a frame must be sent even though nothing changed
+    ############################################################
+    def keepAliveDue(self):
+        return self.lastSentNs is None or self.now - self.lastSentNs > self.keepAliveNs
+
+    ############################################################
+    ## @brief  Record that a frame was transmitted this cycle
+    ############################################################
+    def markSent(self):
+        self.lastSentNs = self.now
+
+    ############################################################
+    ## @brief  One-line summary of the timing statistics
+    ############################################################
+    def summary(self):
+        if self.cycles > 0:
+            meanUs = self.totalJitterNs / float(self.cycles) / 1000.0
+        else:
+            meanUs = 0.0
+        return "cycles: {}, overruns: {}, jitter mean: {:.1f}us, max: {:.1f}us".format(
+            self.cycles, self.overruns, meanUs, self.maxJitterNs / 1000.0)
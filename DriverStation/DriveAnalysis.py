@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+import inspect
+import os
+import sys
+import time
+
+import numpy as np
+
+import DriveCurves
+
+################################################################################
+## Vectorized analysis of the arcade drive mapping
+##
+## Evaluates arcadeDrive() -- deadband, exponential curves, gearbox base
+## commands, scale-back -- followed by CommandPipeline's 255 - x inversion over
+## a dense (y, r) grid with NumPy, in one pass. The grid lies on the
+## joystick's 16-bit steps and is symmetric around zero, so mirrored points are
+## exact.
+##
+## Reports:
+##   saturation     points where the scale-back engaged or a motor is at full command
+##   monotonicity   left/right commands that move against the stick along y or r
+##   reserved       sent bytes (after the inversion) that are reserved values
+##                  123-126, or 255 (v1 frames containing 255 are dropped by the
+##                  firmware)
+##   asymmetry      left(y, r) vs right(y, -r), and forward vs reverse
+##
+## Every run checks the vectorized results against the scalar implementation:
+## DriveCurves.expCurve()/mixArcade() (and DriverStation.arcadeDrive() when the
+## constants are the defaults), on both axes in full and on random grid points.
+##
+## --out DIR writes heatmaps (PNG, through pygame.surfarray), a coarse command
+## table (CSV) and the report.
+##
+## Usage: python DriveAnalysis.py [--grid N] [--samples N] [--out DIR]
+##                                [--y-exp X] [--y-endpoint N] [--r-exp X] [--r-endpoint N]
+##                                [--deadband X] [--left-base N] [--right-base N]
+################################################################################
+
+GRID_SIZE = 1001            # points per axis (1001 x 1001 ~ one million)
+VERIFY_SAMPLES = 20000      # random grid points checked against the scalar code
+TABLE_SIZE = 21             # points per axis in the exported CSV table
+EXAMPLES = 5                # example coordinates printed per finding
+
+RESERVED_VALUES = (123, 124, 125, 126)
+INVALID_VALUE = 255
+
+# Drive constants that can be changed from the command line, with the CurveTables defaults
+PARAMETERS = ['yExpConst', 'yEndpoint', 'rExpConst', 'rEndpoint', 'deadband', 'leftMtrBaseCmd', 'rightMtrBaseCmd']
+OPTIONS = {'--y-exp': 'yExpConst', '--y-endpoint': 'yEndpoint', '--r-exp': 'rExpConst',
+           '--r-endpoint': 'rEndpoint', '--deadband': 'deadband', '--left-base': 'leftMtrBaseCmd',
+           '--right-base': 'rightMtrBaseCmd'}
+
+
+def defaultParameters():
+    signature = inspect.signature(DriveCurves.CurveTables.__init__)
+    return {name: signature.parameters[name].default for name in PARAMETERS}
+
+
+############################################################
+## @brief  Symmetric grid of joystick values on the 16-bit joystick steps
+## @return float64 array of n values from -1.0 to 1.0
+############################################################
+def axisGrid(n):
+    steps = np.round(np.linspace(-DriveCurves.AXIS_STEPS, DriveCurves.AXIS_STEPS, n)).astype(np.int64)
+    return steps / float(DriveCurves.AXIS_STEPS)
+
+
+############################################################
+## @brief  Vectorized DriveCurves.expCurve()
+############################################################
+def expCurve(values, deadband, expConst, endpoint):
+    neg = np.where(values < 0, -1.0, 1.0)
+    magnitude = np.where(np.abs(values) < deadband, 0.0, np.abs(values))
+    curve = neg * (np.power(np.e, np.power(magnitude, expConst) / DriveCurves.END_EXP_CONST) - 1) * endpoint
+    return np.trunc(curve).astype(np.int64)
+
+
+############################################################
+## @brief  Vectorized DriveCurves.mixArcade() over the outer product of the commands
+## @param  yCmd, rCmd - 1D arrays of curve outputs
+## @param  params - dict of the PARAMETERS
+## @return (left, right, scaled) 2D arrays indexed [y, r]; left/right are
+##         127-based, before the inversion
+############################################################
+def mixGrid(yCmd, rCmd, params):
+    # The commands are small integers, so float64 holds them exactly and the
+    # scale-back does the same floating point operations as mixArcade()
+    yCmd = yCmd.astype(np.float64)[:, None]
+    rCmd = rCmd.astype(np.float64)[None, :]
+
+    left = yCmd + rCmd
+    right = yCmd - rCmd
+    left += np.sign(left) * params['leftMtrBaseCmd']
+    right += np.sign(right) * params['rightMtrBaseCmd']
+
+    maxCommand = DriveCurves.CMD_RANGE
+    minCommand = -DriveCurves.CMD_RANGE
+    maxMtr = np.maximum(left, right)
+    minMtr = np.minimum(left, right)
+    scaled = (maxMtr > maxCommand) | (minMtr < minCommand)
+    with np.errstate(divide='ignore'):
+        scale = np.where(maxMtr > np.abs(minMtr), float(maxCommand) / maxMtr, float(minCommand) / minMtr)
+    scale[~scaled] = 1.0
+
+    zero = DriveCurves.ZERO_COMMAND
+    return (np.trunc(left * scale + zero).astype(np.int16),
+            np.trunc(right * scale + zero).astype(np.int16),
+            scaled)
+
+
+############################################################
+## @brief  Vectorized arcadeDrive() over the outer product of y and r
+## @param  y, r - 1D arrays of joystick values
+## @param  params - dict of the PARAMETERS
+## @return dict of 2D arrays indexed [y, r]: left/right (127-based, before the
+##         inversion) and scaled (bool, the scale-back engaged)
+############################################################
+def evaluateGrid(y, r, params):
+    yCmd = expCurve(y, params['deadband'], params['yExpConst'], params['yEndpoint'])
+    rCmd = expCurve(r, params['deadband'], params['rExpConst'], params['rEndpoint'])
+
+    # The curves only have a few hundred distinct outputs: mix those, then
+    # gather the grid from the small table, rows first (much faster than np.ix_)
+    (yValues, yIndex) = np.unique(yCmd, return_inverse=True)
+    (rValues, rIndex) = np.unique(rCmd, return_inverse=True)
+    (left, right, scaled) = mixGrid(yValues, rValues, params)
+    return {'left': left[yIndex][:, rIndex], 'right': right[yIndex][:, rIndex], 'scaled': scaled[yIndex][:, rIndex]}
+
+
+############################################################
+## @brief  Scalar reference for one point
+############################################################
+def scalarDrive(yIn, rIn, params):
+    yCmd = DriveCurves.expCurve(yIn, params['deadband'], params['yExpConst'], params['yEndpoint'])
+    rCmd = DriveCurves.expCurve(rIn, params['deadband'], params['rExpConst'], params['rEndpoint'])
+    return DriveCurves.mixArcade(yCmd, rCmd, params['leftMtrBaseCmd'], params['rightMtrBaseCmd'])
+
+
+############################################################
+## @brief  Check the vectorized evaluation against the scalar implementation
+## @return (points checked, list of (yIn, rIn, expected, actual) mismatches)
+############################################################
+def verify(params, y, r, result, samples, seed=0):
+    references = [scalarDrive]
+    if params == defaultParameters():
+        import DriverStation
+
+        def production(yIn, rIn, params):
+            cmds = DriverStation.arcadeDrive(yIn, rIn)
+            return (cmds['left'], cmds['right'])
+        references.append(production)
+
+    mismatches = []
+    checked = 0
+
+    # Each axis in full, with the other one centered
+    axis = np.arange(DriveCurves.AXIS_TABLE_SIZE) / float(DriveCurves.AXIS_STEPS) - 1.0
+    zero = np.zeros(1)
+    for (ys, rs) in ((axis, zero), (zero, axis)):
+        full = evaluateGrid(ys, rs, params)
+        left = full['left'].ravel()
+        right = full['right'].ravel()
+        for (i, (yIn, rIn)) in enumerate(zip(np.broadcast_to(ys, left.shape), np.broadcast_to(rs, left.shape))):
+            actual = (int(left[i]), int(right[i]))
+            for reference in references:
+                expected = reference(float(yIn), float(rIn), params)
+                checked += 1
+                if expected != actual:
+                    mismatches.append((float(yIn), float(rIn), expected, actual))
+
+    # Random points of the analysed grid
+    rng = np.random.default_rng(seed)
+    for (yi, ri) in zip(rng.integers(0, len(y), samples), rng.integers(0, len(r), samples)):
+        actual = (int(result['left'][yi, ri]), int(result['right'][yi, ri]))
+        for reference in references:
+            expected = reference(float(y[yi]), float(r[ri]), params)
+            checked += 1
+            if expected != actual:
+                mismatches.append((float(y[yi]), float(r[ri]), expected, actual))
+
+    return (checked, mismatches)
+
+
+def examples(mask, y, r):
+    (yi, ri) = np.nonzero(mask)
+    return ["({:+.3f}, {:+.3f})".format(y[a], r[b]) for (a, b) in zip(yi[:EXAMPLES], ri[:EXAMPLES])]
+
+
+def percent(count, total):
+    return "{} ({:.2f}%)".format(count, 100.0 * count / total)
+
+
+############################################################
+## @brief  Run all the checks on an evaluated grid
+## @return list of report lines
+############################################################
+def analyse(y, r, result):
+    lines = []
+    total = result['left'].size
+    left = result['left']
+    right = result['right']
+
+    # Saturation
+    full = (np.abs(left - DriveCurves.ZERO_COMMAND) >= DriveCurves.CMD_RANGE) | \
+           (np.abs(right - DriveCurves.ZERO_COMMAND) >= DriveCurves.CMD_RANGE)
+    lines.append("Saturation: scale-back engaged at {}, a motor at full command at {}".format(
+        percent(int(result['scaled'].sum()), total), percent(int(full.sum()), total)))
+    center = int(np.argmin(np.abs(r)))
+    forward = np.nonzero(full[:, center] & (y > 0))[0]
+    if len(forward):
+        lines.append("  straight ahead reaches full command from y = {:+.3f}".format(y[forward[0]]))
+    turning = np.nonzero(result['scaled'][int(np.argmin(np.abs(y))), :])[0]
+    if len(turning):
+        lines.append("  turning in place scales back beyond |r| = {:.3f}".format(np.min(np.abs(r[turning]))))
+
+    # Monotonicity: both motors follow y; left follows r, right opposes it
+    checks = [('left decreases as y increases', np.diff(left, axis=0) < 0, 0),
+              ('right decreases as y increases', np.diff(right, axis=0) < 0, 0),
+              ('left decreases as r increases', np.diff(left, axis=1) < 0, 1),
+              ('right increases as r increases', np.diff(right, axis=1) > 0, 1)]
+    found = []
+    for (name, mask, axis) in checks:
+        count = int(mask.sum())
+        if count:
+            ys = y[:-1] if axis == 0 else y
+            rs = r[:-1] if axis == 1 else r
+            found.append("  {}: {} steps, e.g. at (y, r) {}".format(name, count, " ".join(examples(mask, ys, rs))))
+    lines.append("Monotonicity violations: {}".format(sum(int(c[1].sum()) for c in checks)))
+    lines += found
+
+    # Reserved values in the bytes that are sent (255 - x)
+    sentLeft = 255 - left
+    sentRight = 255 - right
+    lines.append("Reserved/invalid bytes sent (after 255 - x):")
+    for value in RESERVED_VALUES + (INVALID_VALUE,):
+        mask = (sentLeft == value) | (sentRight == value)
+        count = int(mask.sum())
+        if count:
+            lines.append("  {}{}: {}, e.g. at (y, r) {}".format(
+                value, " (invalid, v1 frame dropped)" if value == INVALID_VALUE else "",
+                percent(count, total), " ".join(examples(mask, y, r))))
+    both = (sentLeft == RESERVED_VALUES[-1]) & (sentRight == RESERVED_VALUES[-1])
+    lines.append("  left and right both {} (v1 PID setup header if the arm is too): {}".format(
+        RESERVED_VALUES[-1], percent(int(both.sum()), total)))
+
+    # Asymmetry (the grid is symmetric, so mirroring is reversing): turning left
+    # vs right swaps the motors, driving backwards negates both commands
+    zero = 2 * DriveCurves.ZERO_COMMAND
+    turnAsym = left - right[:, ::-1]
+    driveAsymL = left + left[::-1, ::-1] - zero
+    driveAsymR = right + right[::-1, ::-1] - zero
+    lines.append("Asymmetry: left(y, r) - right(y, -r) max {} mean {:.2f}; forward vs reverse "
+                 "max {} (left) {} (right)".format(int(np.abs(turnAsym).max()), float(np.abs(turnAsym).mean()),
+                                                   int(np.abs(driveAsymL).max()), int(np.abs(driveAsymR).max())))
+    return lines
+
+
+############################################################
+## @brief  Map a 2D array onto RGB: blue below `center`, white at it, red above
+############################################################
+def colorize(values, low, center, high):
+    values = values.astype(np.float64)
+    rgb = np.full(values.shape + (3,), 255.0)
+    below = np.clip((center - values) / max(center - low, 1e-9), 0.0, 1.0)
+    above = np.clip((values - center) / max(high - center, 1e-9), 0.0, 1.0)
+    rgb[..., 0] -= 255.0 * below
+    rgb[..., 1] -= 255.0 * np.maximum(below, above)
+    rgb[..., 2] -= 255.0 * above
+    return rgb.astype(np.uint8)
+
+
+############################################################
+## @brief  Write the heatmaps, the coarse table and the report
+############################################################
+def export(outDir, y, r, result, lines):
+    import pygame
+
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+
+    left = 255 - result['left']
+    right = 255 - result['right']
+    reserved = np.isin(left, RESERVED_VALUES + (INVALID_VALUE,)) | np.isin(right, RESERVED_VALUES + (INVALID_VALUE,))
+    maps = {'left_sent': colorize(left, 0, 127, 255),
+            'right_sent': colorize(right, 0, 127, 255),
+            'scaled': colorize(result['scaled'], 0, 0, 1),
+            'reserved': colorize(reserved, 0, 0, 1),
+            'asymmetry': colorize(result['left'] - result['right'][:, ::-1], -10, 0, 10)}
+    for (name, rgb) in maps.items():
+        # surfarray is indexed [x, y]: r across, y up
+        surface = pygame.surfarray.make_surface(np.ascontiguousarray(rgb[::-1, :, :].transpose(1, 0, 2)))
+        pygame.image.save(surface, os.path.join(outDir, name + '.png'))
+
+    picks = np.round(np.linspace(0, len(y) - 1, TABLE_SIZE)).astype(np.int64)
+    pickr = np.round(np.linspace(0, len(r) - 1, TABLE_SIZE)).astype(np.int64)
+    for (name, sent) in (('left', left), ('right', right)):
+        table = np.zeros((TABLE_SIZE + 1, TABLE_SIZE + 1))
+        table[0, 1:] = r[pickr]
+        table[1:, 0] = y[picks]
+        table[1:, 1:] = sent[np.ix_(picks, pickr)]
+        np.savetxt(os.path.join(outDir, name + '_sent.csv'), table, delimiter=',', fmt='%.4g',
+                   header='rows: y, columns: r, values: byte sent for the ' + name + ' motor')
+
+    with open(os.path.join(outDir, 'report.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def main():
+
+    args = sys.argv[1:]
+
+    def option(name, default=None):
+        if name in args:
+            return args[args.index(name) + 1]
+        return default
+
+    params = defaultParameters()
+    for (name, key) in OPTIONS.items():
+        if option(name) is not None:
+            params[key] = type(params[key])(option(name))
+
+    gridSize = int(option('--grid', GRID_SIZE))
+    y = axisGrid(gridSize)
+    r = axisGrid(gridSize)
+
+    start = time.perf_counter()
+    result = evaluateGrid(y, r, params)
+    evalMs = (time.perf_counter() - start) * 1000.0
+
+    lines = ["Constants: " + ", ".join("{}={}".format(k, params[k]) for k in PARAMETERS),
+             "Evaluated {}x{} = {} points in {:.1f}ms".format(gridSize, gridSize, gridSize * gridSize, evalMs)]
+    lines += analyse(y, r, result)
+
+    (checked, mismatches) = verify(params, y, r, result, int(option('--samples', VERIFY_SAMPLES)))
+    lines.append("Verified against the scalar implementation: {} comparisons, {} mismatches".format(
+        checked, len(mismatches)))
+    for (yIn, rIn, expected, actual) in mismatches[:EXAMPLES]:
+        lines.append("  (y, r) = ({!r}, {!r}): scalar {} vectorized {}".format(yIn, rIn, expected, actual))
+
+    print('\n'.join(lines))
+    if option('--out') is not None:
+        export(option('--out'), y, r, result, lines)
+        print("Heatmaps, tables and report written to", option('--out'))
+
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
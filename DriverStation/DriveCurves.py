@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+import math
+
+################################################################################
+## Precomputed drive/arm curves
+##
+## arcadeDrive() and manualArmDrive() in DriverStation.py evaluate two
+## exponentials per axis on every pass of the control loop. The joystick only
+## ever reports a 16-bit value per axis (SDL reports -32768..32767 and pygame
+## divides by 32768.0), so every possible output can be computed once up front.
+##
+## The tables are built in three pieces:
+##   - one table per axis curve (y, r, arm), indexed by the quantized joystick
+##     value, holding the zero-based command for that axis
+##   - one mix table indexed by (yCmd, rCmd) holding the final (left, right)
+##     pair, so the base-command offsets and the scale-back step are also free
+##
+## The math below is a copy of arcadeDrive()/manualArmDrive() with the tuning
+## constants turned into parameters. Results match the scalar functions bit for
+## bit for every value the joystick can produce. Inputs that are not on the
+## joystick grid are rounded to the nearest grid step.
+################################################################################
+
+# Number of joystick steps per 1.0 of axis travel (pygame: value / 32768.0)
+AXIS_STEPS = 32768
+
+# Table size: -1.0 .. +1.0 inclusive (+1.0 shows up when an axis is negated)
+AXIS_TABLE_SIZE = 2 * AXIS_STEPS + 1
+
+# Output command range constants (same as arcadeDrive/manualArmDrive)
+ZERO_COMMAND = 127
+CMD_RANGE = 127
+
+# Don't change this unless you've really looked over the math
+END_EXP_CONST = 1.44
+
+
+############################################################
+## @brief  Convert a table index back into the joystick value it represents
+## @param  index - table index from 0 to AXIS_TABLE_SIZE - 1
+## @return the joystick value from -1.0 to 1.0
+############################################################
+def axisValue(index):
+    return (index - AXIS_STEPS) / float(AXIS_STEPS)
+
+
+############################################################
+## @brief  Convert a joystick value into a table index
+## @param  value - joystick value from -1.0 to 1.0
+## @return the table index
+############################################################
+def axisIndex(value):
+    return int(value * float(AXIS_STEPS) + (AXIS_STEPS + 0.5))
+
+
+############################################################
+## @brief  Zero-based exponential curve for one axis
+## @param  value - raw joystick input from -1.0 to 1.0
+## @param  deadband - raw inputs smaller than this are treated as zero
+## @param  expConst - exponential growth coefficient
+## @param  endpoint - maximum/minimum (+/-) output
+## @return the zero-based command for this axis
+############################################################
+def expCurve(value, deadband, expConst, endpoint):
+
+    # Save the negative-ness, which will be re-applied after the exponential function is applied
+    if value < 0:
+        neg = -1
+    else:
+        neg = 1
+
+    # Apply a deadband
+    if abs(value) < deadband:
+        value = 0
+
+    return int(neg*(math.pow(math.e, math.pow(math.fabs(value), expConst)/END_EXP_CONST)-1)*endpoint)
+
+
+############################################################
+## @brief  Mix zero-based y/r commands into final arcade motor commands
+## @param  yCmd - zero-based translation command
+## @param  rCmd - zero-based rotation command
+## @param  leftMtrBaseCmd - offset to overcome the left gearbox resistance
+## @param  rightMtrBaseCmd - offset to overcome the right gearbox resistance
+## @return (left motor command, right motor command), 127-based
+############################################################
+def mixArcade(yCmd, rCmd, leftMtrBaseCmd, rightMtrBaseCmd):
+
+    maxCommand = CMD_RANGE
+    minCommand = -CMD_RANGE
+
+    # Convert the drive commands into motor comands (zero-based)
+    leftMtrCmd = yCmd + rCmd
+    rightMtrCmd = yCmd - rCmd
+
+    # Add an offset for the minimum command to overcome the gearboxes
+    if leftMtrCmd > 0:
+        leftMtrCmd = leftMtrCmd + leftMtrBaseCmd
+    elif leftMtrCmd < 0:
+        leftMtrCmd = leftMtrCmd - leftMtrBaseCmd
+    if rightMtrCmd > 0:
+        rightMtrCmd = rightMtrCmd + rightMtrBaseCmd
+    elif rightMtrCmd < 0:
+        rightMtrCmd = rightMtrCmd - rightMtrBaseCmd
+
+    # If the commands are greater than the maximum or less than the minimum, scale them back
+    maxMtrCmd = max(leftMtrCmd, rightMtrCmd)
+    minMtrCmd = min(leftMtrCmd, rightMtrCmd)
+    scaleFactor = 1.0
+    if maxMtrCmd > maxCommand or minMtrCmd < minCommand:
+        if maxMtrCmd > abs(minMtrCmd):
+            scaleFactor = float(maxCommand) / float(maxMtrCmd)
+        else:
+            scaleFactor = float(minCommand) / float(minMtrCmd)
+
+    # Shift the commands to be based on the zero command
+    return (int(leftMtrCmd * scaleFactor + ZERO_COMMAND), int(rightMtrCmd * scaleFactor + ZERO_COMMAND))
+
+
+############################################################
+## @brief  Final manual arm command for a zero-based arm curve value
+## @param  aCmd - zero-based arm command
+## @param  baseCmd - offset to overcome the gearbox resistance
+## @return the 127-based arm command
+############################################################
+def finishArm(aCmd, baseCmd):
+
+    # Add an offset for the minimum command to overcome the gearboxes
+    if aCmd > 0:
+        aCmd = aCmd + baseCmd
+    elif aCmd < 0:
+        aCmd = aCmd - baseCmd
+
+    # If the command is greater than the maximum or less than the minimum, scale it back
+    if aCmd > CMD_RANGE:
+        aCmd = CMD_RANGE
+    elif aCmd < -CMD_RANGE:
+        aCmd = -CMD_RANGE
+
+    return aCmd + ZERO_COMMAND
+
+
+################################################################################
+## @brief  Lookup tables for the drive and arm curves
+##
+## Build once at startup, then call drive()/arm() from the control loop. The
+## defaults are the values hard-coded in arcadeDrive() and manualArmDrive().
+################################################################################
+class CurveTables:
+
+    def __init__(self,
+                 yExpConst=1.5, yEndpoint=127,
+                 rExpConst=1.5, rEndpoint=70,
+                 deadband=0.10,
+                 leftMtrBaseCmd=2, rightMtrBaseCmd=3,
+                 armExpConst=1.5, armEndpoint=127,
+                 armDeadband=0.0, armBaseCmd=5):
+
+        yCmds = [expCurve(axisValue(i), deadband, yExpConst, yEndpoint) for i in range(AXIS_TABLE_SIZE)]
+        rCmds = [expCurve(axisValue(i), deadband, rExpConst, rEndpoint) for i in range(AXIS_TABLE_SIZE)]
+
+        # Mix table covers every (yCmd, rCmd) pair the axis tables can produce
+        yMin = min(yCmds)
+        rMin = min(rCmds)
+        width = max(rCmds) - rMin + 1
+        height = max(yCmds) - yMin + 1
+
+        # Store each axis as an offset into the flattened mix table so a lookup is a single add
+        self.yIndex = [(y - yMin) * width for y in yCmds]
+        self.rIndex = [r - rMin for r in rCmds]
+        self.mix = [mixArcade(yMin + row, rMin + col, leftMtrBaseCmd, rightMtrBaseCmd)
+                    for row in range(height) for col in range(width)]
+
+        self.armCmds = [finishArm(expCurve(axisValue(i), armDeadband, armExpConst, armEndpoint), armBaseCmd)
+                        for i in range(AXIS_TABLE_SIZE)]
+
+    ############################################################
+    ## @brief  Table version of arcadeDrive()
+    ## @param  yIn - raw joystick input from -1.0 to 1.0 for the Y-axis translation
+    ## @param  rIn - raw joystick input from -1.0 to 1.0 for the rotation
+    ## @return (left motor command, right motor command) -- shared, do not modify
+    ############################################################
+    def drive(self, yIn, rIn):
+        return self.mix[self.yIndex[int(yIn * 32768.0 + 32768.5)] + self.rIndex[int(rIn * 32768.0 + 32768.5)]]
+
+    ############################################################
+    ## @brief  Table version of manualArmDrive()
+    ## @param  aIn - raw input from -1.0 to 1.0
+    ## @return the arm command
+    ############################################################
+    def arm(self, aIn):
+        return self.armCmds[int(aIn * 32768.0 + 32768.5)]
+
+
+############################################################
+## @brief  Compare the tables against the scalar functions
+## @param  tables - CurveTables built with the same constants as the functions
+## @param  arcadeDriveFn - reference arcadeDrive(yIn, rIn) returning {'left', 'right'}
+## @param  manualArmDriveFn - reference manualArmDrive(aIn)
+## @param  stride - step between 2D (y, r) samples; every 1D value is always checked
+## @return list of (yIn, rIn, expected, actual) mismatches, empty if none
+############################################################
+def verifyCurveTables(tables, arcadeDriveFn, manualArmDriveFn, stride=64):
+
+    mismatches = []
+
+    for i in range(AXIS_TABLE_SIZE):
+        value = axisValue(i)
+
+        expected = manualArmDriveFn(value)
+        actual = tables.arm(value)
+        if expected != actual:
+            mismatches.append((value, None, expected, actual))
+
+        for (yIn, rIn) in ((value, 0.0), (0.0, value)):
+            expectedCmds = arcadeDriveFn(yIn, rIn)
+            expected = (expectedCmds['left'], expectedCmds['right'])
+            actual = tables.drive(yIn, rIn)
+            if expected != actual:
+                mismatches.append((yIn, rIn, expected, actual))
+
+    for yi in range(0, AXIS_TABLE_SIZE, stride):
+        yIn = axisValue(yi)
+        for ri in range(0, AXIS_TABLE_SIZE, stride):
+            rIn = axisValue(ri)
+            expectedCmds = arcadeDriveFn(yIn, rIn)
+            expected = (expectedCmds['left'], expectedCmds['right'])
+            actual = tables.drive(yIn, rIn)
+            if expected != actual:
+                mismatches.append((yIn, rIn, expected, actual))
+
+    return mismatches
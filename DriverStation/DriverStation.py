@@ -1,19 +1,41 @@
 #!/usr/bin/env python
 
+import time
+START_NS = time.monotonic_ns()  # Cold start, for the time-to-first-frame report
+
 from enum import Enum
 import pygame
-import time
 import os
 import serial
 import array
 import sys
 import math
+import DriveCurves
+import FrameEncoder
+import LinkProtocol
+import LinkBudget
+import ControlScheduler
+import GamepadInput
+import SerialWriter
+import SerialLink
+import FlightRecorder
+import StageMetrics
+import Telemetry
+import ControlBus
+import StationLog
+import LoopProfiler
+import InputConditioning
+import TuningProfile
 
 # To check what serial ports are available in Linux, use the bash command: dmesg | grep tty
 # To check what serial ports are available in Windows, use the cmd command: wmic path Win32_SerialPort
 #    OR go to Device Manager > Ports (COM & LPT)
 comPort = 'COM5'
-ser = serial.Serial(comPort, 57600, timeout=1)
+ser = None     # SerialLink opened by main() with openLink()
+writer = None  # Transmit thread that owns ser while main() is running
+recorder = None  # Flight recorder for the transmitted frames (see FLIGHT_RECORDER_DIR)
+bus = None       # Shared-memory state published for dashboards (see CONTROL_BUS_NAME)
+log = None       # Background console/file log for the control loop (see StationLog.py)
 
 ### CONTROL SCHEME ###
 # Drive:
@@ -70,154 +92,694 @@ RESERVED_VALUE_ENTER_ARM_MANUAL = 125
 RESERVED_VALUE_RESET_ARM_POS = 123
 RESERVED_VALUE_SET_PID_GAINS = 126
 
-# Set the number of times to transmit each mode change message
+# Set the number of times to transmit each mode change message (protocol v1 only; v2 resends until ACKed)
 RESEND_COUNT_MODE_CHANGE = 3
 
+# Offer the v2 link protocol (sequence numbers, CRC, command channel) to the robot at startup,
+# falling back to v1 if it does not answer. Set to LinkProtocol.PROTOCOL_V1 to skip the offer.
+LINK_PROTOCOL = LinkProtocol.PROTOCOL_V2
+
+# Extra input conditioning around the drive/arm curve tables (see InputConditioning.py), one stage list per channel:
+# raw axes 'y', 'r', 'arm'; commands 'left', 'right', 'armOut'. E.g. {'y': [('ema', 0.5)], 'left': [('slew', 20, 127)]}.
+# Empty = the tables alone (no extra cost in the loop).
+CONDITIONING = {}
+
+# Tuning profile (see profile.example.ini): overrides the button ids, arm presets, PID gains, curve constants and
+# conditioning above. It is reloaded while the loop runs whenever it is saved; the new values take effect between
+# two cycles. None = use the values in this file.
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profile.ini')
+
+# Set the control loop timing
+CONTROL_LOOP_RATE_HZ = 100  # How often the gamepad is sampled and commands are computed
+KEEP_ALIVE_MS = 50          # Resend the last command at least this often (robot fails safe after 250ms)
+
+# Serial link speed, and whether to throttle small command changes as the link fills up (see LinkBudget.py).
+# Keep-alives, mode changes and returns to neutral are never throttled.
+SERIAL_BAUD = 57600
+ADAPTIVE_RATE = True
+
+# Use another serial port that looks like the XBee when comPort is not present (see SerialLink.py). A lost port
+# (adapter reset/unplugged) is reopened automatically and the robot zeroed right after.
+SERIAL_AUTO_DISCOVER = True
+SERIAL_DISCOVER_ANY_USB = False  # Also fall back to USB serial adapters that do not look like an XBee
+
+# Print the robot's latest telemetry (arm encoder/setpoint/output, failsafe, link round-trip time) this often,
+# 0 = only the summary at exit. Robots without telemetry in their firmware just show "no telemetry".
+TELEMETRY_STATUS_S = 1.0
+
+# Shared memory block the loop state is published to every cycle (read it with ControlBus.py), or None to disable
+CONTROL_BUS_NAME = 'battlebirkelbot'
+
+# Transmitted frames are logged in the background, one line per this many seconds ("Sent N frames ..., last L/R/A"),
+# 0 = a line for every frame. LOG_FILE also appends the log to a file (None = console only).
+LOG_FRAME_SUMMARY_S = 1.0
+LOG_FILE = None
+
+# Loop instrumentation: print a per-stage latency summary this often (0 = only on SIGUSR1/Ctrl-Break and exit)
+METRICS_SUMMARY_S = 0
+METRICS_DUMP_FILE = 'loop_metrics.txt'  # Written with each summary and on exit
+
+# On-demand profiling of the running loop (see LoopProfiler.py): SIGUSR2 or 's' + Enter toggles the sampling
+# profiler, 'c' + Enter captures LoopProfiler.CAPTURE_CYCLES cycles with cProfile. Output goes to this directory.
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+# Directory for the flight recorder files (one per run, read with FlightRecorder.py), or None to disable
+FLIGHT_RECORDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings')
+
+############################################################
+## @return the PID gain strings in the order the setup packet carries them
+############################################################
+def pidGains():
+    return (PID_P_GAIN, PID_I_GAIN, PID_D_GAIN, ARM_SCALE_FACTOR)
+
+
+############################################################
+## @return the settings a tuning profile can override, as set in this file (see TuningProfile.py)
+############################################################
+def profileDefaults():
+    return {'armAutoButtons': tuple(BUTTON_IDS_ARM_AUTO),
+            'exitAutoButton': BUTTON_ID_EXIT_AUTO,
+            'resetArmPosButton': BUTTON_ID_RESET_ARM_POS,
+            'sendPidGainsButton': BUTTON_ID_SEND_PID_GAINS,
+            'stopProgramButton': BUTTON_ID_STOP_PROGRAM,
+            'armManualAxis': AXIS_ID_ARM_MANUAL,
+            'armPosDown': ARM_POS_DOWN,
+            'armPosOverBumps': ARM_POS_OVER_BUMPS,
+            'armPosUp': ARM_POS_UP,
+            'pidMode': PID_ERROR_OR_MEASUREMENT,
+            'pidP': PID_P_GAIN,
+            'pidI': PID_I_GAIN,
+            'pidD': PID_D_GAIN,
+            'armScaleFactor': ARM_SCALE_FACTOR,
+            'conditioning': CONDITIONING}
+
+
+# Frame buffers for the serial link (the PID setup packet is built once from the gains above)
+encoder = FrameEncoder.FrameEncoder(PID_ERROR_OR_MEASUREMENT, pidGains())
+
+############################################################
+## @brief Open the serial link to the robot's XBee
+## @return the open serial port
+############################################################
+def openSerialPort():
+    return serial.Serial(comPort, SERIAL_BAUD, timeout=1)
+
+
+############################################################
+## @brief Find and open the XBee's port, waiting for it if it is not plugged in
+## @param  report - function called with status lines
+## @return SerialLink.SerialLink that reconnects by itself
+############################################################
+def openLink(report=print):
+    link = SerialLink.SerialLink(comPort, SERIAL_BAUD, timeout=1, discover=SERIAL_AUTO_DISCOVER,
+                                 report=report, startNs=START_NS, anyUsb=SERIAL_DISCOVER_ANY_USB)
+    if not link.open():
+        if not SERIAL_AUTO_DISCOVER:
+            alternative = ""
+        elif SERIAL_DISCOVER_ANY_USB:
+            alternative = "(or any USB serial port)"
+        else:
+            alternative = "(or any XBee adapter)"
+        print("Waiting for the XBee on", comPort, alternative)
+        link.waitOpen()
+    print("Serial port:", link.port)
+    return link
+
+
 def main():
 
     global ser
+    global writer
+    global recorder
+    global encoder
+    global bus
+    global log
+
+    log = StationLog.StationLog(True, LOG_FILE, LOG_FRAME_SUMMARY_S)
+    log.start()
+
+    # Per-stage latency histograms and link counters (summaries go through the log)
+    metrics = StageMetrics.LoopMetrics(METRICS_SUMMARY_S, METRICS_DUMP_FILE, log.message)
+    metrics.installSignalHandler()
+
+    ser = openLink(log.message)
+    protocol = LinkProtocol.PROTOCOL_V1
+    if LINK_PROTOCOL == LinkProtocol.PROTOCOL_V2:
+        protocol = LinkProtocol.negotiate(ser)
+    if protocol == LinkProtocol.PROTOCOL_V2:
+        encoder = LinkProtocol.FrameEncoderV2(PID_ERROR_OR_MEASUREMENT, pidGains())
+    ser.neutralFrames = encoder.neutral()  # Written first after a reconnect
+    ser.linkReady()  # The first frame is timed from here, after the HELLO exchange
+    print("Robot link: protocol v" + str(protocol))
+
+    # Hand the serial port to the transmit thread
+    writer = SerialWriter.SerialWriter(ser, metrics.histograms[StageMetrics.STAGE_SERIAL])
+    writer.start()
+
+    # Not in the loop until triggered
+    profiler = LoopProfiler.LoopProfiler(metrics, PROFILE_DIR, log.message, writer.thread)
+    profiler.installTriggers()
 
     # Initialize the gamepad
-    pygame.init()
+    GamepadInput.initJoystickOnly()
     joysticks = []
     for i in range(0, pygame.joystick.get_count()):
         joysticks.append(pygame.joystick.Joystick(i))
         joysticks[-1].init()
         print("Detected joystick '",joysticks[-1].get_name(),"'")
 
-    # Local variables
-    prevDriveMtrCmds = {'left':0, 'right':0}
-    prevArmCmd = RESERVED_VALUE_ENTER_ARM_MANUAL
-    prevArmFlags = 0
-    prevTimeSent = 0
-    prevArmMode = ArmMode.MANUAL
-    currArmMode = ArmMode.MANUAL
-    transmitXTimes = RESEND_COUNT_MODE_CHANGE
-    done = False
-    loopCounter = 0
-
+    # Track the first gamepad from its events instead of polling it every cycle
+    GamepadInput.allowJoystickEventsOnly()
+    gamepad = GamepadInput.ControllerState(joysticks[0], report=log.message)
+
+    if FLIGHT_RECORDER_DIR is not None:
+        if not os.path.isdir(FLIGHT_RECORDER_DIR):
+            os.makedirs(FLIGHT_RECORDER_DIR)
+        recordingPath = os.path.join(FLIGHT_RECORDER_DIR, time.strftime("match_%Y%m%d_%H%M%S.bbfr"))
+        recorder = FlightRecorder.FlightRecorder(recordingPath, len(gamepad.axes), len(gamepad.buttons))
+        print("Recording frames to", recordingPath)
+
+    # Precompute the drive/arm curves so the loop only does table lookups; later profile versions are
+    # compiled by the watcher thread and swapped in between cycles
+    profiles = None
+    if PROFILE_FILE is not None:
+        profiles = TuningProfile.ProfileWatcher(PROFILE_FILE, TuningProfile.defaultSettings(profileDefaults()),
+                                                log.message, (len(gamepad.axes), len(gamepad.buttons)))
+        controls = profiles.loadNow()
+        profiles.start()
+        log.message(TuningProfile.describe(controls))
+    rate = LinkBudget.RateController(SERIAL_BAUD) if ADAPTIVE_RATE else None
+    if profiles is not None:
+        pipeline = CommandPipeline(controls.curves, protocol == LinkProtocol.PROTOCOL_V2, rate, controls=controls)
+        encoder.setPidGains(controls.pidMode, controls.pidGains)
+    else:
+        pipeline = CommandPipeline(DriveCurves.CurveTables(), protocol == LinkProtocol.PROTOCOL_V2, rate,
+                                   InputConditioning.build(CONDITIONING))
+    scheduler = ControlScheduler.ControlScheduler(CONTROL_LOOP_RATE_HZ, KEEP_ALIVE_MS)
+
+    # Everything the robot sends back: telemetry, and the command ACKs with protocol v2
+    telemetry = Telemetry.TelemetryReceiver(encoder.ackReceived if protocol == LinkProtocol.PROTOCOL_V2 else None)
+
+    if CONTROL_BUS_NAME is not None:
+        try:
+            bus = ControlBus.ControlBusWriter(CONTROL_BUS_NAME, len(gamepad.axes), len(gamepad.buttons), protocol)
+            print("Publishing the loop state to shared memory '" + CONTROL_BUS_NAME + "'")
+        except FileExistsError as e:
+            # Another driver station is publishing there; leave its bus alone
+            print(e, "-- not publishing the loop state")
+
+    loop = ControlLoop(scheduler, gamepad, pipeline, encoder, ser, writer, metrics, log, telemetry, recorder, bus,
+                       profiles, profiler)
     try:
-        while (done == False):
-
-            pygame.event.pump()  # This line is needed to process the gamepad packets
-
-            if joystickWatchdog(joysticks[0]):
-                sendNeutralCommand()
-                continue
+        while not loop.done:
+            scheduler.waitNextCycle()
+            loop.runCycle()
+    except KeyboardInterrupt:
+        pass
+    cleanup(loop)
 
-            ##### WHEEL COMMANDS #####
 
-            # Get the raw values for drive translation/rotation using the gamepad.
-            yRaw = joysticks[0].get_axis(1)   # Y-axis translation comes from the left joystick Y axis
-            rRaw = -joysticks[0].get_axis(4)  # Rotation comes from the right joystick X axis
+################################################################################
+## @brief  The body of the control loop, shared by main() and SimHarness
+##
+## main() paces it with the real clock and a SerialWriter thread; SimHarness
+## runs the same cycles on a simulated clock with SerialWriter.DirectWriter, so
+## its wire output is what main() would send for the same gamepad input.
+################################################################################
+class ControlLoop:
+
+    ############################################################
+    ## @param  scheduler - ControlScheduler.ControlScheduler (the caller waits for each cycle)
+    ## @param  gamepad - GamepadInput.ControllerState
+    ## @param  pipeline - CommandPipeline
+    ## @param  encoder - FrameEncoder.FrameEncoder or LinkProtocol.FrameEncoderV2
+    ## @param  ser - SerialLink.SerialLink (or a stand-in with the same attributes)
+    ## @param  writer - SerialWriter.SerialWriter or SerialWriter.DirectWriter, already started
+    ## @param  metrics - StageMetrics.LoopMetrics
+    ## @param  log - StationLog.StationLog, already started
+    ## @param  telemetry - Telemetry.TelemetryReceiver, or None to not read from the robot
+    ## @param  recorder - FlightRecorder.FlightRecorder, or None
+    ## @param  bus - ControlBus.ControlBusWriter, or None
+    ## @param  profiles - TuningProfile.ProfileWatcher, or None
+    ## @param  profiler - LoopProfiler.LoopProfiler, or None
+    ## @param  report - function called with the summary lines printed by shutdown()
+    ############################################################
+    def __init__(self, scheduler, gamepad, pipeline, encoder, ser, writer, metrics, log, telemetry=None,
+                 recorder=None, bus=None, profiles=None, profiler=None, report=print):
+        self.scheduler = scheduler
+        self.gamepad = gamepad
+        self.pipeline = pipeline
+        self.encoder = encoder
+        self.ser = ser
+        self.writer = writer
+        self.metrics = metrics
+        self.log = log
+        self.telemetry = telemetry
+        self.recorder = recorder
+        self.bus = bus
+        self.profiles = profiles
+        self.profiler = profiler
+        self.report = report
+        self.rate = pipeline.rateController
+        self.done = False
+
+        self.reconnects = ser.reconnects
+        self.statusPeriodNs = int(TELEMETRY_STATUS_S * ControlScheduler.NS_PER_S)
+        self.nextStatusNs = 0
+
+        # Map to go back to if a hot-swapped profile fails in the loop
+        self.fallbackControls = None
+
+        # Counters
+        self.neutralBursts = 0
+
+    ############################################################
+    ## @brief  Run one control cycle (call after scheduler.waitNextCycle()); sets `done` on stop
+    ############################################################
+    def runCycle(self):
+        scheduler = self.scheduler
+        gamepad = self.gamepad
+        pipeline = self.pipeline
+        encoder = self.encoder
+        ser = self.ser
+        writer = self.writer
+        metrics = self.metrics
+        telemetry = self.telemetry
+        recorder = self.recorder
+        rate = self.rate
+
+        metrics.beginCycle()
+
+        profiles = self.profiles
+        if profiles is not None and profiles.pending is not None:
+            self.swapProfile(profiles.take())  # Compiled by the watcher thread; swapping it in is a few assignments
+
+        gamepad.update()  # Apply the gamepad events received since the last cycle
+        if telemetry is not None:
+            telemetry.poll(ser)  # Non-blocking; only reads what has already arrived
+        if ser.reconnects != self.reconnects:
+            self.reconnects = ser.reconnects
+            encoder.resync()  # v2 delta frames assumed the frames lost with the port arrived
+        if telemetry is not None and self.statusPeriodNs > 0 and scheduler.now >= self.nextStatusNs:
+            self.nextStatusNs = scheduler.now + self.statusPeriodNs
+            self.log.message("Robot -- " + telemetry.status())
+        metrics.endStage(StageMetrics.STAGE_EVENTS)
+
+        if gamepad.watchdogTripped():
+            self.sendNeutral()
+            metrics.watchdogTripped(len(encoder.neutral()))
+            if rate is not None:
+                rate.frameSent(len(encoder.neutral()))
+            if recorder is not None:
+                recorder.record(scheduler.now, gamepad.axes, gamepad.buttons, 127, 127, 127,
+                                ArmMode.MANUAL.value, encoder.neutral())
+            self.publish(True)
+            metrics.endCycle()
+            return
+        metrics.endStage(StageMetrics.STAGE_WATCHDOG)
+
+        if rate is not None:
+            rate.update(ser.out_waiting)  # Bytes still in the driver's transmit buffer
+        try:
+            frame = pipeline.nextFrame(gamepad.axes, gamepad.buttons, scheduler.keepAliveDue(), encoder)
+        except Exception as e:
+            if self.fallbackControls is None:
+                raise
+            self.rollBack(e)
+            frame = pipeline.nextFrame(gamepad.axes, gamepad.buttons, scheduler.keepAliveDue(), encoder)
+        metrics.endStage(StageMetrics.STAGE_COMPUTE)
+
+        if pipeline.stopRequested or gamepad.quitRequested:
+            self.done = True
+            return
+
+        # Only send if the commands changed or if 50ms have elapsed
+        if frame is not None:
+
+            self.log.frame(scheduler.now, pipeline.leftCmd, pipeline.rightCmd, pipeline.armCmd, pipeline.loopCounter)
+            metrics.endStage(StageMetrics.STAGE_PRINT)
+            if writer.error is not None:
+                raise writer.error
+
+            # One write per frame; PID setup frames (126/126/126) carry their payload and checksum.
+            # Reserved arm values (mode changes, zeroing, PID setup) must all reach the robot,
+            # plain drive frames only matter if they are the latest.
+            if pipeline.isReliable():
+                dropped = writer.sendReliable(frame)
+            else:
+                dropped = writer.sendDrive(frame)
+            if dropped:
+                encoder.resync()  # v2 delta frames assumed the dropped frame arrived
+            if telemetry is not None:
+                telemetry.noteSent(pipeline.leftCmd, pipeline.rightCmd, pipeline.armCmd)
+            metrics.frameSent(len(frame), pipeline.isReliable())
+            if rate is not None:
+                rate.frameSent(len(frame))
+            metrics.endStage(StageMetrics.STAGE_WRITE)
+
+            if recorder is not None:
+                recorder.record(scheduler.now, gamepad.axes, gamepad.buttons, pipeline.leftCmd,
+                                pipeline.rightCmd, pipeline.armCmd, pipeline.armMode.value, frame)
+                metrics.endStage(StageMetrics.STAGE_RECORD)
+
+            pipeline.markSent()
+            scheduler.markSent()
+
+        self.publish(False)
+        metrics.endCycle()
+
+    ############################################################
+    ## @brief  Swap in a map compiled by the profile watcher
+    ##
+    ## The map that was running is kept, so one that fails in the loop despite
+    ## TuningProfile.validate() is rolled back instead of stopping the robot.
+    ############################################################
+    def swapProfile(self, controls):
+        previous = self.pipeline.controls
+        try:
+            self.applyControls(controls)
+        except Exception as e:
+            if previous is None:
+                raise
+            self.applyControls(previous)
+            self.profiles.rejected += 1
+            self.log.message("Profile -- v{} could not be applied ({}: {}), keeping v{}".format(
+                controls.version, type(e).__name__, e, previous.version))
+            return
+        self.fallbackControls = previous
+        self.log.message(TuningProfile.describe(controls))
+
+    ############################################################
+    ## @brief  Go back to the map that ran before the current one
+    ## @param  error - exception the current map raised
+    ############################################################
+    def rollBack(self, error):
+        failed = self.pipeline.controls
+        controls = self.fallbackControls
+        self.fallbackControls = None
+        self.applyControls(controls)
+        self.profiles.rejected += 1
+        self.log.message("Profile -- v{} failed in the control loop ({}: {}), back to v{}".format(
+            failed.version, type(error).__name__, error, controls.version))
+
+    def applyControls(self, controls):
+        self.pipeline.applyControlMap(controls)
+        self.encoder.setPidGains(controls.pidMode, controls.pidGains)
+
+    ############################################################
+    ## @brief  Publish this cycle's state on the control bus, if there is one
+    ############################################################
+    def publish(self, watchdogTripped):
+        if self.bus is not None:
+            self.bus.publish(self.scheduler.now, self.gamepad, self.pipeline, watchdogTripped,
+                             self.metrics.framesSent, self.metrics.bytesSent, self.writer.driveDropped,
+                             self.telemetry)
+
+    ############################################################
+    ## @brief  Zero all the commands to the robot:
+    ##         3x "enter arm manual" followed by 3x all-neutral, in a single write
+    ############################################################
+    def sendNeutral(self):
+        self.neutralBursts += 1
+        if self.writer.running:
+            self.writer.sendReliable(self.encoder.neutral(), coalesce=True)
+        else:
+            self.ser.write(self.encoder.neutral())
+
+    ############################################################
+    ## @brief  Stop the helpers, print the run summaries and zero the robot
+    ##
+    ## Leaves the serial port open (the caller owns it).
+    ############################################################
+    def shutdown(self):
+        report = self.report
+        if self.profiles is not None:
+            self.profiles.close()
+        if self.profiler is not None:
+            self.profiler.close()
+        self.metrics.close()
+        self.log.close()
+        report("Loop timing -- " + self.scheduler.summary())
+        if self.rate is not None:
+            report("Link budget -- " + self.rate.summary())
+        if self.telemetry is not None:
+            report("Robot -- " + self.telemetry.summary())
+        report(self.metrics.summary())
+        if self.metrics.dumpPath is not None:
+            self.metrics.dump()
+
+        report("Cleaning up and exiting")
+        self.sendNeutral()
+        self.writer.stop()
+        report("Transmit -- " + self.writer.summary())
+        report("Serial -- " + self.ser.summary())
+        if isinstance(self.encoder, LinkProtocol.FrameEncoderV2):
+            report("Link -- " + self.encoder.summary())
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.bus is not None:
+            self.bus.close()
 
-            # Get the drive motor commands for Arcade Drive
-            driveMtrCmds = arcadeDrive(yRaw, rRaw)
-            driveMtrCmds['left'] = 255 - driveMtrCmds['left']
-            driveMtrCmds['right'] = 255 - driveMtrCmds['right']
 
+################################################################################
+## @brief  Turns gamepad snapshots into robot commands
+##
+## Holds everything that has to survive from one control cycle to the next
+## (arm mode, mode-change resend counter, last transmitted commands), so the
+## same logic can run from main(), the asyncio runtime or a test harness.
+##
+## Mode changes, arm zeroing and PID setup are reported in `command` as their
+## reserved value. With protocol v1 they also replace the arm command (and the
+## motor commands for PID setup) and are repeated RESEND_COUNT_MODE_CHANGE
+## times; with the v2 command channel they are issued once and the motor
+## commands use the full 0-254 range.
+################################################################################
+class CommandPipeline:
+
+    ############################################################
+    ## @param  curves - DriveCurves.CurveTables
+    ## @param  commandChannel - true when the link has a separate command channel (protocol v2)
+    ## @param  rateController - optional LinkBudget.RateController that can hold back small changes
+    ## @param  conditioning - optional InputConditioning.Conditioning run around the curve tables
+    ## @param  controls - optional TuningProfile.ControlMap, replaces curves/conditioning and the constants above
+    ############################################################
+    def __init__(self, curves, commandChannel=False, rateController=None, conditioning=None, controls=None):
+        self.curves = curves
+        self.conditioning = conditioning
+        self.armAutoButtons = tuple(BUTTON_IDS_ARM_AUTO)
+        self.exitAutoButton = BUTTON_ID_EXIT_AUTO
+        self.resetArmPosButton = BUTTON_ID_RESET_ARM_POS
+        self.sendPidGainsButton = BUTTON_ID_SEND_PID_GAINS
+        self.stopProgramButton = BUTTON_ID_STOP_PROGRAM
+        self.armManualAxis = AXIS_ID_ARM_MANUAL
+        self.armPositions = (ARM_POS_DOWN, ARM_POS_OVER_BUMPS, ARM_POS_UP)
+        self.controls = None
+        self.controlVersion = 0
+        if controls is not None:
+            self.applyControlMap(controls)
+        self.commandChannel = commandChannel
+        self.rateController = rateController
+        self.resendCount = 1 if commandChannel else RESEND_COUNT_MODE_CHANGE
+
+        # Commands computed by the most recent compute()
+        self.leftCmd = 127
+        self.rightCmd = 127
+        self.armCmd = 127 if commandChannel else RESERVED_VALUE_ENTER_ARM_MANUAL
+        self.command = RESERVED_VALUE_ENTER_ARM_MANUAL
+        self.armMode = ArmMode.MANUAL
+        self.stopRequested = False
+
+        # State carried between cycles
+        self.prevLeftCmd = 0
+        self.prevRightCmd = 0
+        self.prevArmCmd = self.armCmd
+        self.prevCommand = None
+        self.prevArmMode = ArmMode.MANUAL
+        self.prevCommandButtons = False
+        self.transmitXTimes = self.resendCount
+        self.loopCounter = 0
+
+    ############################################################
+    ## @brief  Switch to another tuning profile (between cycles)
+    ## @param  controls - TuningProfile.ControlMap
+    ##
+    ## Mode, resend counters and the last commands sent are kept; conditioning
+    ## chains with the same stages continue from the running ones' state.
+    ############################################################
+    def applyControlMap(self, controls):
+        if controls.conditioning is not None and self.conditioning is not None and \
+           controls.conditioning is not self.conditioning:
+            controls.conditioning.carryStateFrom(self.conditioning)
+        self.curves = controls.curves
+        self.conditioning = controls.conditioning
+        (self.armAutoButtons, self.exitAutoButton, self.resetArmPosButton, self.sendPidGainsButton,
+         self.stopProgramButton, self.armManualAxis) = controls.buttons
+        self.armPositions = controls.armPositions
+        self.controls = controls
+        self.controlVersion = controls.version
+
+    ############################################################
+    ## @brief  Compute the drive and arm commands for one cycle
+    ## @param  axes - gamepad axis values from -1.0 to 1.0
+    ## @param  buttons - gamepad button states
+    ############################################################
+    def compute(self, axes, buttons):
+
+        curves = self.curves
+        conditioning = self.conditioning
+
+        ##### WHEEL COMMANDS #####
+
+        # Get the raw values for drive translation/rotation using the gamepad.
+        yRaw = axes[1]   # Y-axis translation comes from the left joystick Y axis
+        rRaw = -axes[4]  # Rotation comes from the right joystick X axis
+        if conditioning is not None:
+            yRaw = conditioning.y(yRaw)
+            rRaw = conditioning.r(rRaw)
+
+        # Get the drive motor commands for Arcade Drive (table version of arcadeDrive)
+        (leftCmd, rightCmd) = curves.drive(yRaw, rRaw)
+        leftCmd = 255 - leftCmd
+        rightCmd = 255 - rightCmd
+        if conditioning is not None:
+            leftCmd = conditioning.left(leftCmd)
+            rightCmd = conditioning.right(rightCmd)
+
+        if self.commandChannel:
+            # v2 has no reserved values, but 255 is not a valid motor command
+            if leftCmd > 254:
+                leftCmd = 254
+            if rightCmd > 254:
+                rightCmd = 254
+        else:
             # Protect against sending a reserved value
-            if driveMtrCmds['left'] == RESERVED_VALUE_SET_PID_GAINS:
-                driveMtrCmds['left'] = RESERVED_VALUE_SET_PID_GAINS + 1
-            if driveMtrCmds['right'] == RESERVED_VALUE_SET_PID_GAINS:
-                driveMtrCmds['right'] = RESERVED_VALUE_SET_PID_GAINS + 1
-
-            ##########################
-
-            ###### ARM COMMAND #######
-
-            # Get the raw values for the arm using the gamepad
-            armRawManual = joysticks[0].get_axis(AXIS_ID_ARM_MANUAL)
-            armAutoNumBtns = (1 if joysticks[0].get_button(BUTTON_IDS_ARM_AUTO[0]) else 0) + \
-                               (1 if joysticks[0].get_button(BUTTON_IDS_ARM_AUTO[1]) else 0)
-            armBtnExitAuto = joysticks[0].get_button(BUTTON_ID_EXIT_AUTO)
-            armBtnZero = joysticks[0].get_button(BUTTON_ID_RESET_ARM_POS)
-            armBtnSendPIDGains = joysticks[0].get_button(BUTTON_ID_SEND_PID_GAINS)
-
-            (rawArmCmd, currArmMode) = armDrive(armRawManual, armAutoNumBtns, armBtnExitAuto, prevArmMode)
-
-            if transmitXTimes > 0:
-                armCmd = prevArmCmd
-            elif currArmMode == ArmMode.MANUAL and prevArmMode == ArmMode.AUTO:
-                armCmd = RESERVED_VALUE_ENTER_ARM_MANUAL
-                transmitXTimes = RESEND_COUNT_MODE_CHANGE
-            elif currArmMode == ArmMode.AUTO and prevArmMode == ArmMode.MANUAL:
-                armCmd = RESERVED_VALUE_ENTER_ARM_AUTO
-                transmitXTimes = RESEND_COUNT_MODE_CHANGE
-            elif armBtnZero:
-                armCmd = RESERVED_VALUE_RESET_ARM_POS
-                transmitXTimes = RESEND_COUNT_MODE_CHANGE
-            elif armBtnSendPIDGains:
-                armCmd = RESERVED_VALUE_SET_PID_GAINS
-                # To reset the PID gains, all 3 motor commands (left, right, arm) need to be set to the reserved value
-                driveMtrCmds['left'] = RESERVED_VALUE_SET_PID_GAINS
-                driveMtrCmds['right'] = RESERVED_VALUE_SET_PID_GAINS
-            else:
-                if RESERVED_VALUES_MIN <= rawArmCmd and rawArmCmd <= RESERVED_VALUES_MAX:
-                    armCmd = RESERVED_VALUES_MAX + 1
-                else:
-                    armCmd = rawArmCmd
-
-            prevArmMode = currArmMode
-
-            ##########################
-
-           
-            if joysticks[0].get_button(BUTTON_ID_STOP_PROGRAM):
-                cleanup()
-                done = True
-             # Only send if the commands changed or if 50ms have elapsed
-            elif prevDriveMtrCmds['left'] != driveMtrCmds['left'] or \
-                 prevDriveMtrCmds['right'] != driveMtrCmds['right'] or \
-                 prevArmCmd != armCmd or \
-                 time.time()*1000 > prevTimeSent + 50:
-
-                print("Sending... L: ", driveMtrCmds['left'], ", R: ", driveMtrCmds['right'], \
-                          ", A: ", armCmd, ", loopCounter: ", loopCounter)
-                loopCounter = loopCounter + 1
-                ser.write(chr(255))  # Start byte
-                ser.write(chr(driveMtrCmds['left']))
-                ser.write(chr(driveMtrCmds['right']))
-                ser.write(chr(armCmd))
-
-                if driveMtrCmds['left'] == RESERVED_VALUE_SET_PID_GAINS and \
-                   driveMtrCmds['right'] == RESERVED_VALUE_SET_PID_GAINS and \
-                   armCmd == RESERVED_VALUE_SET_PID_GAINS:
-                    checksum = int(0)
-                    ser.write(PID_ERROR_OR_MEASUREMENT)
-                    checksum += ord(PID_ERROR_OR_MEASUREMENT)
-
-                    ser.write(chr(len(PID_P_GAIN)))
-                    for i in range(0, len(PID_P_GAIN)):
-                        ser.write(PID_P_GAIN[i])
-                        checksum += ord(PID_P_GAIN[i])
-
-                    ser.write(chr(len(PID_I_GAIN)))
-                    for i in range(0, len(PID_I_GAIN)):
-                        ser.write(PID_I_GAIN[i])
-                        checksum += ord(PID_I_GAIN[i])
-
-                    ser.write(chr(len(PID_D_GAIN)))
-                    for i in range(0, len(PID_D_GAIN)):
-                        ser.write(PID_D_GAIN[i])
-                        checksum += ord(PID_D_GAIN[i])
-
-                    ser.write(chr(len(ARM_SCALE_FACTOR)))
-                    for i in range(0, len(ARM_SCALE_FACTOR)):
-                        ser.write(ARM_SCALE_FACTOR[i])
-                        checksum += ord(ARM_SCALE_FACTOR[i])
-
-                    ser.write(chr(checksum & 0x0FF))
-
-                prevDriveMtrCmds = driveMtrCmds
-                prevArmCmd = armCmd
-                prevTimeSent = time.time()*1000
-                if transmitXTimes >= 0:
-                    transmitXTimes -= 1
-                time.sleep(0.01)
+            if leftCmd == RESERVED_VALUE_SET_PID_GAINS:
+                leftCmd = RESERVED_VALUE_SET_PID_GAINS + 1
+            if rightCmd == RESERVED_VALUE_SET_PID_GAINS:
+                rightCmd = RESERVED_VALUE_SET_PID_GAINS + 1
+
+        ##########################
+
+        ###### ARM COMMAND #######
+
+        # Get the raw values for the arm using the gamepad
+        armRawManual = axes[self.armManualAxis]
+        if conditioning is not None:
+            armRawManual = conditioning.arm(armRawManual)
+        armAutoButtons = self.armAutoButtons
+        armAutoNumBtns = (1 if buttons[armAutoButtons[0]] else 0) + \
+                           (1 if buttons[armAutoButtons[1]] else 0)
+        armBtnExitAuto = buttons[self.exitAutoButton]
+        armBtnZero = buttons[self.resetArmPosButton]
+        armBtnSendPIDGains = buttons[self.sendPidGainsButton]
+
+        # With the command channel, holding the zero/PID button issues its command once
+        commandButtons = bool(armBtnZero or armBtnSendPIDGains)
+        if self.commandChannel and self.prevCommandButtons:
+            armBtnZero = False
+            armBtnSendPIDGains = False
+        self.prevCommandButtons = commandButtons
+
+        prevArmMode = self.prevArmMode
+        (rawArmCmd, currArmMode) = armDrive(armRawManual, armAutoNumBtns, armBtnExitAuto, prevArmMode,
+                                             curves.arm, self.armPositions)
+        if conditioning is not None and currArmMode == ArmMode.MANUAL:
+            rawArmCmd = conditioning.armOut(rawArmCmd)  # In auto mode the arm command is a position preset
+
+        if self.transmitXTimes > 0:
+            command = self.prevCommand if self.prevCommand is not None else self.command
+        elif currArmMode == ArmMode.MANUAL and prevArmMode == ArmMode.AUTO:
+            command = RESERVED_VALUE_ENTER_ARM_MANUAL
+            self.transmitXTimes = self.resendCount
+        elif currArmMode == ArmMode.AUTO and prevArmMode == ArmMode.MANUAL:
+            command = RESERVED_VALUE_ENTER_ARM_AUTO
+            self.transmitXTimes = self.resendCount
+        elif armBtnZero:
+            command = RESERVED_VALUE_RESET_ARM_POS
+            self.transmitXTimes = self.resendCount
+        elif armBtnSendPIDGains:
+            command = RESERVED_VALUE_SET_PID_GAINS
+        else:
+            command = None
 
-    except KeyboardInterrupt:
-        cleanup()
+        if self.commandChannel:
+            armCmd = rawArmCmd
+        elif command is not None:
+            armCmd = command
+            if command == RESERVED_VALUE_SET_PID_GAINS:
+                # To reset the PID gains, all 3 motor commands (left, right, arm) need to be set to the reserved value
+                leftCmd = RESERVED_VALUE_SET_PID_GAINS
+                rightCmd = RESERVED_VALUE_SET_PID_GAINS
+        elif RESERVED_VALUES_MIN <= rawArmCmd and rawArmCmd <= RESERVED_VALUES_MAX:
+            # Protect against sending a reserved value
+            armCmd = RESERVED_VALUES_MAX + 1
+        else:
+            armCmd = rawArmCmd
+
+        self.prevArmMode = currArmMode
+
+        ##########################
+
+        self.leftCmd = leftCmd
+        self.rightCmd = rightCmd
+        self.armCmd = armCmd
+        self.command = command
+        self.armMode = currArmMode
+        self.stopRequested = bool(buttons[self.stopProgramButton])
+
+    ############################################################
+    ## @brief  Compute this cycle's commands and decide whether to transmit
+    ## @param  axes - gamepad axis values from -1.0 to 1.0
+    ## @param  buttons - gamepad button states
+    ## @param  keepAliveDue - whether a frame must go out even if nothing changed
+    ## @param  encoder - FrameEncoder used to pack the frame
+    ## @return the frame to transmit (call markSent() once it is sent), or None
+    ############################################################
+    def nextFrame(self, axes, buttons, keepAliveDue, encoder):
+        self.compute(axes, buttons)
+        if self.stopRequested:
+            return None
+        if keepAliveDue or (self.changed() and self.worthSending()):
+            return encoder.command(self.leftCmd, self.rightCmd, self.armCmd, self.command, keepAliveDue)
+        return None
+
+    ############################################################
+    ## @return true if the commands differ from the last ones sent
+    ############################################################
+    def changed(self):
+        return self.prevLeftCmd != self.leftCmd or \
+               self.prevRightCmd != self.rightCmd or \
+               self.prevArmCmd != self.armCmd or \
+               (self.command is not None and self.prevCommand != self.command)
+
+    ############################################################
+    ## @return true unless the rate controller holds back this change
+    ############################################################
+    def worthSending(self):
+        rate = self.rateController
+        if rate is None or self.isReliable():
+            return True
+        return rate.allow(self.prevLeftCmd, self.leftCmd, self.prevRightCmd, self.rightCmd,
+                          self.prevArmCmd, self.armCmd)
+
+    ############################################################
+    ## @return true if the current frame carries a command
+    ##         (mode change, arm zeroing or PID setup) and must not be dropped
+    ############################################################
+    def isReliable(self):
+        return self.command is not None
+
+    ############################################################
+    ## @brief  Record that the current commands were transmitted
+    ############################################################
+    def markSent(self):
+        self.loopCounter = self.loopCounter + 1
+        self.prevLeftCmd = self.leftCmd
+        self.prevRightCmd = self.rightCmd
+        self.prevArmCmd = self.armCmd
+        self.prevCommand = self.command
+        if self.transmitXTimes >= 0:
+            self.transmitXTimes -= 1
 
 
 ################################################################################
@@ -319,25 +881,33 @@ def arcadeDrive(yIn, rIn):
 ## @param  autoNumBtns - the total number of buttons being pressed for automatic arm control
 ## @param  exitAuto - whether to forcefully exit automatic control
 ## @param  prevMode - mode of the arm from the previous iteration
+## @param  manualFn - function mapping manualIn to the manual arm command
+##                    (manualArmDrive, or the table version from DriveCurves)
+## @param  positions - (down, over bumps, up) presets, default ARM_POS_*
 ## @return (the arm command, the arm mode)
 ############################################################
-def armDrive(manualIn, autoNumBtns, exitAuto, prevMode):
+def armDrive(manualIn, autoNumBtns, exitAuto, prevMode, manualFn=None, positions=None):
 
     ZERO_COMMAND = 127  # the default value that corresponds to no motor power
 
-    manualCmd = manualArmDrive(manualIn)
+    if manualFn is None:
+        manualCmd = manualArmDrive(manualIn)
+    else:
+        manualCmd = manualFn(manualIn)
     
     if manualCmd != ZERO_COMMAND or (prevMode == ArmMode.MANUAL and autoNumBtns == 0) or exitAuto:
         currMode = ArmMode.MANUAL 
         armCmd = manualCmd
     else:  # manualCmd == 0 and (prevMode == ArmMode.AUTO or autoNumBtns > 0) and !exitAuto
         currMode = ArmMode.AUTO
+        if positions is None:
+            positions = (ARM_POS_DOWN, ARM_POS_OVER_BUMPS, ARM_POS_UP)
         if autoNumBtns == 0:
-            armCmd = ARM_POS_DOWN
+            armCmd = positions[0]
         elif autoNumBtns == 1:
-            armCmd = ARM_POS_OVER_BUMPS
+            armCmd = positions[1]
         else:  # autoNumBtns == 2
-            armCmd = ARM_POS_UP
+            armCmd = positions[2]
 
     return (armCmd, currMode)
 
@@ -397,73 +967,14 @@ def manualArmDrive(aIn):
     return aCmd
 
 ############################################################
-## @brief Run a watchdog check on the joystick
-## @param joystick - the pygame joystick object
-## @return true if the watchdog thinks the joystick died
-############################################################
-lastChangeDetected = time.time()*1000
-prevAxes = []
-prevBtns = []
-
-def joystickWatchdog(joystick):
-    global lastChangeDetected
-    global prevAxes
-    global prevBtns
-
-    if not prevAxes:
-        for i in range(0, joystick.get_numaxes()):
-            prevAxes.append(joystick.get_axis(i))
-    else:
-        for i in range(0, joystick.get_numaxes()):
-            if prevAxes[i] != joystick.get_axis(i):
-                lastChangeDetected = time.time()*1000
-            prevAxes[i] = joystick.get_axis(i)
-
-    if not prevBtns:
-        for i in range(0, joystick.get_numbuttons()):
-            prevBtns.append(joystick.get_button(i))
-    else:
-        for i in range(0, joystick.get_numbuttons()):
-            if prevBtns[i] != joystick.get_button(i):
-                lastChangeDetected = time.time()*1000
-            prevBtns[i] = joystick.get_button(i)
-
-    # If no change happens in 7000ms, consider the joystick dead
-    if time.time()*1000 > lastChangeDetected + 7000:
-        return True
-    else:
-        return False
-
-
-############################################################
-## @brief Zero all the commands to the robot
-############################################################
-def sendNeutralCommand():
-
-    global ser
-
-    for i in range (0, 3):
-        ser.write(chr(255))
-        ser.write(chr(127))
-        ser.write(chr(127))
-        ser.write(chr(RESERVED_VALUE_ENTER_ARM_MANUAL))
-
-    for i in range (0, 3):
-        ser.write(chr(255))
-        ser.write(chr(127))
-        ser.write(chr(127))
-        ser.write(chr(127))
-
-
-############################################################
-## @brief Zero all the commands to the robot and exit
+## @brief Zero the robot, close everything and exit
+## @param  loop - ControlLoop that was running
 ############################################################
-def cleanup():
+def cleanup(loop):
 
     global ser
 
-    print("Cleaning up and exiting")
-    sendNeutralCommand()
+    loop.shutdown()
     ser.close()
     pygame.quit()
     exit()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import collections
+import mmap
+import struct
+import sys
+
+################################################################################
+## Flight recorder for every frame sent to the robot
+##
+## Records are fixed size and written into a preallocated, memory-mapped ring
+## file, so recording a frame is a couple of struct.pack_into() calls into
+## memory that already exists -- no file writes, no growing buffers. When the
+## ring is full the oldest records are overwritten.
+##
+## File layout (little endian):
+##   header:  magic "BBFR", version, header size, record size, capacity,
+##            number of axes, number of buttons, max frame bytes,
+##            total records written
+##   records: timestamp (monotonic ns), sequence number,
+##            axes (float32 each), buttons (bitmask),
+##            left, right, arm, arm mode, frame length, frame bytes
+##
+## Read a recording with readRecords(), or from the command line:
+##   python FlightRecorder.py <file>
+################################################################################
+
+MAGIC = b'BBFR'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHHIHHHQ')
+HEADER_SIZE = 64
+MAX_FRAME_BYTES = 40  # Longer frames (unusually long PID gain strings) are truncated
+
+# Default ring size: about 45 minutes of frames at 100Hz
+DEFAULT_CAPACITY = 262144
+
+Record = collections.namedtuple('Record', ['timestampNs', 'seq', 'axes', 'buttons',
+                                           'left', 'right', 'arm', 'armMode', 'frame'])
+
+
+############################################################
+## @brief  Build the per-record structs for a given gamepad layout
+## @return (head struct, tail struct, record size)
+############################################################
+def recordStructs(numAxes):
+    head = struct.Struct('<QQ' + 'f' * numAxes)
+    tail = struct.Struct('<IBBBBH')
+    return (head, tail, head.size + tail.size + MAX_FRAME_BYTES)
+
+
+class FlightRecorder:
+
+    ############################################################
+    ## @brief  Create (or overwrite) a recording file
+    ## @param  path - file to record into
+    ## @param  numAxes - number of gamepad axes stored per record
+    ## @param  numButtons - number of gamepad buttons stored per record (max 32)
+    ## @param  capacity - number of records in the ring
+    ############################################################
+    def __init__(self, path, numAxes, numButtons, capacity=DEFAULT_CAPACITY):
+        if numButtons > 32:
+            numButtons = 32
+        (self.head, self.tail, self.recordSize) = recordStructs(numAxes)
+        self.numAxes = numAxes
+        self.numButtons = numButtons
+        self.capacity = capacity
+        self.path = path
+        self.count = 0
+        self.slot = 0
+        self.offset = HEADER_SIZE
+
+        size = HEADER_SIZE + capacity * self.recordSize
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        self.file = open(path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        self.writeHeader()
+
+    def writeHeader(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, HEADER_SIZE, self.recordSize, self.capacity,
+                         self.numAxes, self.numButtons, MAX_FRAME_BYTES, self.count)
+
+    ############################################################
+    ## @brief  Append one transmitted frame
+    ## @param  timestampNs - monotonic time of the control cycle
+    ## @param  axes - gamepad axis values (numAxes of them)
+    ## @param  buttons - gamepad button states
+    ## @param  left, right, arm - commands computed this cycle
+    ## @param  armMode - ArmMode value (int)
+    ## @param  frame - bytes actually written to the port
+    ############################################################
+    def record(self, timestampNs, axes, buttons, left, right, arm, armMode, frame):
+        mm = self.mm
+        offset = self.offset
+
+        # A reconnected pad with fewer buttons records the ones it has
+        mask = 0
+        bit = 1
+        for i in range(0, min(self.numButtons, len(buttons))):
+            if buttons[i]:
+                mask |= bit
+            bit <<= 1
+
+        frameLen = len(frame)
+        if frameLen > MAX_FRAME_BYTES:
+            frameLen = MAX_FRAME_BYTES
+
+        if len(axes) != self.numAxes:
+            # Gamepad layout changed (reconnected a different pad); record what fits
+            axes = (list(axes) + [0.0] * self.numAxes)[:self.numAxes]
+        self.head.pack_into(mm, offset, timestampNs, self.count, *axes)
+        offset += self.head.size
+        self.tail.pack_into(mm, offset, mask, left, right, arm, armMode, len(frame))
+        offset += self.tail.size
+        mm[offset:offset + frameLen] = frame[:frameLen]
+
+        self.count += 1
+        struct.pack_into('<Q', mm, HEADER.size - 8, self.count)
+
+        self.slot += 1
+        if self.slot == self.capacity:
+            self.slot = 0
+            self.offset = HEADER_SIZE
+        else:
+            self.offset += self.recordSize
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+            self.mm = None
+
+
+############################################################
+## @brief  Stream the records of a recording, oldest first
+## @param  path - recording file
+## @return generator of Record tuples
+############################################################
+def readRecords(path):
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, headerSize, recordSize, capacity,
+             numAxes, numButtons, maxFrameBytes, count) = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("Not a flight recorder file: " + path)
+            (head, tail, size) = recordStructs(numAxes)
+            if size != recordSize:
+                raise ValueError("Unexpected record size in " + path)
+
+            if count > capacity:
+                first = count - capacity
+            else:
+                first = 0
+
+            for seq in range(first, count):
+                offset = headerSize + (seq % capacity) * recordSize
+                values = head.unpack_from(mm, offset)
+                offset += head.size
+                (mask, left, right, arm, armMode, frameLen) = tail.unpack_from(mm, offset)
+                offset += tail.size
+                frame = mm[offset:offset + min(frameLen, maxFrameBytes)]
+                buttons = tuple((mask >> i) & 1 for i in range(0, numButtons))
+                yield Record(values[0], values[1], values[2:], buttons,
+                             left, right, arm, armMode, frame)
+        finally:
+            mm.close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python FlightRecorder.py <file>")
+        return 1
+
+    print("timestamp_ns,seq,left,right,arm,arm_mode,axes,buttons,frame")
+    for r in readRecords(sys.argv[1]):
+        print("{},{},{},{},{},{},{},{},{}".format(
+            r.timestampNs, r.seq, r.left, r.right, r.arm, r.armMode,
+            " ".join("{:.4f}".format(a) for a in r.axes),
+            "".join(str(b) for b in r.buttons), r.frame.hex()))
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+################################################################################
+## Serial frame encoding/decoding for the robot link
+##
+## Wire format (see processCmd()/processSetup() in ArduinoProMini.ino):
+##   Command frame:   255, <left>, <right>, <arm>
+##   PID setup frame: 255, 126, 126, 126,
+##                      <'E' or 'M'>,
+##                      <# chars> <Kp>,
+##                      <# chars> <Ki>,
+##                      <# chars> <Kd>,
+##                      <# chars> <armScale>,
+##                      <checksum>         <--- sum of all chars excluding lengths & 0xFF
+##
+## Frames are packed into preallocated buffers so each frame goes out with a
+## single ser.write() call instead of one call per byte.
+################################################################################
+
+START_BYTE = 255
+SETUP_VALUE = 126  # left/right/arm all equal to this value marks a PID setup frame
+NEUTRAL_VALUE = 127
+ENTER_ARM_MANUAL_VALUE = 125
+
+COMMAND_FRAME_SIZE = 4
+
+# DriverStation.ControlLoop.sendNeutral() repeats each of these frames this many times
+NEUTRAL_REPEAT_COUNT = 3
+
+
+############################################################
+## @brief  Build the PID setup payload (everything after the 4-byte header)
+## @param  errorOrMeasurement - 'E' for proportional on error, 'M' for measurement
+## @param  gains - strings for Kp, Ki, Kd and armScale, in that order
+## @return bytes with the payload and trailing checksum
+############################################################
+def encodePidPayload(errorOrMeasurement, gains):
+
+    payload = bytearray(errorOrMeasurement.encode('ascii'))
+    checksum = payload[0]
+
+    for gain in gains:
+        gainBytes = gain.encode('ascii')
+        if len(gainBytes) > 255:
+            raise ValueError("PID gain string too long: " + gain)
+        payload.append(len(gainBytes))
+        payload += gainBytes
+        checksum += sum(gainBytes)
+
+    payload.append(checksum & 0x0FF)
+    return bytes(payload)
+
+
+################################################################################
+## @brief  Packs command frames into one preallocated buffer
+################################################################################
+class FrameEncoder:
+
+    def __init__(self, errorOrMeasurement='E', gains=("0", "0", "0", "0")):
+
+        self.commandBuf = bytearray(COMMAND_FRAME_SIZE)
+        self.commandBuf[0] = START_BYTE
+        self.commandView = memoryview(self.commandBuf)
+
+        # The neutral burst never changes, so build it once
+        neutral = bytearray()
+        for i in range(0, NEUTRAL_REPEAT_COUNT):
+            neutral += bytes((START_BYTE, NEUTRAL_VALUE, NEUTRAL_VALUE, ENTER_ARM_MANUAL_VALUE))
+        for i in range(0, NEUTRAL_REPEAT_COUNT):
+            neutral += bytes((START_BYTE, NEUTRAL_VALUE, NEUTRAL_VALUE, NEUTRAL_VALUE))
+        self.neutralFrames = bytes(neutral)
+
+        self.setPidGains(errorOrMeasurement, gains)
+
+    ############################################################
+    ## @brief  Rebuild the cached PID setup frame
+    ## @param  errorOrMeasurement - 'E' or 'M'
+    ## @param  gains - strings for Kp, Ki, Kd and armScale
+    ############################################################
+    def setPidGains(self, errorOrMeasurement, gains):
+        self.pidFrame = bytes((START_BYTE, SETUP_VALUE, SETUP_VALUE, SETUP_VALUE)) + \
+                        encodePidPayload(errorOrMeasurement, gains)
+
+    ############################################################
+    ## @brief  Pack a command frame
+    ## @param  left, right, arm - motor commands from 0 to 254
+    ## @param  linkCommand - unused; v1 commands travel in the arm byte
+    ##                       (see LinkProtocol.FrameEncoderV2)
+    ## @param  keepAlive - unused; every v1 frame carries all three values
+    ## @return memoryview of the shared frame buffer (valid until the next call)
+    ############################################################
+    def command(self, left, right, arm, linkCommand=None, keepAlive=False):
+
+        # Setup frames carry a payload, so return the whole cached packet for them
+        if left == SETUP_VALUE and right == SETUP_VALUE and arm == SETUP_VALUE:
+            return self.pidFrame
+
+        buf = self.commandBuf
+        buf[1] = left
+        buf[2] = right
+        buf[3] = arm
+        return self.commandView
+
+    ############################################################
+    ## @brief  Nothing to do: every v1 frame carries all three values
+    ############################################################
+    def resync(self):
+        pass
+
+    ############################################################
+    ## @brief  Frames sent by DriverStation.ControlLoop.sendNeutral(): leave arm auto mode, then zero everything
+    ## @return bytes with all neutral frames back to back
+    ############################################################
+    def neutral(self):
+        return self.neutralFrames
+
+
+################################################################################
+## @brief  Incremental decoder that parses the byte stream like the firmware does
+##
+## Mirrors loop()/processSetup() in ArduinoProMini.ino: hunt for the start byte,
+## read a 3-byte body, drop bodies containing 255, and treat 126/126/126 as a
+## PID setup packet. Feed it any chunking of the stream.
+################################################################################
+class FrameDecoder:
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.checksumErrors = 0
+        self.droppedBodies = 0
+        self.skippedBytes = 0
+
+    ############################################################
+    ## @brief  Add bytes from the link and return any complete frames
+    ## @param  data - bytes-like chunk of the stream
+    ## @return list of ('cmd', left, right, arm) and
+    ##         ('setup', errorOrMeasurement, [Kp, Ki, Kd, armScale]) tuples
+    ############################################################
+    def feed(self, data):
+
+        self.buf += data
+        buf = self.buf
+        frames = []
+        pos = 0
+
+        while True:
+            # Look for the start byte
+            start = buf.find(START_BYTE, pos)
+            if start < 0:
+                self.skippedBytes += len(buf) - pos
+                pos = len(buf)
+                break
+            self.skippedBytes += start - pos
+
+            if len(buf) - start < COMMAND_FRAME_SIZE:
+                pos = start
+                break
+
+            left = buf[start + 1]
+            right = buf[start + 2]
+            arm = buf[start + 3]
+
+            if left == SETUP_VALUE and right == SETUP_VALUE and arm == SETUP_VALUE:
+                setup = self.parseSetup(buf, start + COMMAND_FRAME_SIZE)
+                if setup is None:
+                    pos = start  # wait for the rest of the packet
+                    break
+                (frame, end) = setup
+                if frame is not None:
+                    frames.append(frame)
+                pos = end
+            elif left < 255 and right < 255 and arm < 255:
+                frames.append(('cmd', left, right, arm))
+                pos = start + COMMAND_FRAME_SIZE
+            else:
+                self.droppedBodies += 1
+                pos = start + COMMAND_FRAME_SIZE
+
+        del buf[:pos]
+        return frames
+
+    ############################################################
+    ## @brief  Parse a PID setup payload
+    ## @param  buf - stream buffer
+    ## @param  pos - index of the first payload byte
+    ## @return None if incomplete, else (frame or None on bad checksum, end index)
+    ############################################################
+    def parseSetup(self, buf, pos):
+
+        if pos >= len(buf):
+            return None
+        proportional = chr(buf[pos])
+        checksum = buf[pos]
+        pos += 1
+
+        values = []
+        for i in range(0, 4):
+            if pos >= len(buf):
+                return None
+            strLen = buf[pos]
+            pos += 1
+            if pos + strLen > len(buf):
+                return None
+            chars = bytes(buf[pos:pos + strLen])
+            checksum += sum(chars)
+            values.append(chars.decode('ascii', 'replace'))
+            pos += strLen
+
+        if pos >= len(buf):
+            return None
+        if (checksum & 0xFF) != buf[pos]:
+            self.checksumErrors += 1
+            return (None, pos + 1)
+        return (('setup', proportional, values), pos + 1)
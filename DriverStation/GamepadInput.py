@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+import os
+import time
+import pygame
+
+################################################################################
+## Event-driven gamepad input
+##
+## Instead of polling every axis and button each cycle, the controller state is
+## updated from pygame's joystick events. Each event touches one slot of the
+## snapshot and refreshes the watchdog timestamp, so the cost per cycle is
+## proportional to what actually changed on the gamepad.
+##
+## The watchdog trips when nothing has changed for WATCHDOG_TIMEOUT_MS (a live
+## gamepad always jitters a little) or immediately when the gamepad is
+## unplugged.
+##
+## For testing without hardware, set SDL_VIDEODRIVER=dummy, create a
+## ControllerState with joystick=None and post synthetic events, e.g.
+##   pygame.event.post(pygame.event.Event(pygame.JOYAXISMOTION, instance_id=0, axis=1, value=0.5))
+################################################################################
+
+# If no change happens in this long, consider the joystick dead
+WATCHDOG_TIMEOUT_MS = 7000
+
+NS_PER_MS = 1000000
+
+# Only these events are queued; everything else is dropped by SDL
+JOYSTICK_EVENTS = [pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP,
+                   pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED, pygame.QUIT]
+
+
+class ControllerState:
+
+    ############################################################
+    ## @brief  Create the snapshot for one gamepad
+    ## @param  joystick - initialized pygame joystick, or None for synthetic events
+    ## @param  numAxes - number of axes when joystick is None
+    ## @param  numButtons - number of buttons when joystick is None
+    ## @param  instanceId - instance id to listen to when joystick is None
+    ## @param  clock - monotonic nanosecond clock
+    ## @param  report - callback for status lines (e.g. StationLog.message, to keep the console off the loop)
+    ############################################################
+    def __init__(self, joystick=None, numAxes=6, numButtons=11, instanceId=0, clock=time.monotonic_ns,
+                 report=print):
+        self.clock = clock
+        self.report = report
+        self.watchdogTimeoutNs = WATCHDOG_TIMEOUT_MS * NS_PER_MS
+
+        self.joystick = None
+        self.axes = [0.0] * numAxes
+        self.buttons = [0] * numButtons
+        self.instanceId = instanceId
+        self.guid = None
+        self.connected = joystick is None
+        self.quitRequested = False
+        self.lastChangeNs = clock()
+
+        # Counters
+        self.eventCount = 0
+        self.disconnects = 0
+
+        if joystick is not None:
+            self.attach(joystick)
+
+    ############################################################
+    ## @brief  Start tracking a (re)connected joystick
+    ## @param  joystick - initialized pygame joystick
+    ############################################################
+    def attach(self, joystick):
+        self.joystick = joystick
+        self.instanceId = joystick.get_instance_id()
+        self.guid = joystick.get_guid()
+
+        numAxes = joystick.get_numaxes()
+        numButtons = joystick.get_numbuttons()
+        if len(self.axes) != numAxes:
+            self.axes = [0.0] * numAxes
+        if len(self.buttons) != numButtons:
+            self.buttons = [0] * numButtons
+
+        # Take one full snapshot; from here on only events update it
+        for i in range(0, numAxes):
+            self.axes[i] = joystick.get_axis(i)
+        for i in range(0, numButtons):
+            self.buttons[i] = joystick.get_button(i)
+
+        self.connected = True
+        self.lastChangeNs = self.clock()
+
+    ############################################################
+    ## @brief  Apply all pending joystick events to the snapshot
+    ############################################################
+    def update(self):
+        for event in pygame.event.get():
+            self.handleEvent(event)
+
+    ############################################################
+    ## @brief  Apply one event to the snapshot
+    ## @param  event - pygame event
+    ############################################################
+    def handleEvent(self, event):
+        eventType = event.type
+        self.eventCount += 1
+
+        if eventType == pygame.JOYAXISMOTION:
+            if event.instance_id == self.instanceId:
+                axis = event.axis
+                if self.joystick is not None:
+                    # Use the same scaling as get_axis() so values land on the DriveCurves grid
+                    value = self.joystick.get_axis(axis)
+                else:
+                    value = event.value
+                if self.axes[axis] != value:
+                    self.axes[axis] = value
+                    self.lastChangeNs = self.clock()
+        elif eventType == pygame.JOYBUTTONDOWN:
+            if event.instance_id == self.instanceId:
+                self.buttons[event.button] = 1
+                self.lastChangeNs = self.clock()
+        elif eventType == pygame.JOYBUTTONUP:
+            if event.instance_id == self.instanceId:
+                self.buttons[event.button] = 0
+                self.lastChangeNs = self.clock()
+        elif eventType == pygame.JOYDEVICEREMOVED:
+            if event.instance_id == self.instanceId:
+                self.detach()
+        elif eventType == pygame.JOYDEVICEADDED:
+            if not self.connected and self.joystick is not None:
+                joystick = pygame.joystick.Joystick(event.device_index)
+                joystick.init()
+                self.report("Reconnected joystick '" + joystick.get_name() + "'")
+                self.attach(joystick)
+        elif eventType == pygame.QUIT:
+            self.quitRequested = True
+
+    ############################################################
+    ## @brief  Forget the current joystick after it was unplugged
+    ############################################################
+    def detach(self):
+        self.report("Joystick disconnected")
+        self.connected = False
+        self.disconnects += 1
+        for i in range(0, len(self.axes)):
+            self.axes[i] = 0.0
+        for i in range(0, len(self.buttons)):
+            self.buttons[i] = 0
+
+    ############################################################
+    ## @brief  Run a watchdog check on the joystick
+    ## @return true if the watchdog thinks the joystick died
+    ############################################################
+    def watchdogTripped(self):
+        return not self.connected or self.clock() - self.lastChangeNs > self.watchdogTimeoutNs
+
+
+############################################################
+## @brief  Initialize only what reading gamepads needs
+##
+## pygame.init() also starts audio, fonts and a real video driver, which can
+## take hundreds of milliseconds. The event queue needs the video subsystem,
+## so it is started with SDL's dummy driver (no window; SDL keeps its own
+## hidden helper window for joysticks where the OS needs one).
+############################################################
+def initJoystickOnly():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.joystick.init()
+
+
+############################################################
+## @brief  Restrict the pygame event queue to joystick events
+############################################################
+def allowJoystickEventsOnly():
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(JOYSTICK_EVENTS)
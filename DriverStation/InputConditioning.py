@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+
+import math
+import sys
+import time
+
+import DriveCurves
+import StageMetrics
+
+################################################################################
+## Composable input conditioning for the control loop
+##
+## A chain is a list of small stages, each turning one value into the next:
+##   deadband  (width)              within width of neutral -> neutral
+##   expo      (expConst[, endpoint]) DriveCurves.expCurve()'s shape without the
+##                                  deadband, scaled so full deflection gives
+##                                  endpoint (0 to 1, default 1); axes only
+##   ema       (alpha[, initial])   exponential moving average (low-pass);
+##                                  alpha = 1 passes the input through
+##   slew      (maxStep[, initial]) change limited to maxStep per cycle
+## Neutral is 0.0 on the axis channels and 127 on the command channels; ema
+## and slew start (and restart after reset()) from it unless given `initial`.
+##   clamp     (low, high)
+##   reserved  (low, high[, to])    values in [low, high] become `to` (default high + 1)
+##
+## Chains are compiled once:
+##   - a leading run of stateless stages on a joystick axis is folded into a
+##     lookup table over the joystick's 16-bit grid (as DriveCurves does), so
+##     deadband + expo costs one index
+##   - the remaining stages are bound into one generated function that calls
+##     them in a straight line (no loop, no list, no per-call allocation);
+##     their state lives in the stage objects, created up front
+##
+## CommandPipeline runs the chains named in a spec around the drive/arm
+## tables (see DriverStation.CONDITIONING):
+##   'y', 'r', 'arm'            raw axes, before the tables
+##   'left', 'right', 'armOut'  commands after the tables (and the 255 - x
+##                              inversion), before the link's reserved-value
+##                              protection; 'armOut' only in manual arm mode
+## Every non-empty chain ends in a range stage, so whatever its stages compute
+## an axis chain yields -1.0 to 1.0 (the tables' domain) and a command chain
+## an int from 0 to 254.
+##
+## Spec: {'y': [('ema', 0.5)], 'left': [('slew', 20, 127)], ...}
+##
+## Per-stage cost: Conditioning.timed() compiles the same chains with a clock
+## read between stages into StageMetrics histograms; print summary(). Or run
+## python InputConditioning.py to benchmark every stage type.
+################################################################################
+
+AXIS_CHANNELS = ('y', 'r', 'arm')
+OUTPUT_CHANNELS = ('left', 'right', 'armOut')
+
+
+class Deadband:
+    __slots__ = ('width', 'neutral')
+    stateless = True
+
+    def __init__(self, width, neutral=0.0):
+        self.width = width
+        self.neutral = neutral
+
+    def process(self, x):
+        if -self.width < x - self.neutral < self.width:
+            return self.neutral
+        return x
+
+    def reset(self):
+        pass
+
+
+class Expo:
+    __slots__ = ('expConst', 'endpoint', 'scale')
+    stateless = True
+
+    def __init__(self, expConst, endpoint=1.0):
+        if not 0.0 < endpoint <= 1.0:
+            raise ValueError("Expo endpoint is the output at full deflection, from 0 to 1, got " + str(endpoint))
+        self.expConst = expConst
+        self.endpoint = endpoint
+        # DriveCurves.expCurve() reaches e^(1/END_EXP_CONST) - 1 at full deflection
+        self.scale = endpoint / (math.exp(1.0 / DriveCurves.END_EXP_CONST) - 1.0)
+
+    def process(self, x):
+        y = (math.exp(math.pow(math.fabs(x), self.expConst) / DriveCurves.END_EXP_CONST) - 1.0) * self.scale
+        return -y if x < 0 else y
+
+    def reset(self):
+        pass
+
+
+class Ema:
+    __slots__ = ('alpha', 'value', 'initial')
+    stateless = False
+
+    def __init__(self, alpha, initial=None, neutral=0.0):
+        if not 0.0 < alpha <= 1.0:
+            raise ValueError("EMA alpha must be in (0, 1], got " + str(alpha))
+        self.alpha = alpha
+        self.initial = neutral if initial is None else initial
+        self.value = self.initial
+
+    def process(self, x):
+        value = self.value + self.alpha * (x - self.value)
+        self.value = value
+        return value
+
+    def reset(self):
+        self.value = self.initial
+
+
+class Slew:
+    __slots__ = ('maxStep', 'value', 'initial')
+    stateless = False
+
+    def __init__(self, maxStep, initial=None, neutral=0):
+        if maxStep <= 0:
+            raise ValueError("Slew step must be positive, got " + str(maxStep))
+        self.maxStep = maxStep
+        self.initial = neutral if initial is None else initial
+        self.value = self.initial
+
+    def process(self, x):
+        value = self.value
+        if x > value + self.maxStep:
+            x = value + self.maxStep
+        elif x < value - self.maxStep:
+            x = value - self.maxStep
+        self.value = x
+        return x
+
+    def reset(self):
+        self.value = self.initial
+
+
+class Clamp:
+    __slots__ = ('low', 'high')
+    stateless = True
+
+    def __init__(self, low, high):
+        if low > high:
+            raise ValueError("Clamp low {} is above high {}".format(low, high))
+        self.low = low
+        self.high = high
+
+    def process(self, x):
+        if x < self.low:
+            return self.low
+        if x > self.high:
+            return self.high
+        return x
+
+    def reset(self):
+        pass
+
+
+class AvoidReserved:
+    __slots__ = ('low', 'high', 'to')
+    stateless = True
+
+    def __init__(self, low, high, to=None):
+        self.low = low
+        self.high = high
+        self.to = high + 1 if to is None else to
+
+    def process(self, x):
+        if self.low <= x <= self.high:
+            return self.to
+        return x
+
+    def reset(self):
+        pass
+
+
+################################################################################
+## @brief  Final stage of a command chain: nearest int from 0 to 254
+################################################################################
+class CommandRange:
+    __slots__ = ()
+    stateless = True
+
+    def process(self, x):
+        x = int(x + 0.5)
+        if x < 0:
+            return 0
+        if x > 254:
+            return 254
+        return x
+
+    def reset(self):
+        pass
+
+
+################################################################################
+## @brief  Stateless axis stages folded into one lookup over the joystick grid
+################################################################################
+class AxisTable:
+    __slots__ = ('table', 'names')
+    stateless = True
+
+    def __init__(self, stages):
+        self.names = [type(s).__name__.lower() for s in stages]
+        table = []
+        for i in range(DriveCurves.AXIS_TABLE_SIZE):
+            x = DriveCurves.axisValue(i)
+            for stage in stages:
+                x = stage.process(x)
+            table.append(x)
+        self.table = table
+
+    def process(self, x):
+        return self.table[int(x * 32768.0 + 32768.5)]
+
+    def reset(self):
+        pass
+
+
+STAGES = {'deadband': Deadband, 'expo': Expo, 'ema': Ema, 'slew': Slew, 'clamp': Clamp,
+          'reserved': AvoidReserved}
+
+# Stages that only make sense on a joystick axis (-1.0 to 1.0)
+AXIS_ONLY_STAGES = ('expo',)
+
+# Stages that measure from, or start at, the channel's neutral value
+CENTRED_STAGES = ('deadband', 'ema', 'slew')
+
+AXIS_NEUTRAL = 0.0
+COMMAND_NEUTRAL = 127
+
+
+############################################################
+## @brief  Create stages from a spec list
+## @param  spec - list of (name, *args) tuples, see STAGES
+## @param  neutral - the channel's neutral value (AXIS_NEUTRAL or COMMAND_NEUTRAL)
+## @return list of new stage objects
+############################################################
+def buildStages(spec, neutral=AXIS_NEUTRAL):
+    stages = []
+    for entry in spec:
+        (name, args) = (entry[0], entry[1:])
+        if name not in STAGES:
+            raise ValueError("Unknown conditioning stage '" + str(name) + "' (one of " +
+                             ", ".join(sorted(STAGES)) + ")")
+        if name in CENTRED_STAGES:
+            stages.append(STAGES[name](*args, neutral=neutral))
+        else:
+            stages.append(STAGES[name](*args))
+    return stages
+
+
+############################################################
+## @brief  Bind stage functions into one straight-line function
+## @param  steps - process functions, in order
+## @return function of one value
+############################################################
+def flatten(steps):
+    names = ['s' + str(i) for i in range(len(steps))]
+    source = "def chain(x):\n" + "".join("    x = " + n + "(x)\n" for n in names) + "    return x\n"
+    scope = dict(zip(names, steps))
+    exec(source, scope)
+    return scope['chain']
+
+
+################################################################################
+## @brief  One compiled chain
+################################################################################
+class Chain:
+
+    ############################################################
+    ## @param  stages - stage objects, in order
+    ## @param  axis - the input is a joystick axis, so a leading stateless run can become a table
+    ############################################################
+    def __init__(self, stages, axis=False):
+        self.stages = list(stages)
+        run = 0
+        if axis:
+            while run < len(self.stages) and self.stages[run].stateless:
+                run += 1
+        if run > 1:
+            self.compiled = [AxisTable(self.stages[:run])] + self.stages[run:]
+        else:
+            self.compiled = list(self.stages)
+        self.names = ["+".join(s.names) if isinstance(s, AxisTable) else type(s).__name__.lower()
+                      for s in self.compiled]
+        self.run = flatten([s.process for s in self.compiled])
+        self.histograms = None
+
+    ############################################################
+    ## @brief  Switch to a version that times every stage
+    ############################################################
+    def timed(self):
+        clock = time.perf_counter_ns
+        self.histograms = [StageMetrics.LatencyHistogram() for s in self.compiled]
+        steps = []
+        for (stage, histogram) in zip(self.compiled, self.histograms):
+            def step(x, process=stage.process, record=histogram.record):
+                start = clock()
+                x = process(x)
+                record(clock() - start)
+                return x
+            steps.append(step)
+        self.run = flatten(steps)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    ############################################################
+    ## @brief  Continue from another chain's running values
+    ## @param  other - Chain this one replaces
+    ## @return true if the stage types match and the values were copied
+    ############################################################
+    def carryStateFrom(self, other):
+        if [type(s) for s in self.stages] != [type(s) for s in other.stages]:
+            return False
+        for (stage, previous) in zip(self.stages, other.stages):
+            if not stage.stateless and math.isfinite(previous.value):
+                stage.value = previous.value
+        return True
+
+
+################################################################################
+## @brief  The chains CommandPipeline runs, compiled from a spec
+################################################################################
+class Conditioning:
+
+    ############################################################
+    ## @param  spec - dict of channel name -> stage spec list (missing/empty = pass through)
+    ############################################################
+    def __init__(self, spec):
+        unknown = set(spec) - set(AXIS_CHANNELS) - set(OUTPUT_CHANNELS)
+        if unknown:
+            raise ValueError("Unknown conditioning channel(s): " + ", ".join(sorted(unknown)))
+        self.chains = {}
+        for channel in AXIS_CHANNELS + OUTPUT_CHANNELS:
+            axis = channel in AXIS_CHANNELS
+            stageSpec = spec.get(channel, ())
+            if not axis:
+                for entry in stageSpec:
+                    if entry[0] in AXIS_ONLY_STAGES:
+                        raise ValueError("Conditioning stage '" + entry[0] + "' works on joystick axes (" +
+                                         ", ".join(AXIS_CHANNELS) + "), not on '" + channel + "'")
+            stages = buildStages(stageSpec, AXIS_NEUTRAL if axis else COMMAND_NEUTRAL)
+            if stages:
+                # Keep the chain's output in the range the next step of the pipeline takes
+                stages.append(Clamp(-1.0, 1.0) if axis else CommandRange())
+            try:
+                self.chains[channel] = Chain(stages, axis)
+            except ArithmeticError as e:
+                # Folding stateless axis stages into a table runs them over the joystick grid
+                raise ValueError("'" + channel + "' fails on the joystick range: " + str(e))
+        self.bind()
+
+    def bind(self):
+        chains = self.chains
+        self.y = chains['y'].run
+        self.r = chains['r'].run
+        self.arm = chains['arm'].run
+        self.left = chains['left'].run
+        self.right = chains['right'].run
+        self.armOut = chains['armOut'].run
+
+    def timed(self):
+        for chain in self.chains.values():
+            chain.timed()
+        self.bind()
+
+    def reset(self):
+        for chain in self.chains.values():
+            chain.reset()
+
+    ############################################################
+    ## @brief  Continue from the running values of the conditioning this replaces
+    ##
+    ## Channels whose stage types are unchanged keep their filter/slew state,
+    ## so swapping a profile does not step the output; the others start from
+    ## their initial state.
+    ## @param  other - Conditioning that was running
+    ############################################################
+    def carryStateFrom(self, other):
+        for (channel, chain) in self.chains.items():
+            chain.carryStateFrom(other.chains[channel])
+
+    ############################################################
+    ## @brief  Run every chain over its whole input range
+    ##
+    ## Axis chains get every point of the joystick grid and must return -1.0
+    ## to 1.0, command chains get 0 to 254 and must return an int in that range.
+    ## The chains are reset afterwards.
+    ## @return list of problems (empty if every chain is usable)
+    ############################################################
+    def check(self):
+        errors = []
+        axisInputs = [DriveCurves.axisValue(i) for i in range(0, DriveCurves.AXIS_TABLE_SIZE)]
+        for (channel, chain) in self.chains.items():
+            if not chain.stages:
+                continue
+            axis = channel in AXIS_CHANNELS
+            run = chain.run
+            x = None
+            try:
+                for x in (axisInputs if axis else range(0, 255)):
+                    y = run(x)
+                    if axis:
+                        valid = type(y) in (int, float) and -1.0 <= y <= 1.0
+                    else:
+                        valid = type(y) is int and 0 <= y <= 254
+                    if not valid:
+                        errors.append("{}: input {} gives {!r}".format(channel, x, y))
+                        break
+            except Exception as e:
+                errors.append("{}: input {} raises {}: {}".format(channel, x, type(e).__name__, e))
+            chain.reset()
+        return errors
+
+    ############################################################
+    ## @brief  Per-stage cost (only after timed())
+    ############################################################
+    def summary(self):
+        lines = ["{:<8}{:<20}{:>10}{:>10}{:>10}".format("channel", "stage", "count", "mean ns", "p99 ns")]
+        for (channel, chain) in self.chains.items():
+            if chain.histograms is None:
+                continue
+            for (name, h) in zip(chain.names, chain.histograms):
+                lines.append("{:<8}{:<20}{:>10}{:>10.0f}{:>10}".format(
+                    channel, name, h.count, h.mean(), h.percentile(0.99)))
+        return "\n".join(lines)
+
+
+############################################################
+## @brief  Build the pipeline's conditioning, or None when the spec has no stages
+############################################################
+def build(spec):
+    if not spec or not any(spec.values()):
+        return None
+    return Conditioning(spec)
+
+
+############################################################
+## @brief  Time every stage type on a synthetic input sweep
+############################################################
+def main():
+    iterations = 200000
+    values = [DriveCurves.axisValue(i) for i in range(0, DriveCurves.AXIS_TABLE_SIZE, 7)]
+    cases = [('deadband', Chain([Deadband(0.1)])),
+             ('expo', Chain([Expo(1.5)])),
+             ('deadband+expo[table]', Chain([Deadband(0.1), Expo(1.5)], axis=True)),
+             ('ema', Chain([Ema(0.5)])),
+             ('slew', Chain([Slew(0.05)])),
+             ('clamp', Chain([Clamp(-0.5, 0.5)])),
+             ('reserved', Chain([AvoidReserved(123, 126)])),
+             ('empty chain', Chain([]))]
+    print("{:<24}{:>10}".format("stage", "ns/call"))
+    for (name, chain) in cases:
+        run = chain.run
+        count = len(values)
+        start = time.perf_counter_ns()
+        for i in range(0, iterations):
+            run(values[i % count])
+        print("{:<24}{:>10.0f}".format(name, (time.perf_counter_ns() - start) / float(iterations)))
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+import time
+
+################################################################################
+## Adaptive transmit rate for the serial link
+##
+## Models how many bytes per second the link can carry (baud / 10 for 8N1,
+## derated for the radio) and how many are queued but not yet on the air. The
+## queue estimate is the larger of the model's own backlog and pyserial's
+## out_waiting, when the port reports it.
+##
+## As link utilization rises the controller steps up through levels with
+## larger per-channel change thresholds, so stick noise stops generating
+## frames. Levels only move down again once utilization has fallen well below
+## the level's entry point (hysteresis). When the backlog would add more than
+## MAX_QUEUE_MS of latency, changes are held back entirely; the pipeline keeps
+## comparing against the last value sent, so the newest value goes out as
+## soon as the queue drains (coalescing).
+##
+## Never throttled: keep-alives, commands (mode changes, PID setup), a channel
+## returning to neutral (127) and a channel reversing direction.
+################################################################################
+
+NEUTRAL_VALUE = 127
+
+# Fraction of the raw serial rate the radio can sustain
+BUDGET_FRACTION = 0.5
+
+# Hold back changes while the queue would take longer than this to drain
+MAX_QUEUE_MS = 20
+
+# Per-level change thresholds for (left, right, arm), and the utilization that
+# moves to the next level up / back to the level below
+LEVEL_THRESHOLDS = [(1, 1, 1), (2, 2, 1), (4, 4, 2), (8, 8, 4)]
+LEVEL_UP_UTILIZATION = [0.50, 0.70, 0.85]    # leave level i for i+1 above this
+LEVEL_DOWN_UTILIZATION = [0.30, 0.50, 0.65]  # leave level i+1 for i below this
+
+# Smoothing of the measured byte rate and backlog (time constant in seconds)
+RATE_TIME_CONSTANT_S = 0.25
+
+
+class RateController:
+
+    ############################################################
+    ## @brief  Set up the link model
+    ## @param  baud - serial baud rate
+    ## @param  budgetFraction - share of the raw rate the link can sustain
+    ## @param  clock - monotonic nanosecond clock (replaceable for simulation)
+    ############################################################
+    def __init__(self, baud=57600, budgetFraction=BUDGET_FRACTION, clock=time.monotonic_ns):
+        self.budgetBytesPerS = baud / 10.0 * budgetFraction
+        self.maxBacklogBytes = self.budgetBytesPerS * MAX_QUEUE_MS / 1000.0
+        self.clock = clock
+
+        self.lastUpdateNs = None
+        self.modelBacklog = 0.0   # bytes the model thinks are still queued
+        self.backlog = 0.0        # max of the model and out_waiting
+        self.byteRate = 0.0       # smoothed bytes/s handed to the link
+        self.queueRate = 0.0      # smoothed backlog, as the bytes/s needed to drain it within MAX_QUEUE_MS
+        self.bytesThisCycle = 0
+        self.utilization = 0.0
+        self.level = 0
+        self.thresholds = LEVEL_THRESHOLDS[0]
+
+        # Statistics
+        self.framesAllowed = 0
+        self.framesHeld = 0       # changes below the threshold or held for the queue
+        self.queueHolds = 0
+        self.levelChanges = 0
+        self.maxLevel = 0
+        self.maxBacklog = 0.0
+
+    ############################################################
+    ## @brief  Update the link model; call once per control cycle
+    ## @param  outWaiting - bytes in the serial driver's output buffer, or None if unknown
+    ############################################################
+    def update(self, outWaiting=None):
+        now = self.clock()
+        if self.lastUpdateNs is None:
+            self.lastUpdateNs = now
+        dtS = (now - self.lastUpdateNs) / 1e9
+        self.lastUpdateNs = now
+
+        # Drain the modelled queue
+        if dtS > 0:
+            self.modelBacklog -= self.budgetBytesPerS * dtS
+            if self.modelBacklog < 0.0:
+                self.modelBacklog = 0.0
+
+        backlog = self.modelBacklog
+        if outWaiting is not None and outWaiting > backlog:
+            backlog = float(outWaiting)
+        self.backlog = backlog
+        if backlog > self.maxBacklog:
+            self.maxBacklog = backlog
+
+        # Utilization counts both the sending rate and anything already queued, smoothed so
+        # single frames do not flip the level back and forth
+        if dtS > 0:
+            alpha = dtS / RATE_TIME_CONSTANT_S
+            if alpha > 1.0:
+                alpha = 1.0
+            self.byteRate += (self.bytesThisCycle / dtS - self.byteRate) * alpha
+            self.queueRate += (backlog * 1000.0 / MAX_QUEUE_MS - self.queueRate) * alpha
+            self.bytesThisCycle = 0
+        self.utilization = (self.byteRate + self.queueRate) / self.budgetBytesPerS
+
+        level = self.level
+        if level < len(LEVEL_UP_UTILIZATION) and self.utilization > LEVEL_UP_UTILIZATION[level]:
+            level += 1
+        elif level > 0 and self.utilization < LEVEL_DOWN_UTILIZATION[level - 1]:
+            level -= 1
+        if level != self.level:
+            self.level = level
+            self.thresholds = LEVEL_THRESHOLDS[level]
+            self.levelChanges += 1
+            if level > self.maxLevel:
+                self.maxLevel = level
+
+    ############################################################
+    ## @brief  Decide whether changed drive values are worth a frame now
+    ## @param  prevLeft, left, prevRight, right, prevArm, arm - last sent and current values
+    ## @return true to send (the caller still sends keep-alives and commands unconditionally)
+    ############################################################
+    def allow(self, prevLeft, left, prevRight, right, prevArm, arm):
+        if urgent(prevLeft, left) or urgent(prevRight, right) or urgent(prevArm, arm):
+            self.framesAllowed += 1
+            return True
+
+        if self.backlog > self.maxBacklogBytes:
+            self.queueHolds += 1
+            self.framesHeld += 1
+            return False
+
+        thresholds = self.thresholds
+        if abs(left - prevLeft) >= thresholds[0] or abs(right - prevRight) >= thresholds[1] or \
+           abs(arm - prevArm) >= thresholds[2]:
+            self.framesAllowed += 1
+            return True
+        self.framesHeld += 1
+        return False
+
+    ############################################################
+    ## @brief  Account for a frame handed to the link
+    ## @param  numBytes - frame length
+    ############################################################
+    def frameSent(self, numBytes):
+        self.modelBacklog += numBytes
+        self.bytesThisCycle += numBytes
+
+    ############################################################
+    ## @brief  One-line summary of the controller statistics
+    ############################################################
+    def summary(self):
+        return "rate: {:.0f} B/s of {:.0f} ({:.0f}%), level: {} (max {}, {} changes), " \
+               "allowed: {}, held: {} ({} for the queue), max backlog: {:.0f} B".format(
+                   self.byteRate, self.budgetBytesPerS, self.utilization * 100.0, self.level,
+                   self.maxLevel, self.levelChanges, self.framesAllowed, self.framesHeld,
+                   self.queueHolds, self.maxBacklog)
+
+
+############################################################
+## @brief  Changes that always go out: back to neutral or reversing direction
+############################################################
+def urgent(prev, value):
+    if value == prev:
+        return False
+    if value == NEUTRAL_VALUE:
+        return True
+    return (prev - NEUTRAL_VALUE) * (value - NEUTRAL_VALUE) < 0
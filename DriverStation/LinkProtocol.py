@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import tty
+
+import FrameEncoder
+
+################################################################################
+## Robot link protocol v2, negotiated at startup with fallback to v1
+##
+## v1 (FrameEncoder.py) is 255 followed by left/right/arm, with arm values
+## 123-126 used as in-band commands that are sent several times blindly.
+##
+## v2 frames start with their own sync byte, carry a sequence number and end
+## with a CRC-8 (polynomial 0x07) over everything after the sync byte:
+##
+##   Drive frame:    254, <mask:3 | seq:5>, <value for each bit set in mask>, <crc>
+##                     mask bit 0 = left, bit 1 = right, bit 2 = arm; values 0-254
+##                     with no reserved values. Only channels that changed are
+##                     sent; a keep-alive, and at least every FULL_FRAME_INTERVAL-th
+##                     frame, carries all three (mask 7) so a lost delta is repaired.
+##   Control frame:  254, <0:3 | seq:5>, <code>, <cmdSeq>, <len>, <payload>, <crc>
+##                     code 123-126 = the v1 reserved-value commands (126 payload:
+##                     FrameEncoder.encodePidPayload()), code 6 = ACK of cmdSeq,
+##                     code 7 = robot telemetry (Telemetry.py, sent with either protocol)
+##
+## Commands are sent once and attached to the following frames until the robot
+## ACKs their cmdSeq (a repeat of an already executed cmdSeq is only ACKed).
+##
+## Negotiation: the driver station sends HELLO (255, 255, 'B', 'B', <version>)
+## and the robot answers with the same bytes. v1 firmware drops the 3-byte body
+## after the start byte because it contains 255, and skips the version byte, so
+## the HELLO is harmless to it; with no answer the driver station stays on v1.
+## A v2 receiver accepts v1 frames until it sees a HELLO.
+##
+## Usage: python LinkProtocol.py --pty   (reference receiver behind a pty)
+################################################################################
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+
+SYNC_V2 = 254
+HELLO = bytes((FrameEncoder.START_BYTE, FrameEncoder.START_BYTE, ord('B'), ord('B'), PROTOCOL_V2))
+
+MASK_LEFT = 1
+MASK_RIGHT = 2
+MASK_ARM = 4
+MASK_ALL = 7
+SEQ_MASK = 0x1F
+
+CONTROL_ACK = 6
+CONTROL_TELEMETRY = 7
+CONTROL_RESET_ARM_POS = 123
+CONTROL_ENTER_ARM_AUTO = 124
+CONTROL_ENTER_ARM_MANUAL = 125
+CONTROL_SET_PID_GAINS = 126
+
+CONTROL_HEADER_SIZE = 5   # sync, header, code, cmdSeq, len
+MAX_PAYLOAD = 255
+
+NEGOTIATE_ATTEMPTS = 3
+NEGOTIATE_TIMEOUT_S = 0.1
+
+# Give up on a command after it has gone out with this many frames without an ACK
+MAX_COMMAND_SENDS = 20
+
+# Send all three channels at least every this many drive frames, so a lost delta
+# frame is corrected even while other channels keep changing (5 frames is one
+# keep-alive period at 100Hz)
+FULL_FRAME_INTERVAL = 5
+
+
+def makeCrc8Table():
+    table = []
+    for i in range(0, 256):
+        crc = i
+        for bit in range(0, 8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+CRC8_TABLE = makeCrc8Table()
+
+
+############################################################
+## @brief  CRC-8 (polynomial 0x07, initial value 0)
+## @param  data - bytes-like
+## @param  start, end - range of data to cover
+############################################################
+def crc8(data, start=0, end=None):
+    if end is None:
+        end = len(data)
+    crc = 0
+    table = CRC8_TABLE
+    for i in range(start, end):
+        crc = table[crc ^ data[i]]
+    return crc
+
+
+############################################################
+## @brief  Build a complete control frame
+############################################################
+def encodeControl(seq, code, cmdSeq, payload=b''):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError("Control payload too long")
+    frame = bytearray((SYNC_V2, seq & SEQ_MASK, code, cmdSeq, len(payload)))
+    frame += payload
+    frame.append(crc8(frame, 1))
+    return bytes(frame)
+
+
+############################################################
+## @brief  Offer v2 to the robot and wait for its answer
+## @param  ser - open serial port (its timeout is restored afterwards)
+## @return PROTOCOL_V2 if the robot answered, else PROTOCOL_V1
+############################################################
+def negotiate(ser, attempts=NEGOTIATE_ATTEMPTS, timeoutS=NEGOTIATE_TIMEOUT_S):
+    savedTimeout = ser.timeout
+    ser.timeout = timeoutS
+    try:
+        for attempt in range(0, attempts):
+            ser.write(HELLO)
+            received = bytearray()
+            deadline = time.monotonic() + timeoutS
+            while time.monotonic() < deadline:
+                received += ser.read(max(1, ser.in_waiting))
+                if HELLO in received:
+                    return PROTOCOL_V2
+    finally:
+        ser.timeout = savedTimeout
+    return PROTOCOL_V1
+
+
+################################################################################
+## @brief  Packs v2 frames into one preallocated buffer
+##
+## Drop-in for FrameEncoder.FrameEncoder when the robot speaks v2: command()
+## takes the same left/right/arm values plus the pipeline's pending command.
+################################################################################
+class FrameEncoderV2:
+
+    def __init__(self, errorOrMeasurement='E', gains=("0", "0", "0", "0")):
+
+        self.buf = bytearray(CONTROL_HEADER_SIZE + MAX_PAYLOAD + 1 + 6)
+        self.view = memoryview(self.buf)
+        self.seq = 0
+        self.cmdSeq = 0
+        self.lastSent = None        # (left, right, arm) the robot has, or None to send all three
+        self.deltaRun = 0           # delta frames since the last full frame
+
+        # Command waiting for an ACK: (code, cmdSeq, payload), and how often it went out
+        self.pending = None
+        self.pendingSends = 0
+
+        # The neutral burst is built once; it uses cmdSeq 0, which command() never does
+        neutral = bytearray()
+        for i in range(0, FrameEncoder.NEUTRAL_REPEAT_COUNT):
+            neutral += encodeControl(2 * i, CONTROL_ENTER_ARM_MANUAL, 0)
+            neutral += self.driveFrame(2 * i + 1, FrameEncoder.NEUTRAL_VALUE, FrameEncoder.NEUTRAL_VALUE,
+                                       FrameEncoder.NEUTRAL_VALUE)
+        self.neutralFrames = bytes(neutral)
+
+        self.decoder = FrameDecoderV2(v1Frames=False)
+
+        # Counters
+        self.commandsSent = 0
+        self.commandResends = 0
+        self.commandsAcked = 0
+        self.commandsAbandoned = 0  # superseded or out of attempts before an ACK
+        self.deltaFrames = 0
+        self.fullFrames = 0
+
+        self.setPidGains(errorOrMeasurement, gains)
+
+    def setPidGains(self, errorOrMeasurement, gains):
+        self.pidPayload = FrameEncoder.encodePidPayload(errorOrMeasurement, gains)
+
+    @staticmethod
+    def driveFrame(seq, left, right, arm):
+        frame = bytearray((SYNC_V2, (MASK_ALL << 5) | (seq & SEQ_MASK), left, right, arm))
+        frame.append(crc8(frame, 1))
+        return frame
+
+    ############################################################
+    ## @brief  Pack the pending command (if any) and a drive frame
+    ## @param  left, right, arm - motor commands from 0 to 254
+    ## @param  linkCommand - CONTROL_* code issued this cycle, or None
+    ## @param  keepAlive - the frame is a keep-alive; send all three channels
+    ## @return memoryview of the shared frame buffer (valid until the next call)
+    ############################################################
+    def command(self, left, right, arm, linkCommand=None, keepAlive=False):
+
+        buf = self.buf
+        table = CRC8_TABLE
+        pos = 0
+
+        if linkCommand is not None:
+            if self.pending is not None:
+                self.commandsAbandoned += 1
+            self.cmdSeq = self.cmdSeq % 255 + 1
+            payload = self.pidPayload if linkCommand == CONTROL_SET_PID_GAINS else b''
+            self.pending = (linkCommand, self.cmdSeq, payload)
+            self.pendingSends = 0
+            self.commandsSent += 1
+        elif self.pending is not None:
+            if self.pendingSends >= MAX_COMMAND_SENDS:
+                self.pending = None
+                self.commandsAbandoned += 1
+            else:
+                self.commandResends += 1
+
+        if self.pending is not None:
+            (code, cmdSeq, payload) = self.pending
+            self.pendingSends += 1
+            end = CONTROL_HEADER_SIZE + len(payload)
+            buf[0] = SYNC_V2
+            buf[1] = self.seq
+            buf[2] = code
+            buf[3] = cmdSeq
+            buf[4] = len(payload)
+            buf[CONTROL_HEADER_SIZE:end] = payload
+            crc = 0
+            for i in range(1, end):
+                crc = table[crc ^ buf[i]]
+            buf[end] = crc
+            pos = end + 1
+            self.seq = (self.seq + 1) & SEQ_MASK
+
+        # Drive frame with only the channels that changed (all of them for a keep-alive
+        # and every FULL_FRAME_INTERVAL-th frame)
+        lastSent = self.lastSent
+        if lastSent is None or keepAlive or self.deltaRun >= FULL_FRAME_INTERVAL - 1:
+            mask = MASK_ALL
+        else:
+            mask = (MASK_LEFT if left != lastSent[0] else 0) | \
+                   (MASK_RIGHT if right != lastSent[1] else 0) | \
+                   (MASK_ARM if arm != lastSent[2] else 0)
+            if mask == 0:
+                mask = MASK_ALL
+        if mask == MASK_ALL:
+            self.fullFrames += 1
+            self.deltaRun = 0
+        else:
+            self.deltaFrames += 1
+            self.deltaRun += 1
+
+        start = pos
+        buf[pos] = SYNC_V2
+        buf[pos + 1] = (mask << 5) | self.seq
+        pos += 2
+        if mask & MASK_LEFT:
+            buf[pos] = left
+            pos += 1
+        if mask & MASK_RIGHT:
+            buf[pos] = right
+            pos += 1
+        if mask & MASK_ARM:
+            buf[pos] = arm
+            pos += 1
+        crc = 0
+        for i in range(start + 1, pos):
+            crc = table[crc ^ buf[i]]
+        buf[pos] = crc
+        pos += 1
+        self.seq = (self.seq + 1) & SEQ_MASK
+
+        self.lastSent = (left, right, arm)
+        return self.view[:pos]
+
+    ############################################################
+    ## @brief  Send all three channels with the next frame
+    ##
+    ## Call when a frame from command() did not reach the wire (e.g. it was
+    ## replaced in SerialWriter's drive mailbox), since later frames only
+    ## carry what changed since it.
+    ############################################################
+    def resync(self):
+        self.lastSent = None
+        self.deltaRun = 0
+
+    ############################################################
+    ## @brief  Handle bytes received from the robot (ACKs)
+    ############################################################
+    def processReplies(self, data):
+        for frame in self.decoder.feed(data):
+            if frame[0] == 'control' and frame[2] == CONTROL_ACK:
+                self.ackReceived(frame[3])
+
+    ############################################################
+    ## @brief  The robot ACKed cmdSeq (also called by Telemetry.TelemetryReceiver)
+    ############################################################
+    def ackReceived(self, cmdSeq):
+        if self.pending is not None and self.pending[1] == cmdSeq:
+            self.pending = None
+            self.commandsAcked += 1
+
+    ############################################################
+    ## @brief  Frames sent by DriverStation.ControlLoop.sendNeutral(): leave arm auto mode, then zero everything
+    ############################################################
+    def neutral(self):
+        return self.neutralFrames
+
+    def summary(self):
+        return "v2 frames full: {}, delta: {} | commands: {}, resends: {}, acked: {}, abandoned: {}".format(
+            self.fullFrames, self.deltaFrames, self.commandsSent, self.commandResends,
+            self.commandsAcked, self.commandsAbandoned)
+
+
+################################################################################
+## @brief  Incremental decoder for v2 frames (and optionally v1 frames)
+################################################################################
+class FrameDecoderV2:
+
+    ############################################################
+    ## @param  v1Frames - also accept v1 frames and PID setup packets
+    ############################################################
+    def __init__(self, v1Frames=True):
+        self.v1Frames = v1Frames
+        self.v1 = FrameEncoder.FrameDecoder()
+        self.buf = bytearray()
+        self.crcErrors = 0
+        self.skippedBytes = 0
+
+    ############################################################
+    ## @brief  Add bytes from the link and return any complete frames
+    ## @return list of ('drive', seq, mask, left, right, arm) (None for channels not in mask),
+    ##         ('control', seq, code, cmdSeq, payload), ('hello', version),
+    ##         and with v1Frames: ('cmd', left, right, arm), ('setup', errorOrMeasurement, values)
+    ############################################################
+    def feed(self, data):
+
+        self.buf += data
+        buf = self.buf
+        frames = []
+        pos = 0
+        n = len(buf)
+
+        while pos < n:
+            b = buf[pos]
+
+            if b == SYNC_V2:
+                if n - pos < 2:
+                    break
+                header = buf[pos + 1]
+                mask = header >> 5
+                if mask == 0:
+                    if n - pos < CONTROL_HEADER_SIZE:
+                        break
+                    end = pos + CONTROL_HEADER_SIZE + buf[pos + 4]
+                else:
+                    end = pos + 2 + (mask & 1) + ((mask >> 1) & 1) + (mask >> 2)
+                if end >= n:
+                    break
+                if crc8(buf, pos + 1, end) != buf[end]:
+                    self.crcErrors += 1
+                    pos += 1
+                    continue
+                seq = header & SEQ_MASK
+                if mask == 0:
+                    frames.append(('control', seq, buf[pos + 2], buf[pos + 3],
+                                   bytes(buf[pos + CONTROL_HEADER_SIZE:end])))
+                else:
+                    values = [None, None, None]
+                    i = pos + 2
+                    for channel in range(0, 3):
+                        if mask & (1 << channel):
+                            values[channel] = buf[i]
+                            i += 1
+                    frames.append(('drive', seq, mask, values[0], values[1], values[2]))
+                pos = end + 1
+
+            elif b == FrameEncoder.START_BYTE:
+                if n - pos < FrameEncoder.COMMAND_FRAME_SIZE:
+                    break
+                if buf[pos + 1] == FrameEncoder.START_BYTE and buf[pos + 2] == HELLO[2] and \
+                   buf[pos + 3] == HELLO[3]:
+                    if n - pos < len(HELLO):
+                        break
+                    frames.append(('hello', buf[pos + 4]))
+                    pos += len(HELLO)
+                elif not self.v1Frames:
+                    self.skippedBytes += 1
+                    pos += 1
+                else:
+                    left = buf[pos + 1]
+                    right = buf[pos + 2]
+                    arm = buf[pos + 3]
+                    setupValue = FrameEncoder.SETUP_VALUE
+                    if left == setupValue and right == setupValue and arm == setupValue:
+                        setup = self.v1.parseSetup(buf, pos + FrameEncoder.COMMAND_FRAME_SIZE)
+                        if setup is None:
+                            break
+                        if setup[0] is not None:
+                            frames.append(setup[0])
+                        pos = setup[1]
+                    else:
+                        if left < 255 and right < 255 and arm < 255:
+                            frames.append(('cmd', left, right, arm))
+                        pos += FrameEncoder.COMMAND_FRAME_SIZE
+
+            else:
+                self.skippedBytes += 1
+                pos += 1
+
+        del buf[:pos]
+        return frames
+
+
+################################################################################
+## @brief  Reference robot-side receiver
+##
+## Turns the byte stream into the motor values and commands the firmware acts
+## on, for either protocol, and produces the bytes to send back (HELLO answer
+## and ACKs). v1 frames are accepted until the driver station says HELLO.
+################################################################################
+class ReferenceReceiver:
+
+    def __init__(self):
+        self.decoder = FrameDecoderV2(v1Frames=True)
+        self.protocol = PROTOCOL_V1
+        self.left = FrameEncoder.NEUTRAL_VALUE
+        self.right = FrameEncoder.NEUTRAL_VALUE
+        self.arm = FrameEncoder.NEUTRAL_VALUE
+        self.reply = bytearray()
+        self.txSeq = 0
+        self.lastSeq = None
+        self.lastCmdSeq = None
+
+        # Statistics
+        self.framesAccepted = 0
+        self.seqGaps = 0            # frames missing according to the sequence numbers
+        self.duplicateCommands = 0  # resent commands that had already been executed
+
+    ############################################################
+    ## @brief  Process received bytes
+    ## @return list of ('drive', left, right, arm) and ('command', code, args) events,
+    ##         where args is (errorOrMeasurement, [Kp, Ki, Kd, armScale]) for CONTROL_SET_PID_GAINS
+    ############################################################
+    def feed(self, data):
+        events = []
+        for frame in self.decoder.feed(data):
+            kind = frame[0]
+
+            if kind == 'hello':
+                self.reply += HELLO
+                self.protocol = PROTOCOL_V2
+                self.decoder.v1Frames = False
+                self.lastSeq = None
+                continue
+
+            self.framesAccepted += 1
+            if kind == 'cmd':
+                (left, right, arm) = frame[1:]
+                if CONTROL_RESET_ARM_POS <= arm <= CONTROL_ENTER_ARM_MANUAL:
+                    events.append(('command', arm, None))
+                    arm = self.arm
+                self.setDrive(events, left, right, arm)
+            elif kind == 'setup':
+                events.append(('command', CONTROL_SET_PID_GAINS, (frame[1], frame[2])))
+            else:
+                seq = frame[1]
+                if self.lastSeq is not None:
+                    self.seqGaps += (seq - self.lastSeq - 1) & SEQ_MASK
+                self.lastSeq = seq
+                if kind == 'drive':
+                    self.setDrive(events,
+                                  self.left if frame[3] is None else frame[3],
+                                  self.right if frame[4] is None else frame[4],
+                                  self.arm if frame[5] is None else frame[5])
+                else:
+                    self.control(events, frame[2], frame[3], frame[4])
+        return events
+
+    def setDrive(self, events, left, right, arm):
+        self.left = left
+        self.right = right
+        self.arm = arm
+        events.append(('drive', left, right, arm))
+
+    def control(self, events, code, cmdSeq, payload):
+        if code == CONTROL_ACK:
+            return
+        self.reply += encodeControl(self.txSeq, CONTROL_ACK, cmdSeq)
+        self.txSeq = (self.txSeq + 1) & SEQ_MASK
+        if cmdSeq == self.lastCmdSeq:
+            self.duplicateCommands += 1
+            return
+        self.lastCmdSeq = cmdSeq
+        args = None
+        if code == CONTROL_SET_PID_GAINS:
+            setup = self.decoder.v1.parseSetup(payload, 0)
+            if setup is None or setup[0] is None:
+                return
+            args = (setup[0][1], setup[0][2])
+        events.append(('command', code, args))
+
+    ############################################################
+    ## @brief  Bytes to send back to the driver station (clears them)
+    ############################################################
+    def takeReply(self):
+        reply = bytes(self.reply)
+        del self.reply[:]
+        return reply
+
+    def summary(self):
+        return "protocol v{} L={} R={} A={} | frames={} crcErrors={} seqGaps={} duplicateCommands={}".format(
+            self.protocol, self.left, self.right, self.arm, self.framesAccepted,
+            self.decoder.crcErrors, self.seqGaps, self.duplicateCommands)
+
+
+############################################################
+## @brief  Run the reference receiver behind a pty, printing what it receives
+############################################################
+def runPty():
+    (master, slave) = os.openpty()
+    tty.setraw(slave)
+    print("Reference receiver listening on", os.ttyname(slave), "(set comPort in DriverStation.py to this)")
+
+    receiver = ReferenceReceiver()
+    printed = 0
+    try:
+        while True:
+            data = os.read(master, 4096)
+            for event in receiver.feed(data):
+                if event[0] == 'command':
+                    print("Command", event[1], event[2] if event[2] is not None else "")
+            reply = receiver.takeReply()
+            if reply:
+                os.write(master, reply)
+            if receiver.framesAccepted // 100 != printed:
+                printed = receiver.framesAccepted // 100
+                print(receiver.summary())
+    except KeyboardInterrupt:
+        print(receiver.summary())
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def main():
+    if '--pty' in sys.argv[1:]:
+        runPty()
+    else:
+        print("Usage: python LinkProtocol.py --pty")
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
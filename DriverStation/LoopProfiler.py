@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+import collections
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+
+import StageMetrics
+
+################################################################################
+## On-demand profiling of the running control loop
+##
+## Two profilers, started and stopped while the driver station is running:
+##   sampling  -- a thread snapshots the loop thread's stack (and the transmit
+##                thread's) every SAMPLE_INTERVAL_S until toggled off, and
+##                writes collapsed stacks (flamegraph.pl / speedscope input)
+##   capture   -- cProfile over the next CAPTURE_CYCLES control cycles, written
+##                as one pstats file per loop stage plus one for the whole loop
+##
+## Both are tagged by the stage of StageMetrics.LoopMetrics the loop was in:
+## events (gamepad.update(), the old event.pump), watchdog, compute
+## (arcadeDrive/armDrive tables in CommandPipeline.nextFrame()), print, write,
+## record, cycle (the rest of the cycle) and wait (the scheduler sleep between
+## cycles). Transmit thread samples are tagged ser.write.
+##
+## Disabled, the profiler costs nothing: it is not in the loop at all. Starting
+## one replaces the metrics object's beginCycle/endStage/endCycle with
+## profiling versions (instance attributes shadowing the class methods);
+## stopping deletes them again.
+##
+## Triggers: SIGUSR2 toggles sampling; typing 's' or 'c' + Enter on the console
+## toggles sampling or starts a capture (the console keys also work on Windows).
+################################################################################
+
+SAMPLE_INTERVAL_S = 0.005   # sampling period (each sample holds the GIL for a few us)
+SAMPLE_SWITCH_INTERVAL_S = 0.0005   # GIL switch interval while sampling (see startSampling())
+CAPTURE_CYCLES = 500        # control cycles in a cProfile capture
+MAX_STACK_DEPTH = 64
+
+KEY_SAMPLING = 's'
+KEY_CAPTURE = 'c'
+
+WAIT_TAG = 'wait'
+WRITER_TAG = 'ser.write'
+
+
+class LoopProfiler:
+
+    ############################################################
+    ## @param  metrics - StageMetrics.LoopMetrics the loop reports its stages to
+    ## @param  outDir - directory for the profile files
+    ## @param  report - function called with a line of text when a profile starts or is written
+    ## @param  writerThread - transmit thread to sample as well, or None
+    ############################################################
+    def __init__(self, metrics, outDir, report=print, writerThread=None):
+        self.metrics = metrics
+        self.outDir = outDir
+        self.report = report
+        self.writerThread = writerThread
+        self.pending = None         # 'sample' or 'capture' to apply at the start of the next cycle
+
+        # Sampling state
+        self.sampling = False
+        self.samplerStop = None
+        self.samplerThread = None
+        self.loopIdent = None
+        self.switchInterval = None
+        self.samples = collections.deque()         # untagged loop stacks from the sampler thread
+        self.counts = collections.Counter()        # collapsed stack -> samples (loop thread)
+        self.writerCounts = collections.Counter()  # collapsed stack -> samples (sampler thread)
+        self.codeNames = {}
+
+        # Capture state
+        self.capturing = False
+        self.current = None
+        self.segments = None
+        self.cyclesLeft = 0
+        self.writers = []
+
+    ############################################################
+    ## @brief  SIGUSR2 toggles sampling; console keys toggle sampling or start a capture
+    ############################################################
+    def installTriggers(self):
+        sig = getattr(signal, 'SIGUSR2', None)
+        if sig is not None:
+            def handler(signum, frame):
+                self.request('sample')
+            signal.signal(sig, handler)
+
+        if sys.stdin is not None and sys.stdin.isatty():
+            thread = threading.Thread(target=self.readKeys, name="LoopProfilerKeys")
+            thread.daemon = True
+            thread.start()
+
+    def readKeys(self):
+        for line in sys.stdin:
+            key = line.strip().lower()
+            if key == KEY_SAMPLING:
+                self.request('sample')
+            elif key == KEY_CAPTURE:
+                self.request('capture')
+
+    ############################################################
+    ## @brief  Toggle sampling or start a capture at the start of the next cycle
+    ## @param  what - 'sample' or 'capture'
+    ##
+    ## Safe to call from a signal handler or another thread: it only installs
+    ## the beginCycle hook, which does the work on the loop thread.
+    ############################################################
+    def request(self, what):
+        self.pending = what
+        self.metrics.beginCycle = self.beginCycle
+
+    ############################################################
+    ## Hooks, installed on the metrics object only while needed
+    ############################################################
+    def beginCycle(self):
+        if self.pending is not None:
+            what = self.pending
+            self.pending = None
+            if what == 'sample':
+                if self.sampling:
+                    self.stopSampling()
+                else:
+                    self.startSampling()
+            elif what == 'capture' and not self.capturing:
+                self.startCapture()
+            self.updateHooks()
+
+        if self.sampling:
+            self.tag(WAIT_TAG)
+        StageMetrics.LoopMetrics.beginCycle(self.metrics)
+        if self.capturing:
+            self.current.enable()
+
+    def endStage(self, stage):
+        name = StageMetrics.STAGE_NAMES[stage]
+        if self.capturing:
+            self.nextSegment(name)
+        if self.sampling:
+            self.tag(name)
+        StageMetrics.LoopMetrics.endStage(self.metrics, stage)
+
+    def endCycle(self):
+        name = StageMetrics.STAGE_NAMES[StageMetrics.STAGE_CYCLE]
+        if self.capturing:
+            self.current.disable()
+            self.segments[name].append(self.current)
+            self.current = cProfile.Profile()
+            self.cyclesLeft -= 1
+            if self.cyclesLeft <= 0:
+                self.stopCapture()
+                self.updateHooks()
+        if self.sampling:
+            self.tag(name)
+        StageMetrics.LoopMetrics.endCycle(self.metrics)
+
+    def updateHooks(self):
+        metrics = self.metrics
+        active = self.sampling or self.capturing
+        for name in ('beginCycle', 'endStage', 'endCycle'):
+            if active:
+                setattr(metrics, name, getattr(self, name))
+            elif name in metrics.__dict__ and self.pending is None:
+                delattr(metrics, name)
+
+    ############################################################
+    ## Sampling
+    ############################################################
+    def startSampling(self):
+        # The sampler thread can only look at the loop when it gets the GIL, which a
+        # busy loop thread only gives up every switch interval (5ms by default), so
+        # samples would pile up at the scheduler sleep. Hand the GIL over more often
+        # while sampling.
+        self.switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switchInterval, SAMPLE_SWITCH_INTERVAL_S))
+        self.sampling = True
+        self.loopIdent = threading.get_ident()
+        self.samples.clear()
+        self.counts = collections.Counter()
+        self.writerCounts = collections.Counter()
+        self.samplerStop = threading.Event()
+        self.startedAt = time.strftime("%Y%m%d_%H%M%S")
+        self.samplerThread = threading.Thread(target=self.sample, args=(self.samplerStop, self.writerCounts),
+                                              name="LoopProfiler")
+        self.samplerThread.daemon = True
+        self.samplerThread.start()
+        self.report("Profiler -- sampling every {:.0f}ms".format(SAMPLE_INTERVAL_S * 1000))
+
+    def stopSampling(self):
+        self.sampling = False
+        self.samplerStop.set()
+        sys.setswitchinterval(self.switchInterval)
+        path = os.path.join(self.outDir, "profile_" + self.startedAt + "_samples.collapsed")
+        self.writeInBackground(self.writeCollapsed, path, (self.samplerThread, self.counts, self.writerCounts))
+
+    ############################################################
+    ## @brief  Sampler thread body
+    ############################################################
+    def sample(self, stop, writerCounts):
+        interval = SAMPLE_INTERVAL_S
+        writerIdent = self.writerThread.ident if self.writerThread is not None else None
+        while not stop.wait(interval):
+            frames = sys._current_frames()
+            frame = frames.get(self.loopIdent)
+            if frame is not None:
+                self.samples.append(self.stack(frame))
+            frame = frames.get(writerIdent) if writerIdent is not None else None
+            if frame is not None:
+                writerCounts[WRITER_TAG + ';' + self.stack(frame)] += 1
+            del frames, frame
+
+    ############################################################
+    ## @brief  Collapsed stack of a frame, root first
+    ############################################################
+    def stack(self, frame):
+        names = []
+        codeNames = self.codeNames
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            name = codeNames.get(code)
+            if name is None:
+                name = os.path.basename(code.co_filename) + ':' + code.co_name
+                codeNames[code] = name
+            names.append(name)
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+    ############################################################
+    ## @brief  Attribute the samples taken since the last call to a stage
+    ############################################################
+    def tag(self, name, counts=None):
+        samples = self.samples
+        if counts is None:
+            counts = self.counts
+        while samples:
+            counts[name + ';' + samples.popleft()] += 1
+
+    ############################################################
+    ## cProfile capture
+    ############################################################
+    def startCapture(self):
+        self.capturing = True
+        self.cyclesLeft = CAPTURE_CYCLES
+        self.segments = collections.defaultdict(list)
+        self.current = cProfile.Profile()
+        self.report("Profiler -- capturing {} cycles with cProfile".format(CAPTURE_CYCLES))
+
+    def nextSegment(self, name):
+        self.current.disable()
+        self.segments[name].append(self.current)
+        self.current = cProfile.Profile()
+        self.current.enable()
+
+    def stopCapture(self):
+        self.capturing = False
+        self.current = None
+        path = os.path.join(self.outDir, time.strftime("profile_%Y%m%d_%H%M%S_cprofile"))
+        self.writeInBackground(self.writeStats, path, self.segments)
+        self.segments = None
+
+    ############################################################
+    ## Output (formatting and file writes stay off the loop thread)
+    ############################################################
+    def writeInBackground(self, fn, path, data):
+        thread = threading.Thread(target=fn, args=(path, data), name="LoopProfilerWriter")
+        thread.start()
+        self.writers.append(thread)
+
+    def writeCollapsed(self, path, data):
+        (sampler, counts, writerCounts) = data
+        sampler.join()
+        # Samples the loop took after its last stage ran up to the stop
+        self.tag(WAIT_TAG, counts)
+        counts.update(writerCounts)
+        self.makeOutDir()
+        with open(path, 'w') as f:
+            for (stack, count) in sorted(counts.items()):
+                f.write("{} {}\n".format(stack, count))
+        self.report("Profiler -- {} samples written to {}".format(sum(counts.values()), path))
+
+    def writeStats(self, path, segments):
+        self.makeOutDir()
+        combined = None
+        for (name, profiles) in segments.items():
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(path + "_" + name + ".pstats")
+            if combined is None:
+                combined = pstats.Stats(*profiles)
+            else:
+                combined.add(*profiles)
+        if combined is not None:
+            combined.dump_stats(path + ".pstats")
+        self.report("Profiler -- cProfile capture written to {}*.pstats".format(path))
+
+    ############################################################
+    ## @brief  Write out whatever is still running and wait for the files
+    ############################################################
+    def close(self):
+        if self.sampling:
+            self.stopSampling()
+        if self.capturing:
+            self.current.disable()
+            self.stopCapture()
+        self.updateHooks()
+        for thread in self.writers:
+            thread.join()
+        self.writers = []
+
+    def makeOutDir(self):
+        if not os.path.isdir(self.outDir):
+            os.makedirs(self.outDir)
+
+
+############################################################
+## @brief  Print the top functions of a pstats file
+############################################################
+def main():
+    args = sys.argv[1:]
+    if not args:
+        print("Usage: python LoopProfiler.py <file.pstats> [count]")
+        return 1
+    pstats.Stats(args[0]).sort_stats('cumulative').print_stats(int(args[1]) if len(args) > 1 else 25)
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
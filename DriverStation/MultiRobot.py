@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+import asyncio
+import configparser
+import os
+import sys
+import serial
+import pygame
+
+import DriverStation
+import ControlScheduler
+import GamepadInput
+import AsyncRuntime
+import StationLog
+
+################################################################################
+## Drive several robots, each from its own gamepad, from one process
+##
+## Every robot gets its own serial port, CommandPipeline (arm mode, resend
+## counters), encoder, keep-alive tracking and gamepad watchdog, wrapped in an
+## AsyncRuntime.DriverStationRuntime. One event loop serves all the ports, and
+## a single sampler task paces the control loop:
+##   - reads the pygame event queue once and hands each event to every gamepad
+##     (each one only keeps events from its own joystick); a replugged joystick
+##     goes to the gamepad that lost one with the same GUID, and is left
+##     unassigned when that could be more than one robot
+##   - wakes the robots' compute tasks in an order that rotates every cycle, so
+##     no robot always gets the first or last slot of the cycle
+##
+## All the robots share one StationLog, so their frame summaries come from one
+## consumer thread.
+##
+## Each robot publishes its loop state to its own shared memory block,
+## DriverStation.CONTROL_BUS_NAME + '_' + section name (see ControlBus.py).
+##
+## A robot whose stop button is pressed is zeroed and its port closed; the rest
+## keep running. So does a robot whose runtime fails: the runtime zeroes it and
+## closes its port on the way out, and the failure is reported and makes the
+## process exit with status 1. Closing the window, Ctrl-C or a failure of the
+## sampler stops all of them.
+##
+## The mapping of gamepads to ports comes from an INI file with one section
+## per robot (see robots.example.ini):
+##   [Birkel]
+##   port = COM5       ; serial port of the robot's XBee
+##   gamepad = 0       ; pygame joystick index
+##   baud = 57600      ; optional, default SERIAL_BAUD
+##   protocol = 2      ; optional, highest link protocol to offer, default LINK_PROTOCOL
+##   adaptive = yes    ; optional, default ADAPTIVE_RATE
+##
+## Usage: python MultiRobot.py [--config FILE] [--telemetry]
+################################################################################
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'robots.ini')
+
+
+############################################################
+## @brief  Read the robot/gamepad mapping
+## @param  path - INI file
+## @return list of dicts with name, port, gamepad, baud, protocol and adaptive
+############################################################
+def loadConfig(path):
+    parser = configparser.ConfigParser(inline_comment_prefixes=(';', '#'))
+    if not parser.read(path):
+        raise IOError("Cannot read robot config file " + path)
+
+    robots = []
+    for name in parser.sections():
+        section = parser[name]
+        robots.append({'name': name,
+                       'port': section['port'],
+                       'gamepad': section.getint('gamepad'),
+                       'baud': section.getint('baud', DriverStation.SERIAL_BAUD),
+                       'protocol': section.getint('protocol', DriverStation.LINK_PROTOCOL),
+                       'adaptive': section.getboolean('adaptive', DriverStation.ADAPTIVE_RATE)})
+
+    ports = [r['port'] for r in robots]
+    gamepads = [r['gamepad'] for r in robots]
+    if len(set(ports)) != len(ports) or len(set(gamepads)) != len(gamepads):
+        raise ValueError("Each robot needs its own port and gamepad in " + path)
+    if not robots:
+        raise ValueError("No robots in " + path)
+    return robots
+
+
+################################################################################
+## @brief  Paces the control loop and feeds gamepad events to all the robots
+################################################################################
+class MultiRobotRuntime:
+
+    ############################################################
+    ## @param  runtimes - one DriverStationRuntime per robot
+    ## @param  report - callback for status lines
+    ############################################################
+    def __init__(self, runtimes, report=print):
+        self.runtimes = runtimes
+        self.report = report
+        self.gamepads = [r.gamepad for r in runtimes]
+        self.scheduler = ControlScheduler.ControlScheduler(DriverStation.CONTROL_LOOP_RATE_HZ,
+                                                           DriverStation.KEEP_ALIVE_MS)
+        self.tasks = []
+        self.first = 0
+
+        # (name, exception) of each robot whose runtime failed
+        self.failures = []
+
+    ############################################################
+    ## @brief  Run until every robot has stopped
+    ############################################################
+    async def run(self):
+        self.tasks = [asyncio.ensure_future(r.run(ownInput=False)) for r in self.runtimes]
+        sampler = asyncio.ensure_future(self.sampleInput())
+        try:
+            pending = set(self.tasks + [sampler])
+            while not all(task.done() for task in self.tasks):
+                (done, pending) = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is sampler:
+                        # Nothing paces the robots any more
+                        self.report("Stopping all robots, the input sampler failed: " + repr(sampler.exception()))
+                        for runtime in self.runtimes:
+                            runtime.stop()
+                    else:
+                        self.reportExit(self.tasks.index(task))
+        finally:
+            # Each robot zeroes itself and closes its port on the way out; let them finish
+            sampler.cancel()
+            await asyncio.gather(sampler, *self.tasks, return_exceptions=True)
+            print("Loop timing -- ", self.scheduler.summary())
+        if not sampler.cancelled() and sampler.exception() is not None:
+            raise sampler.exception()
+
+    ############################################################
+    ## @brief  Report a robot whose runtime has returned
+    ##
+    ## The runtime has already zeroed the robot and closed its port, and the
+    ## sampler skips finished robots, so the others keep running.
+    ## @param  index - index of the robot in runtimes
+    ############################################################
+    def reportExit(self, index):
+        task = self.tasks[index]
+        if task.cancelled() or task.exception() is None:
+            return
+        runtime = self.runtimes[index]
+        self.failures.append((runtime.name, task.exception()))
+        self.report(runtime.prefix + "Robot stopped, its runtime failed: " + repr(task.exception()))
+
+    ############################################################
+    ## @brief  Task: pace the loop, apply gamepad events and wake the robots
+    ############################################################
+    async def sampleInput(self):
+        scheduler = self.scheduler
+        runtimes = self.runtimes
+        count = len(runtimes)
+
+        while True:
+            remaining = scheduler.remainingNs()
+            if remaining > 0:
+                await asyncio.sleep(remaining / float(ControlScheduler.NS_PER_S))
+            scheduler.startCycle()
+
+            self.dispatchEvents()
+
+            # Rotate which robot is served first
+            for i in range(0, count):
+                index = (self.first + i) % count
+                runtime = runtimes[index]
+                if self.tasks[index].done() or runtime.inputReady is None:
+                    continue
+                runtime.scheduler.startCycle()
+                runtime.inputReady.set()
+            self.first = (self.first + 1) % count
+
+    ############################################################
+    ## @brief  Read the event queue once and hand the events to the gamepads
+    ############################################################
+    def dispatchEvents(self):
+        for event in pygame.event.get():
+            if event.type == pygame.JOYDEVICEADDED:
+                # Only a gamepad that lost a joystick of the same model may take it. Two
+                # pads of one model share a GUID, and handing the joystick to the wrong
+                # one would drive the wrong robot, so then neither gets it.
+                guid = getattr(event, 'guid', None)
+                if guid is None:
+                    guid = pygame.joystick.Joystick(event.device_index).get_guid()
+                owners = [gamepad for gamepad in self.gamepads if not gamepad.connected and gamepad.guid == guid]
+                if len(owners) == 1:
+                    owners[0].handleEvent(event)
+                elif owners:
+                    self.report("Reconnected joystick {} could belong to {} robots, not assigned; "
+                                "restart to map it again".format(event.device_index, len(owners)))
+            else:
+                for gamepad in self.gamepads:
+                    gamepad.handleEvent(event)
+
+
+def main():
+
+    args = sys.argv[1:]
+    configPath = args[args.index('--config') + 1] if '--config' in args else CONFIG_FILE
+    telemetry = '--telemetry' in args
+    robots = loadConfig(configPath)
+
+    GamepadInput.initJoystickOnly()
+    GamepadInput.allowJoystickEventsOnly()
+    for robot in robots:
+        if robot['gamepad'] >= pygame.joystick.get_count():
+            print("Gamepad", robot['gamepad'], "for", robot['name'], "is not connected")
+            pygame.quit()
+            return 1
+
+    links = []
+    for robot in robots:
+        joystick = pygame.joystick.Joystick(robot['gamepad'])
+        joystick.init()
+        print(robot['name'], ": joystick '", joystick.get_name(), "' ->", robot['port'])
+        ser = serial.Serial(robot['port'], robot['baud'], timeout=1)
+        (encoder, pipeline) = AsyncRuntime.setUpLink(ser, robot['protocol'], robot['adaptive'], robot['baud'])
+        links.append((robot, joystick, ser, encoder, pipeline))
+
+    log = StationLog.StationLog(True, DriverStation.LOG_FILE, DriverStation.LOG_FRAME_SUMMARY_S)
+    log.start()
+
+    async def runAll():
+        runtimes = []
+        for (robot, joystick, ser, encoder, pipeline) in links:
+            scheduler = ControlScheduler.ControlScheduler(DriverStation.CONTROL_LOOP_RATE_HZ,
+                                                          DriverStation.KEEP_ALIVE_MS)
+            busName = None
+            if DriverStation.CONTROL_BUS_NAME is not None:
+                busName = DriverStation.CONTROL_BUS_NAME + '_' + robot['name']
+            prefix = robot['name'] + ": "
+            gamepad = GamepadInput.ControllerState(joystick,
+                                                   report=lambda text, prefix=prefix: log.message(prefix + text))
+            runtimes.append(AsyncRuntime.DriverStationRuntime(
+                AsyncRuntime.SerialTransport(ser), gamepad,
+                pipeline, encoder, scheduler, telemetry, robot['name'], busName, log))
+        multi = MultiRobotRuntime(runtimes, log.message)
+        await multi.run()
+        return len(multi.failures)
+
+    failures = 0
+    try:
+        failures = asyncio.run(runAll())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log.close()
+        pygame.quit()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
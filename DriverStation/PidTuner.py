@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+import concurrent.futures
+import itertools
+import os
+import random
+import sys
+import time
+
+import FrameEncoder
+import RobotSimulator
+import TuningProfile
+
+################################################################################
+## Batch PID gain sweep for the arm
+##
+## Simulates the firmware's arm positioning loop -- setArmAngle() with PID_v1
+## (100ms sample time, +/-500 output limits, P_ON_E or P_ON_M) driving the
+## RobotSimulator arm model -- for many candidate gain sets in parallel across
+## a process pool. Each candidate moves through the arm presets
+## (down -> over bumps -> up -> down) and is ranked by settle time and
+## overshoot.
+##
+## The presets and the current gains come from the active tuning profile
+## (DriverStation.PROFILE_FILE, or --profile; see TuningProfile.py), falling
+## back to DriverStation.py's constants when there is none. The winner is
+## printed as the profile's [pid] section and as the bytes the "send PID
+## gains" button transmits.
+##
+## Usage: python PidTuner.py [--profile FILE] [--mode grid|random] [--samples N]
+##                           [--kp MIN:MAX] [--ki MIN:MAX] [--kd MIN:MAX]
+##                           [--pon E|M|EM] [--scale S[,S...]] [--frame-ms N] [--top N]
+################################################################################
+
+# Default search ranges
+KP_RANGE = (0.05, 2.0)
+KI_RANGE = (0.0, 0.01)
+KD_RANGE = (0.0, 0.5)
+GRID_STEPS = 8              # values per gain in grid mode
+
+STEP_DURATION_MS = 3000     # time allowed for each preset move
+SIM_DT_MS = 2               # arm model integration step
+FRAME_PERIOD_MS = 50        # how often a frame reaches setArmAngle() (keep-alive when holding a preset)
+SETTLE_BAND = 0.02          # settled once within 2% of the step size (and at least 5 counts)
+OVERSHOOT_WEIGHT = 5000.0   # ms of score per 100% overshoot
+
+
+############################################################
+## @brief  Arm byte -> angle, as setArmAngle() does it
+############################################################
+def armAngle(armByte):
+    if armByte > 123:
+        armByte -= 4
+    return armByte
+
+
+############################################################
+## @brief  Simulate one candidate through the preset sequence
+## @param  candidate - (kp, ki, kd, pOn 'E'/'M', armScale, presets, framePeriodMs)
+## @return dict with the candidate and its metrics
+############################################################
+def simulateCandidate(candidate):
+    (kp, ki, kd, pOn, armScale, presets, framePeriodMs) = candidate
+
+    clock = [0]
+    pid = RobotSimulator.PidV1(lambda: clock[0], kp, ki, kd,
+                               RobotSimulator.P_ON_E if pOn == 'E' else RobotSimulator.P_ON_M)
+    pid.setOutputLimits(-500, 500)
+    pid.setMode(RobotSimulator.AUTOMATIC)  # arm value 124 puts the firmware in angle mode
+    arm = RobotSimulator.ArmModel()
+    armUs = 1500
+
+    settleTimes = []
+    maxOvershoot = 0.0
+    unsettled = 0
+    dtS = SIM_DT_MS / 1000.0
+    frameSteps = max(1, framePeriodMs // SIM_DT_MS)
+
+    sequence = [presets[1], presets[2], presets[0]]
+    for target in sequence:
+        setpoint = armAngle(target) * armScale
+        start = arm.read()
+        stepSize = abs(setpoint - start)
+        band = max(SETTLE_BAND * stepSize, 5.0)
+        direction = 1.0 if setpoint >= start else -1.0
+        lastOutsideMs = 0
+        peak = 0.0
+
+        for n in range(0, STEP_DURATION_MS // SIM_DT_MS):
+            if n % frameSteps == 0:
+                pid.setpoint = float(setpoint)
+                pid.input = float(arm.read())
+                pid.compute()
+                us = 1500 - pid.output
+                if us > 2000:
+                    us = 2000
+                if us < 1000:
+                    us = 1000
+                armUs = int(us)
+
+            arm.advance(dtS, armUs)
+            clock[0] += SIM_DT_MS
+
+            error = arm.position - setpoint
+            if abs(error) > band:
+                lastOutsideMs = (n + 1) * SIM_DT_MS
+            beyond = error * direction
+            if beyond > peak:
+                peak = beyond
+
+        if lastOutsideMs >= STEP_DURATION_MS:
+            unsettled += 1
+        settleTimes.append(lastOutsideMs)
+        if stepSize > 0:
+            maxOvershoot = max(maxOvershoot, peak / stepSize)
+
+    meanSettle = sum(settleTimes) / float(len(settleTimes))
+    score = meanSettle + OVERSHOOT_WEIGHT * maxOvershoot + unsettled * STEP_DURATION_MS
+    return {'kp': kp, 'ki': ki, 'kd': kd, 'pOn': pOn, 'armScale': armScale,
+            'settleMs': meanSettle, 'overshoot': maxOvershoot, 'unsettled': unsettled, 'score': score}
+
+
+def simulateBatch(candidates):
+    return [simulateCandidate(c) for c in candidates]
+
+
+############################################################
+## @brief  Build the candidate list
+############################################################
+def makeCandidates(mode, samples, kpRange, kiRange, kdRange, pOns, scales, presets, framePeriodMs, seed=0):
+    if mode == 'grid':
+        def steps(r):
+            if GRID_STEPS == 1 or r[0] == r[1]:
+                return [r[0]]
+            return [r[0] + (r[1] - r[0]) * i / float(GRID_STEPS - 1) for i in range(0, GRID_STEPS)]
+        return [(kp, ki, kd, pOn, scale, presets, framePeriodMs)
+                for (kp, ki, kd, pOn, scale) in itertools.product(
+                    steps(kpRange), steps(kiRange), steps(kdRange), pOns, scales)]
+
+    rng = random.Random(seed)
+    return [(rng.uniform(*kpRange), rng.uniform(*kiRange), rng.uniform(*kdRange),
+             rng.choice(pOns), rng.choice(scales), presets, framePeriodMs)
+            for i in range(0, samples)]
+
+
+def formatGain(value):
+    return "{:.6g}".format(value)
+
+
+############################################################
+## @brief  Read the settings of the active profile
+## @param  path - INI file, or None for the built-in defaults
+## @return dict of setting name -> value (TuningProfile.load)
+## @throws ValueError if the profile is invalid
+############################################################
+def loadSettings(path):
+    import DriverStation
+    defaults = TuningProfile.defaultSettings(DriverStation.profileDefaults())
+    if path is None or not os.path.exists(path):
+        return defaults
+    return TuningProfile.load(path, defaults)
+
+
+############################################################
+## @brief  The [pid] section of a profile holding the given gains
+## @param  pOn - 'E' or 'M'
+## @param  gains - (P, I, D, arm scale factor) strings
+## @return INI text
+############################################################
+def pidSection(pOn, gains):
+    values = dict(zip(('pidMode', 'pidP', 'pidI', 'pidD', 'armScaleFactor'), (pOn,) + tuple(gains)))
+    lines = ["[pid]"]
+    for (section, key, name) in TuningProfile.FIELDS:
+        if section == 'pid':
+            lines.append("{} = {}".format(key, values[name]))
+    return "\n".join(lines)
+
+
+def main():
+
+    args = sys.argv[1:]
+
+    def option(name, default=None):
+        if name in args:
+            return args[args.index(name) + 1]
+        return default
+
+    def rangeOption(name, default):
+        value = option(name)
+        if value is None:
+            return default
+        (lo, hi) = value.split(':')
+        return (float(lo), float(hi))
+
+    # The presets and current gains come from the profile the driver station would load
+    import DriverStation
+    profilePath = option('--profile', DriverStation.PROFILE_FILE)
+    try:
+        settings = loadSettings(profilePath)
+    except (ValueError, IOError) as e:
+        print(e)
+        return 1
+    if profilePath is None or not os.path.exists(profilePath):
+        profilePath = None
+        print("No profile, starting from the gains in DriverStation.py")
+    else:
+        print("Starting from the gains in", profilePath)
+    presets = (settings['armPosDown'], settings['armPosOverBumps'], settings['armPosUp'])
+
+    mode = option('--mode', 'random')
+    samples = int(option('--samples', 2000))
+    pOns = list(option('--pon', settings['pidMode']))
+    scales = [float(s) for s in option('--scale', settings['armScaleFactor']).split(',')]
+    framePeriodMs = int(option('--frame-ms', FRAME_PERIOD_MS))
+    top = int(option('--top', 10))
+
+    candidates = makeCandidates(mode, samples, rangeOption('--kp', KP_RANGE), rangeOption('--ki', KI_RANGE),
+                                rangeOption('--kd', KD_RANGE), pOns, scales, presets, framePeriodMs)
+
+    # The current gains are always included for comparison
+    current = (float(settings['pidP']), float(settings['pidI']), float(settings['pidD']),
+               settings['pidMode'], float(settings['armScaleFactor']), presets, framePeriodMs)
+    candidates.append(current)
+
+    # Send work to the pool in chunks so the per-task overhead stays small
+    workers = os.cpu_count() or 1
+    chunkSize = max(1, len(candidates) // (workers * 4))
+    chunks = [candidates[i:i + chunkSize] for i in range(0, len(candidates), chunkSize)]
+
+    start = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for batch in pool.map(simulateBatch, chunks):
+            results.extend(batch)
+    elapsed = time.perf_counter() - start
+
+    currentResult = results[-1]
+    results.sort(key=lambda r: r['score'])
+
+    print("Simulated {} candidates in {:.2f}s on {} processes".format(len(results), elapsed, workers))
+    print("{:>4} {:>10} {:>10} {:>10} {:>4} {:>7} {:>10} {:>10} {:>9}".format(
+        "rank", "Kp", "Ki", "Kd", "P", "scale", "settle ms", "overshoot", "unsettled"))
+    for (i, r) in enumerate(results[:top]):
+        print("{:>4} {:>10.5g} {:>10.5g} {:>10.5g} {:>4} {:>7.4g} {:>10.0f} {:>9.1f}% {:>9}".format(
+            i + 1, r['kp'], r['ki'], r['kd'], r['pOn'], r['armScale'], r['settleMs'],
+            r['overshoot'] * 100.0, r['unsettled']))
+    print("Current gains: settle {:.0f}ms, overshoot {:.1f}%, unsettled {}".format(
+        currentResult['settleMs'], currentResult['overshoot'] * 100.0, currentResult['unsettled']))
+
+    best = results[0]
+    gains = (formatGain(best['kp']), formatGain(best['ki']), formatGain(best['kd']), formatGain(best['armScale']))
+    print("")
+    print("# Replace the [pid] section of {} with:".format(profilePath or "the profile"))
+    print(pidSection(best['pOn'], gains))
+    packet = bytes((FrameEncoder.START_BYTE, FrameEncoder.SETUP_VALUE, FrameEncoder.SETUP_VALUE,
+                    FrameEncoder.SETUP_VALUE)) + FrameEncoder.encodePidPayload(best['pOn'], gains)
+    print("# Setup packet: " + " ".join("{:02x}".format(b) for b in packet))
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
@@ -0,0 +1,577 @@
+#!/usr/bin/env python
+
+import math
+import os
+import re
+import sys
+import time
+import tty
+
+import Telemetry
+
+################################################################################
+## Pure-Python simulator of Robot/ArduinoProMini/ArduinoProMini.ino
+##
+## The firmware's setup()/loop() are written as a generator that yields the
+## time (in microseconds) each step takes, so blocking calls such as
+## waitSerialAvailable(), blinkLED() and delay() cost simulated time exactly
+## where they cost real time on the robot. Bytes arrive at the UART rate into a
+## 64-byte receive buffer like the Arduino's, and are dropped when it is full.
+##
+## Modelled: start-byte hunt, 3-byte body, reserved values 123-126, the
+## processSetup() PID packet and checksum, the 250ms idle() failsafe, the
+## encoder (with a first-order arm motor model) and the PID_v1 library.
+## Telemetry frames go out through a 64-byte transmit buffer at the UART rate
+## and are skipped when it is full, like sendTelemetry(); read them back with
+## takeTransmitted().
+##
+## Time only advances when advance() is called, so the simulator runs as fast
+## as the caller feeds it. Use --pty to run it in real time behind a pty that
+## DriverStation.py can open as its serial port:
+##   python RobotSimulator.py --pty
+################################################################################
+
+BAUD_RATE = 57600
+RX_BUFFER_SIZE = 64      # HardwareSerial receive buffer on the ATmega328
+TX_BUFFER_SIZE = 64      # HardwareSerial transmit buffer
+LOOP_US = 20             # Approximate cost of one pass of loop() with no work
+FAILSAFE_MS = 250        # idle() after this long without a start byte
+
+# LED colors (same as the LEDColor enum)
+OFF, RED, GREEN, BLUE, YELLOW, PURPLE, BLUEGREEN, WHITE = range(0, 8)
+LED_NAMES = ['OFF', 'RED', 'GREEN', 'BLUE', 'YELLOW', 'PURPLE', 'BLUEGREEN', 'WHITE']
+
+# PID_v1 constants
+AUTOMATIC = 1
+MANUAL = 0
+P_ON_M = 0
+P_ON_E = 1
+
+
+############################################################
+## @brief  Wrap to int16_t / int32_t like the firmware's casts
+############################################################
+def int16(value):
+    return ((value + 0x8000) & 0xFFFF) - 0x8000
+
+
+def int32(value):
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+############################################################
+## @brief  Arduino map() with its integer (long) arithmetic
+############################################################
+def arduinoMap(x, inMin, inMax, outMin, outMax):
+    num = (x - inMin) * (outMax - outMin)
+    den = inMax - inMin
+    # C integer division truncates toward zero
+    q = abs(num) // abs(den)
+    if (num < 0) != (den < 0):
+        q = -q
+    return q + outMin
+
+
+############################################################
+## @brief  String.toDouble(): parse the leading number, 0.0 if there is none
+############################################################
+def toDouble(text):
+    match = re.match(r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?', text)
+    if match is None:
+        return 0.0
+    return float(match.group(0))
+
+
+############################################################
+## @brief  AVR char is signed
+############################################################
+def signedChar(value):
+    return value - 256 if value > 127 else value
+
+
+################################################################################
+## @brief  Port of Brett Beauregard's PID_v1 (version 1.2.0)
+################################################################################
+class PidV1:
+
+    def __init__(self, millis, kp, ki, kd, pOn):
+        self.millis = millis
+        self.input = 0.0
+        self.output = 0.0
+        self.setpoint = 0.0
+        self.inAuto = False
+        self.sampleTime = 100
+        self.outMin = 0.0
+        self.outMax = 255.0
+        self.outputSum = 0.0
+        self.lastInput = 0.0
+        self.setTunings(kp, ki, kd, pOn)
+        self.lastTime = millis() - self.sampleTime
+
+    def compute(self):
+        if not self.inAuto:
+            return False
+        now = self.millis()
+        if now - self.lastTime < self.sampleTime:
+            return False
+
+        error = self.setpoint - self.input
+        dInput = self.input - self.lastInput
+        self.outputSum += self.ki * error
+
+        # Add proportional on measurement, if P_ON_M is specified
+        if not self.pOnE:
+            self.outputSum -= self.kp * dInput
+        self.outputSum = min(max(self.outputSum, self.outMin), self.outMax)
+
+        # Add proportional on error, if P_ON_E is specified
+        output = self.kp * error if self.pOnE else 0.0
+        output += self.outputSum - self.kd * dInput
+        self.output = min(max(output, self.outMin), self.outMax)
+
+        self.lastInput = self.input
+        self.lastTime = now
+        return True
+
+    def setTunings(self, kp, ki, kd, pOn):
+        if kp < 0 or ki < 0 or kd < 0:
+            return
+        self.pOnE = pOn == P_ON_E
+        sampleTimeInSec = self.sampleTime / 1000.0
+        self.kp = kp
+        self.ki = ki * sampleTimeInSec
+        self.kd = kd / sampleTimeInSec
+
+    def setMode(self, mode):
+        newAuto = mode == AUTOMATIC
+        if newAuto and not self.inAuto:
+            # Initialize()
+            self.outputSum = min(max(self.output, self.outMin), self.outMax)
+            self.lastInput = self.input
+        self.inAuto = newAuto
+
+    def setOutputLimits(self, outMin, outMax):
+        if outMin >= outMax:
+            return
+        self.outMin = outMin
+        self.outMax = outMax
+        if self.inAuto:
+            self.output = min(max(self.output, outMin), outMax)
+            self.outputSum = min(max(self.outputSum, outMin), outMax)
+
+
+################################################################################
+## @brief  Arm motor + encoder
+##
+## Encoder counts move at up to maxCountsPerS, with a first-order lag, in the
+## direction the PID code expects: pulses below 1500us increase the count.
+################################################################################
+class ArmModel:
+
+    def __init__(self, maxCountsPerS=2000.0, timeConstantS=0.08):
+        self.maxCountsPerS = maxCountsPerS
+        self.timeConstantS = timeConstantS
+        self.position = 0.0
+        self.velocity = 0.0
+
+    def advance(self, dtS, microseconds):
+        target = (1500 - microseconds) / 500.0 * self.maxCountsPerS
+        alpha = dtS / self.timeConstantS
+        if alpha > 1.0:
+            alpha = 1.0
+        self.velocity += (target - self.velocity) * alpha
+        self.position += self.velocity * dtS
+
+    def read(self):
+        return int(self.position)
+
+
+class RobotSimulator:
+
+    ############################################################
+    ## @brief  Create the simulated robot (setup() runs on the first advance())
+    ## @param  loopUs - cost of one pass of loop()
+    ## @param  baud - serial rate used to space out arriving bytes
+    ## @param  telemetryPeriodMs - TELEMETRY_PERIOD_MS in the firmware (0 = off)
+    ############################################################
+    def __init__(self, loopUs=LOOP_US, baud=BAUD_RATE, telemetryPeriodMs=Telemetry.TELEMETRY_PERIOD_MS):
+        self.loopUs = loopUs
+        self.telemetryPeriodMs = telemetryPeriodMs
+        self.byteUs = 10 * 1000000.0 / baud  # 8N1: 10 bits per byte
+
+        self.nowUs = 0
+        self.arrivals = []      # (arrival time us, byte), in order
+        self.arrivalIndex = 0
+        self.lastArrivalUs = 0.0
+        self.rx = bytearray()
+        self.transmitted = []   # (time us the byte is out of the UART, byte), in order
+        self.transmittedIndex = 0
+        self.txDoneUs = 0.0
+
+        # Outputs
+        self.leftUs = 1500
+        self.rightUs = 1500
+        self.armUs = 1500
+        self.boardLed = False
+        self.ledColor = OFF
+
+        # Firmware globals
+        self.armAngleMode = False
+        self.armZeroPoint = 0
+        self.armScale = 20.0
+        self.lastTimeRX = 0
+        self.waitingForStartByte = True
+        self.arm = ArmModel()
+        self.pid = PidV1(self.millis, 0.43, 0.0001, 0.05, P_ON_E)
+        self.loopCount = 0
+        self.lastCommand = (127, 127, 127)
+        self.lastCmdTime = 0
+        self.lastTelemetry = 0
+        self.telemetrySeq = 0
+
+        # Statistics
+        self.framesProcessed = 0
+        self.setupsAccepted = 0
+        self.setupChecksumErrors = 0
+        self.bodiesDropped = 0      # bodies containing 255
+        self.bytesSkipped = 0       # bytes discarded while hunting for the start byte
+        self.rxOverflows = 0        # bytes lost to a full receive buffer
+        self.failsafeEntries = 0
+        self.failsafeUs = 0         # total time spent in idle()
+        self.inFailsafe = False
+        self.maxFrameGapUs = 0
+        self.lastFrameUs = None
+        self.inSetup = False        # blocked inside processSetup() (idle() is not checked there)
+        self.telemetrySent = 0
+        self.telemetrySkipped = 0   # transmit buffer full
+
+        self.firmware = self.run()
+
+    def millis(self):
+        return self.nowUs // 1000
+
+    ############################################################
+    ## @brief  Bytes sent to the robot
+    ## @param  data - bytes-like
+    ## @param  atUs - time the first byte starts on the wire (default: now)
+    ##
+    ## Bytes queue behind anything still being transmitted.
+    ############################################################
+    def receive(self, data, atUs=None):
+        t = float(self.nowUs if atUs is None else atUs)
+        if t < self.lastArrivalUs:
+            t = self.lastArrivalUs
+        for b in data:
+            t += self.byteUs
+            self.arrivals.append((t, b))
+        self.lastArrivalUs = t
+
+    ############################################################
+    ## @brief  Run the firmware up to the given time
+    ## @param  toUs - simulated time in microseconds
+    ############################################################
+    def advance(self, toUs):
+        while self.nowUs < toUs:
+            stepUs = next(self.firmware)
+            self.elapse(stepUs)
+
+        # Drop arrivals that have been consumed so the list does not grow forever
+        if self.arrivalIndex > 4096:
+            del self.arrivals[:self.arrivalIndex]
+            self.arrivalIndex = 0
+
+    def elapse(self, stepUs):
+        self.arm.advance(stepUs / 1000000.0, self.armUs)
+        if self.inFailsafe:
+            self.failsafeUs += stepUs
+        self.nowUs += stepUs
+
+        # Deliver the bytes that finished arriving during this step
+        arrivals = self.arrivals
+        i = self.arrivalIndex
+        while i < len(arrivals) and arrivals[i][0] <= self.nowUs:
+            if len(self.rx) < RX_BUFFER_SIZE:
+                self.rx.append(arrivals[i][1])
+            else:
+                self.rxOverflows += 1
+            i += 1
+        self.arrivalIndex = i
+
+    ##### Serial #####
+
+    def serialAvailable(self, count):
+        return len(self.rx) >= count
+
+    def serialRead(self):
+        if not self.rx:
+            return -1
+        b = self.rx[0]
+        del self.rx[0]
+        return b
+
+    def waitSerialAvailable(self, count):
+        while not self.serialAvailable(count):
+            yield 1000
+
+    def availableForWrite(self):
+        if self.txDoneUs <= self.nowUs:
+            return TX_BUFFER_SIZE
+        return TX_BUFFER_SIZE - int(math.ceil((self.txDoneUs - self.nowUs) / self.byteUs))
+
+    def serialWrite(self, data):
+        t = max(self.txDoneUs, float(self.nowUs))
+        for b in data:
+            t += self.byteUs
+            self.transmitted.append((t, b))
+        self.txDoneUs = t
+
+    ############################################################
+    ## @brief  Bytes the robot has finished sending by the given time
+    ## @param  atUs - simulated time (default: now)
+    ############################################################
+    def takeTransmitted(self, atUs=None):
+        t = self.nowUs if atUs is None else atUs
+        transmitted = self.transmitted
+        start = self.transmittedIndex
+        i = start
+        while i < len(transmitted) and transmitted[i][0] <= t:
+            i += 1
+        data = bytes(b for (arrival, b) in transmitted[start:i])
+        if i > 4096:
+            del transmitted[:i]
+            i = 0
+        self.transmittedIndex = i
+        return data
+
+    ##### Firmware #####
+
+    ############################################################
+    ## @brief  setup() followed by loop() forever, yielding elapsed microseconds
+    ############################################################
+    def run(self):
+        # setup()
+        self.pid.setMode(MANUAL)
+        self.pid.setOutputLimits(-500, 500)
+        yield from self.blinkBoardLed(2, 200)
+
+        while True:
+            if self.waitingForStartByte:
+                b = self.serialRead()
+                if b == 255:
+                    self.lastTimeRX = self.millis()
+                    self.waitingForStartByte = False
+                elif b >= 0:
+                    self.bytesSkipped += 1
+
+            if not self.waitingForStartByte and self.serialAvailable(3):
+                self.waitingForStartByte = True
+                left = self.serialRead()
+                right = self.serialRead()
+                arm = self.serialRead()
+                if left == 126 and right == 126 and arm == 126:
+                    self.inSetup = True
+                    yield from self.processSetup()
+                    self.inSetup = False
+                elif left < 255 and right < 255 and arm < 255:
+                    self.processCmd(left, right, arm)
+                else:
+                    self.bodiesDropped += 1
+
+            if self.millis() - self.lastTimeRX > FAILSAFE_MS:
+                self.idle()
+            else:
+                self.inFailsafe = False
+
+            if self.telemetryPeriodMs > 0 and self.millis() - self.lastTelemetry >= self.telemetryPeriodMs:
+                self.sendTelemetry()
+
+            yield self.loopUs
+
+    def processCmd(self, left, right, arm):
+        self.framesProcessed += 1
+        self.loopCount += 1
+        self.lastCommand = (left, right, arm)
+        self.lastCmdTime = self.millis()
+        if self.lastFrameUs is not None and self.nowUs - self.lastFrameUs > self.maxFrameGapUs:
+            self.maxFrameGapUs = self.nowUs - self.lastFrameUs
+        self.lastFrameUs = self.nowUs
+
+        self.boardLed = True
+        if arm == 123:
+            self.armZeroPoint = self.arm.read()
+            self.ledColor = PURPLE
+        elif arm == 124:
+            self.armAngleMode = True
+            self.pid.setMode(AUTOMATIC)
+        elif arm == 125:
+            self.armAngleMode = False
+            self.pid.setMode(MANUAL)
+        elif self.armAngleMode:
+            self.setArmAngle(arm)
+        else:
+            self.moveArm(arm)
+        self.runWheels(left, right)
+
+    def setArmAngle(self, arm):
+        if arm > 123:
+            arm -= 4
+        self.pid.setpoint = float(arm) * self.armScale
+        self.pid.input = float(self.arm.read() - self.armZeroPoint)
+        self.pid.compute()
+
+        armMicroseconds = 1500 - self.pid.output
+        if armMicroseconds > 2000:
+            armMicroseconds = 2000
+        if armMicroseconds < 1000:
+            armMicroseconds = 1000
+        self.armUs = int(armMicroseconds)
+        self.ledColor = YELLOW
+
+    def moveArm(self, arm):
+        arm = arduinoMap(arm, 0, 254, 1000, 2000)
+        self.armUs = arm
+        if arm > 1505:
+            self.ledColor = BLUE
+        elif arm < 1495:
+            self.ledColor = GREEN
+        else:
+            self.ledColor = WHITE
+
+    def runWheels(self, left, right):
+        self.leftUs = arduinoMap(left, 0, 254, 1000, 2000)
+        self.rightUs = arduinoMap(right, 0, 254, 1000, 2000)
+
+    def idle(self):
+        if not self.inFailsafe:
+            self.failsafeEntries += 1
+            self.inFailsafe = True
+        self.leftUs = 1500
+        self.rightUs = 1500
+        self.armUs = 1500
+        self.boardLed = False
+        self.ledColor = RED
+
+    def sendTelemetry(self):
+        self.lastTelemetry = self.millis()
+        if self.availableForWrite() < Telemetry.TELEMETRY_FRAME_SIZE:
+            self.telemetrySkipped += 1
+            return
+        flags = (Telemetry.FLAG_FAILSAFE if self.inFailsafe else 0) | \
+                (Telemetry.FLAG_ARM_ANGLE_MODE if self.armAngleMode else 0)
+        self.serialWrite(Telemetry.encodeTelemetry(
+            self.telemetrySeq, self.millis(), self.loopCount, int32(self.arm.read() - self.armZeroPoint),
+            int16(int(self.pid.setpoint)), self.armUs, flags, self.lastCommand[0], self.lastCommand[1],
+            self.lastCommand[2], self.millis() - self.lastCmdTime))
+        self.telemetrySeq = (self.telemetrySeq + 1) & 0x1F
+        self.telemetrySent += 1
+
+    def blinkLED(self, count, duration, color):
+        for i in range(0, count):
+            self.ledColor = color
+            yield duration * 1000
+            self.ledColor = WHITE
+            yield duration * 1000
+
+    def blinkBoardLed(self, count, duration):
+        for i in range(0, count):
+            self.boardLed = True
+            yield duration * 1000
+            self.boardLed = False
+            yield duration * 1000
+
+    def processSetup(self):
+        checksum = 0
+
+        yield from self.waitSerialAvailable(1)
+        proportional = self.serialRead()
+        checksum += signedChar(proportional)
+
+        # Read 4 strings and convert to doubles
+        values = []
+        for valueIndex in range(0, 4):
+            yield from self.waitSerialAvailable(1)
+            strLen = self.serialRead()
+            yield from self.waitSerialAvailable(strLen)
+            chars = []
+            for strIndex in range(0, strLen):
+                ch = self.serialRead()
+                chars.append(chr(ch))
+                checksum += signedChar(ch)
+            values.append(toDouble(''.join(chars)))
+
+        # Simple sanity check - abort if checksum does not match
+        yield from self.waitSerialAvailable(1)
+        if (checksum & 0xFF) != self.serialRead():
+            self.setupChecksumErrors += 1
+            yield from self.blinkLED(3, 250, RED)
+            return
+
+        self.setupsAccepted += 1
+        self.armScale = values[3]
+        pOn = P_ON_E if proportional == ord('E') else P_ON_M
+        self.pid.setTunings(values[0], values[1], values[2], pOn)
+        yield from self.blinkLED(5, 50, PURPLE)
+        self.ledColor = PURPLE
+
+    ############################################################
+    ## @brief  One-line summary of the outputs and statistics
+    ############################################################
+    def summary(self):
+        return ("t={:.3f}s L={} R={} A={} LED={} armMode={} enc={} | frames={} setups={} "
+                "badChecksum={} droppedBodies={} skipped={} rxOverflow={} failsafe={} ({:.0f}ms) "
+                "maxGap={:.1f}ms telemetry={} (skipped {}){}").format(
+                    self.nowUs / 1e6, self.leftUs, self.rightUs, self.armUs, LED_NAMES[self.ledColor],
+                    'angle' if self.armAngleMode else 'motor', self.arm.read() - self.armZeroPoint,
+                    self.framesProcessed, self.setupsAccepted, self.setupChecksumErrors,
+                    self.bodiesDropped, self.bytesSkipped, self.rxOverflows, self.failsafeEntries,
+                    self.failsafeUs / 1000.0, self.maxFrameGapUs / 1000.0, self.telemetrySent,
+                    self.telemetrySkipped,
+                    " BLOCKED IN processSetup()" if self.inSetup else "")
+
+
+############################################################
+## @brief  Run the simulator in real time behind a pty
+############################################################
+def runPty():
+    (master, slave) = os.openpty()
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    print("Robot simulator listening on", os.ttyname(slave), "(set comPort in DriverStation.py to this)")
+
+    robot = RobotSimulator()
+    start = time.monotonic()
+    nextStatus = start + 1.0
+    try:
+        while True:
+            nowUs = int((time.monotonic() - start) * 1e6)
+            try:
+                data = os.read(master, 4096)
+                if data:
+                    robot.receive(data, nowUs)
+            except BlockingIOError:
+                pass
+            robot.advance(nowUs)
+            telemetry = robot.takeTransmitted()
+            if telemetry:
+                os.write(master, telemetry)
+            if time.monotonic() >= nextStatus:
+                nextStatus += 1.0
+                print(robot.summary())
+            time.sleep(0.001)
+    except KeyboardInterrupt:
+        print(robot.summary())
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def main():
+    if '--pty' in sys.argv[1:]:
+        runPty()
+    else:
+        print("Usage: python RobotSimulator.py --pty")
+        print("       (or run SimHarness.py --robot to drive it in simulated time)")
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
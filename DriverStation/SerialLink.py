@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+import sys
+import threading
+import time
+import serial
+import serial.tools.list_ports
+
+################################################################################
+## Serial connection manager for the robot's XBee
+##
+## Stands in for the serial.Serial the control loop used to own:
+##   - the port is found automatically (the configured port if it is present,
+##     else the likeliest XBee adapter; other USB serial adapters only when
+##     asked for) and only opened by open()
+##   - an I/O error (USB-serial adapter reset or unplugged) closes the port
+##     instead of raising; writes are dropped and reads return nothing until
+##     the port is back
+##   - the next write after RECONNECT_MIN_S reopens it (rediscovering it, the
+##     device name may change), backing off up to RECONNECT_MAX_S between
+##     attempts, and the neutral frames are written before anything else
+##
+## Reconnect attempts run in whichever thread writes (the SerialWriter thread
+## in DriverStation.main()), so the control loop never waits on them. The loop
+## only compares `reconnects` each cycle to resynchronize its encoder.
+##
+## Usage: python SerialLink.py   (lists the ports and the one that would be picked)
+################################################################################
+
+RECONNECT_MIN_S = 0.02      # first retry after the port is lost
+RECONNECT_MAX_S = 0.25      # retries back off up to this interval
+
+# USB vendor ids of the usual XBee adapters (FTDI on SparkFun/Digi boards, Silicon Labs CP210x)
+XBEE_VENDOR_IDS = (0x0403, 0x10C4)
+
+NS_PER_S = 1000000000
+NS_PER_MS = 1000000
+
+
+############################################################
+## @brief  Pick the serial port of the XBee
+## @param  preferred - port to use if it is present (e.g. DriverStation.comPort), or None
+## @param  ports - list_ports.comports() result (for testing)
+## @param  anyUsb - fall back to a USB serial adapter that does not look like an XBee
+## @return device name, or None if there is no candidate
+############################################################
+def findPort(preferred=None, ports=None, anyUsb=False):
+    if ports is None:
+        ports = serial.tools.list_ports.comports()
+    best = None
+    bestScore = 0 if anyUsb else 1
+    for port in ports:
+        if port.device == preferred:
+            return port.device
+        text = " ".join(str(s) for s in (port.description, port.manufacturer, port.product) if s).lower()
+        if 'xbee' in text:
+            score = 3
+        elif port.vid in XBEE_VENDOR_IDS:
+            score = 2
+        elif port.vid is not None:
+            score = 1       # some other USB serial adapter
+        else:
+            score = 0       # built-in UARTs are never the XBee
+        if score > bestScore:
+            best = port.device
+            bestScore = score
+    return best
+
+
+class SerialLink:
+
+    ############################################################
+    ## @param  port - configured port, preferred when present
+    ## @param  baud - link speed
+    ## @param  timeout - read timeout of the underlying port
+    ## @param  discover - look for another port when the configured one is absent
+    ## @param  report - function called with a line of text on connect/loss/reconnect
+    ## @param  startNs - program start (clock time), to report the time to the first frame, or None
+    ## @param  clock - monotonic nanosecond clock
+    ## @param  anyUsb - let discovery pick a USB serial adapter that does not look like an XBee
+    ############################################################
+    def __init__(self, port, baud, timeout=1, discover=True, report=print, startNs=None, clock=time.monotonic_ns,
+                 anyUsb=False):
+        self.preferred = port
+        self.port = port
+        self.baud = baud
+        self._timeout = timeout
+        self.discover = discover
+        self.anyUsb = anyUsb
+        self.report = report
+        self.clock = clock
+        self.startNs = startNs
+        self.lock = threading.Lock()
+        self.ser = None
+        self.neutralFrames = b''     # written right after every reconnect
+
+        self.backoffNs = RECONNECT_MIN_S * NS_PER_S
+        self.nextAttemptNs = 0
+        self.lostNs = None
+
+        # Counters
+        self.reconnects = 0
+        self.writesDropped = 0
+        self.openedNs = None
+        self.readyNs = None             # handshake over, see linkReady()
+        self.firstWriteNs = None
+        self.lastRecoveryNs = None
+
+    ############################################################
+    ## @brief  Find and open the port
+    ## @return true if it is open
+    ############################################################
+    def open(self):
+        with self.lock:
+            if self.ser is not None:
+                return True
+            port = self.preferred
+            if self.discover:
+                port = findPort(self.preferred, anyUsb=self.anyUsb) or self.port
+            try:
+                self.ser = serial.Serial(port, self.baud, timeout=self._timeout)
+            except (serial.SerialException, OSError, ValueError):
+                return False
+            self.port = port
+            self.openedNs = self.clock()
+            return True
+
+    ############################################################
+    ## @brief  Start timing the first control frame
+    ##
+    ## Call once the protocol handshake (LinkProtocol.negotiate()) is over: the
+    ## next write is then reported as the first frame, and the handshake shows
+    ## up in the time to it instead of its HELLO counting as the first frame.
+    ############################################################
+    def linkReady(self):
+        self.readyNs = self.clock()
+
+    ############################################################
+    ## @brief  Open the port, retrying with backoff
+    ## @param  timeoutS - give up after this long (None = wait forever)
+    ## @return true if it is open
+    ############################################################
+    def waitOpen(self, timeoutS=None):
+        deadline = None if timeoutS is None else self.clock() + int(timeoutS * NS_PER_S)
+        delayS = RECONNECT_MIN_S
+        while not self.open():
+            if deadline is not None and self.clock() >= deadline:
+                return False
+            time.sleep(delayS)
+            delayS = min(delayS * 2, RECONNECT_MAX_S)
+        return True
+
+    ############################################################
+    ## @brief  Forget a port that failed
+    ## @param  ser - the port the error came from (another thread may already have replaced it)
+    ############################################################
+    def lost(self, ser, error):
+        with self.lock:
+            if self.ser is not ser:
+                return
+            self.ser = None
+            self.lostNs = self.clock()
+            self.backoffNs = RECONNECT_MIN_S * NS_PER_S
+            self.nextAttemptNs = self.lostNs + self.backoffNs
+        try:
+            ser.close()
+        except (serial.SerialException, OSError):
+            pass
+        self.report("Serial -- lost " + str(self.port) + ": " + str(error))
+
+    ############################################################
+    ## @brief  Try to reopen a lost port, if the backoff allows
+    ## @return the open port, or None
+    ############################################################
+    def reconnect(self):
+        now = self.clock()
+        if now < self.nextAttemptNs:
+            return None
+        if not self.open():
+            self.backoffNs = min(self.backoffNs * 2, RECONNECT_MAX_S * NS_PER_S)
+            self.nextAttemptNs = now + self.backoffNs
+            return None
+
+        ser = self.ser
+        try:
+            ser.write(self.neutralFrames)
+        except (serial.SerialException, OSError) as e:
+            self.lost(ser, e)
+            return None
+        self.reconnects += 1
+        if self.lostNs is not None:
+            self.lastRecoveryNs = self.clock() - self.lostNs
+            self.report("Serial -- reconnected to {} after {:.0f}ms, robot zeroed".format(
+                self.port, self.lastRecoveryNs / NS_PER_MS))
+        return ser
+
+    ############################################################
+    ## @brief  Write a frame; dropped (not raised) while the port is down
+    ## @return number of bytes written
+    ############################################################
+    def write(self, data):
+        ser = self.ser
+        if ser is None:
+            ser = self.reconnect()
+            if ser is None:
+                self.writesDropped += 1
+                return 0
+        try:
+            written = ser.write(data)
+        except (serial.SerialException, OSError) as e:
+            self.lost(ser, e)
+            self.writesDropped += 1
+            return 0
+        if self.firstWriteNs is None and self.readyNs is not None:
+            self.firstWriteNs = self.clock()
+            if self.startNs is not None:
+                self.report("Serial -- first frame {:.0f}ms after start (port open at {:.0f}ms, "
+                            "link ready at {:.0f}ms)".format((self.firstWriteNs - self.startNs) / NS_PER_MS,
+                                                            (self.openedNs - self.startNs) / NS_PER_MS,
+                                                            (self.readyNs - self.startNs) / NS_PER_MS))
+        return written
+
+    ############################################################
+    ## Reads: nothing while the port is down
+    ############################################################
+    @property
+    def in_waiting(self):
+        ser = self.ser
+        if ser is None:
+            return 0
+        try:
+            return ser.in_waiting
+        except (serial.SerialException, OSError) as e:
+            self.lost(ser, e)
+            return 0
+
+    @property
+    def out_waiting(self):
+        ser = self.ser
+        if ser is None:
+            return None
+        try:
+            return ser.out_waiting
+        except (serial.SerialException, OSError) as e:
+            self.lost(ser, e)
+            return None
+
+    def readinto(self, buf):
+        ser = self.ser
+        if ser is None:
+            return 0
+        try:
+            return ser.readinto(buf)
+        except (serial.SerialException, OSError) as e:
+            self.lost(ser, e)
+            return 0
+
+    def read(self, size=1):
+        ser = self.ser
+        if ser is None:
+            return b''
+        try:
+            return ser.read(size)
+        except (serial.SerialException, OSError) as e:
+            self.lost(ser, e)
+            return b''
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        ser = self.ser
+        if ser is not None:
+            ser.timeout = value
+
+    @property
+    def connected(self):
+        return self.ser is not None
+
+    def close(self):
+        with self.lock:
+            ser = self.ser
+            self.ser = None
+            self.nextAttemptNs = sys.maxsize    # no reconnects after close
+        if ser is not None:
+            ser.close()
+
+    ############################################################
+    ## @brief  One-line summary of the connection
+    ############################################################
+    def summary(self):
+        recovery = "-" if self.lastRecoveryNs is None else "{:.0f}ms".format(self.lastRecoveryNs / NS_PER_MS)
+        return "port: {}, reconnects: {}, last recovery: {}, writes dropped: {}".format(
+            self.port, self.reconnects, recovery, self.writesDropped)
+
+
+def main():
+    import DriverStation
+
+    for port in serial.tools.list_ports.comports():
+        print(port.device, "-", port.description, "(vid: {})".format(
+            "{:04x}".format(port.vid) if port.vid is not None else "-"))
+    print("Selected:", findPort(DriverStation.comPort, anyUsb=DriverStation.SERIAL_DISCOVER_ANY_USB))
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+import collections
+import threading
+import time
+
+################################################################################
+## Background serial transmitter
+##
+## The control loop never calls ser.write() itself. It hands frames to this
+## thread through two channels:
+##   - a single-slot drive mailbox: a newer drive frame replaces one that has
+##     not been written yet, so a stalled link never builds a backlog of stale
+##     commands
+##   - a small reliable queue for mode changes, arm zeroing, PID setup and the
+##     neutral burst: every frame put here is written, in order (v1 repeats
+##     of a mode change are identical on purpose, so they are all written)
+##
+## Reliable frames are always written before the mailbox, and queuing one
+## discards any older pending drive frame (its arm byte may belong to the
+## previous arm mode).
+################################################################################
+
+# Maximum number of reliable frames waiting to be written
+RELIABLE_QUEUE_SIZE = 8
+
+
+class SerialWriter:
+
+    ############################################################
+    ## @brief  Create the transmit thread (call start() to run it)
+    ## @param  ser - open serial port; owned by this object from now on
+    ## @param  writeHistogram - optional StageMetrics.LatencyHistogram for ser.write() times
+    ############################################################
+    def __init__(self, ser, writeHistogram=None):
+        self.ser = ser
+        self.writeHistogram = writeHistogram
+        self.cond = threading.Condition()
+        self.mailbox = None
+        self.reliable = collections.deque()
+        self.running = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="SerialWriter")
+        self.thread.daemon = True
+
+        # Counters
+        self.driveSubmitted = 0
+        self.driveWritten = 0
+        self.driveDropped = 0      # drive frames replaced before they were written
+        self.reliableWritten = 0
+        self.reliableCoalesced = 0  # neutral bursts already at the end of the queue
+        self.bytesWritten = 0
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    ############################################################
+    ## @brief  Offer the latest drive frame (never blocks)
+    ## @param  frame - bytes-like frame; copied, so shared buffers are fine
+    ## @return true if it replaced a frame that was never written
+    ############################################################
+    def sendDrive(self, frame):
+        frame = bytes(frame)
+        with self.cond:
+            self.driveSubmitted += 1
+            replaced = self.mailbox is not None
+            if replaced:
+                self.driveDropped += 1
+            self.mailbox = frame
+            self.cond.notify()
+        return replaced
+
+    ############################################################
+    ## @brief  Queue a frame that must reach the wire
+    ## @param  frame - bytes-like frame; copied, so shared buffers are fine
+    ## @param  coalesce - skip the frame if it is already at the end of the queue
+    ##                    (only for the neutral burst, which the watchdog repeats every cycle)
+    ##
+    ## @return true if a pending drive frame was discarded to make way for it
+    ##
+    ## Blocks only if RELIABLE_QUEUE_SIZE frames are already waiting.
+    ############################################################
+    def sendReliable(self, frame, coalesce=False):
+        frame = bytes(frame)
+        with self.cond:
+            replaced = self.mailbox is not None
+            if replaced:
+                self.mailbox = None
+                self.driveDropped += 1
+            if coalesce and self.reliable and self.reliable[-1] == frame:
+                self.reliableCoalesced += 1
+                return replaced
+            while self.running and len(self.reliable) >= RELIABLE_QUEUE_SIZE:
+                self.cond.wait()
+            self.reliable.append(frame)
+            self.cond.notify()
+        return replaced
+
+    ############################################################
+    ## @brief  Thread body: write reliable frames first, then the mailbox
+    ############################################################
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.reliable and self.mailbox is None:
+                    self.cond.wait()
+                if self.reliable:
+                    frame = self.reliable.popleft()
+                    isReliable = True
+                    self.cond.notify()  # wake a producer waiting for queue space
+                elif self.mailbox is not None:
+                    frame = self.mailbox
+                    self.mailbox = None
+                    isReliable = False
+                else:
+                    return  # stopped and drained
+
+            try:
+                start = time.perf_counter_ns()
+                self.ser.write(frame)
+                if self.writeHistogram is not None:
+                    self.writeHistogram.record(time.perf_counter_ns() - start)
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+                    self.running = False
+                    self.cond.notify_all()
+                return
+
+            self.bytesWritten += len(frame)
+            if isReliable:
+                self.reliableWritten += 1
+            else:
+                self.driveWritten += 1
+
+    ############################################################
+    ## @brief  Write whatever is still queued, then stop the thread
+    ## @param  timeout - seconds to wait for the queue to drain
+    ############################################################
+    def stop(self, timeout=1.0):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    ############################################################
+    ## @brief  One-line summary of the transmit counters
+    ############################################################
+    def summary(self):
+        return "drive sent: {}, dropped: {}, reliable sent: {}, coalesced: {}, bytes: {}".format(
+            self.driveWritten, self.driveDropped, self.reliableWritten,
+            self.reliableCoalesced, self.bytesWritten)
+
+
+################################################################################
+## @brief  Same interface as SerialWriter, but writes in the caller's thread
+##
+## For SimHarness and tests, where the control loop runs on a simulated clock
+## and the wire output has to be deterministic.
+################################################################################
+class DirectWriter:
+
+    def __init__(self, ser, writeHistogram=None):
+        self.ser = ser
+        self.writeHistogram = writeHistogram
+        self.running = False
+        self.error = None
+        self.thread = None
+
+        # Counters (nothing is ever dropped or coalesced)
+        self.driveWritten = 0
+        self.driveDropped = 0
+        self.reliableWritten = 0
+        self.reliableCoalesced = 0
+        self.bytesWritten = 0
+
+    def start(self):
+        self.running = True
+
+    def sendDrive(self, frame):
+        self.write(frame)
+        self.driveWritten += 1
+        return False
+
+    def sendReliable(self, frame, coalesce=False):
+        self.write(frame)
+        self.reliableWritten += 1
+        return False
+
+    def write(self, frame):
+        start = time.perf_counter_ns()
+        self.ser.write(frame)
+        if self.writeHistogram is not None:
+            self.writeHistogram.record(time.perf_counter_ns() - start)
+        self.bytesWritten += len(frame)
+
+    def stop(self, timeout=1.0):
+        self.running = False
+
+    def summary(self):
+        return SerialWriter.summary(self)
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+
+import math
+import os
+import random
+import sys
+import time
+import tty
+import pygame
+
+import DriverStation
+import DriveCurves
+import ControlScheduler
+import GamepadInput
+import FlightRecorder
+import FrameEncoder
+import LinkBudget
+import RobotSimulator
+import SerialWriter
+import StageMetrics
+import StationLog
+import Telemetry
+
+################################################################################
+## Headless replay/simulation harness for the control pipeline
+##
+## Runs DriverStation.ControlLoop -- the cycle body and shutdown of
+## DriverStation.main() -- against a gamepad trace instead of a real gamepad, on
+## a simulated clock, as fast as the CPU allows. The trace is posted to pygame's
+## event queue (dummy video driver), frames are written in the loop's thread
+## (SerialWriter.DirectWriter) and everything written to the "robot" is
+## captured, so the wire output can be saved and compared between versions.
+##
+## Traces are lists of (timestamp ns, axes, buttons) samples. They can come
+## from a flight recorder file or be generated.
+##
+## With --robot the output is also fed, at the serial baud rate, into
+## RobotSimulator running on the same simulated clock. That reports what the
+## firmware did with it: frames accepted, framing errors, failsafe entries and
+## the largest gap between accepted frames. --corrupt P flips each byte with
+## probability P to exercise framing-error recovery. The robot's telemetry is
+## read back every cycle through Telemetry.TelemetryReceiver, as main() does.
+##
+## --adaptive runs the pipeline with a LinkBudget.RateController; with --robot
+## its backlog comes from the bytes still in flight to the simulated robot.
+## --link-baud N slows the simulated radio down to N baud.
+##
+## Usage: python SimHarness.py [--recording FILE] [--seconds N] [--seed N]
+##                             [--pty] [--robot] [--corrupt P] [--link-baud N] [--adaptive]
+##                             [--save FILE] [--expect FILE]
+################################################################################
+
+NUM_AXES = 6
+NUM_BUTTONS = 11
+SAMPLE_PERIOD_NS = 10 * ControlScheduler.NS_PER_MS
+
+
+################################################################################
+## @brief  Simulated monotonic clock; sleeping just advances time
+################################################################################
+class SimClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += int(seconds * ControlScheduler.NS_PER_S)
+
+
+################################################################################
+## @brief  Serial port stand-in that keeps everything written to it
+################################################################################
+class FakeSerial:
+
+    # SerialLink attributes the control loop reads
+    reconnects = 0
+    out_waiting = None
+
+    def __init__(self):
+        self.output = bytearray()
+        self.writes = 0
+
+    def write(self, data):
+        self.output += data
+        self.writes += 1
+        return len(data)
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return "{} bytes in {} writes".format(len(self.output), self.writes)
+
+
+################################################################################
+## @brief  Serial port stand-in backed by a raw pty
+##
+## Frames go through the kernel tty layer like they would on a USB-serial
+## adapter; the other end of the pty is drained after every write.
+################################################################################
+class PtySerial(FakeSerial):
+
+    def __init__(self):
+        (self.master, self.slave) = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.output = bytearray()
+        self.writes = 0
+
+    def write(self, data):
+        written = os.write(self.slave, data)
+        self.writes += 1
+        self.drain()
+        return written
+
+    def drain(self):
+        while True:
+            try:
+                chunk = os.read(self.master, 4096)
+            except BlockingIOError:
+                return
+            if not chunk:
+                return
+            self.output += chunk
+
+    def close(self):
+        self.drain()
+        os.close(self.slave)
+        os.close(self.master)
+
+
+################################################################################
+## @brief  Serial port stand-in that delivers everything to a RobotSimulator
+################################################################################
+class RobotSerial(FakeSerial):
+
+    ############################################################
+    ## @param  clock - SimClock shared with the control loop
+    ## @param  corruptProbability - chance of flipping each byte on the "radio"
+    ## @param  seed - random seed for the corruption
+    ## @param  baud - rate the bytes reach the robot at (lower it to model a congested radio)
+    ############################################################
+    def __init__(self, clock, corruptProbability=0.0, seed=0, baud=RobotSimulator.BAUD_RATE):
+        FakeSerial.__init__(self)
+        self.clock = clock
+        self.robot = RobotSimulator.RobotSimulator(baud=baud)
+        self.corruptProbability = corruptProbability
+        self.rng = random.Random(seed)
+        self.bytesCorrupted = 0
+        self.received = bytearray()
+
+    def write(self, data):
+        FakeSerial.write(self, data)
+        nowUs = self.clock.now // 1000
+        self.robot.advance(nowUs)
+        if self.corruptProbability > 0.0:
+            data = bytearray(data)
+            for i in range(0, len(data)):
+                if self.rng.random() < self.corruptProbability:
+                    data[i] ^= 1 << self.rng.randint(0, 7)
+                    self.bytesCorrupted += 1
+        self.robot.receive(data, nowUs)
+        return len(data)
+
+    ############################################################
+    ## @brief  Bytes written but not yet received by the robot (like pyserial's out_waiting)
+    ############################################################
+    @property
+    def out_waiting(self):
+        robot = self.robot
+        nowUs = self.clock.now // 1000
+        waiting = 0
+        for i in range(len(robot.arrivals) - 1, robot.arrivalIndex - 1, -1):
+            if robot.arrivals[i][0] <= nowUs:
+                break
+            waiting += 1
+        return waiting
+
+    ############################################################
+    ## @brief  Bytes the robot has sent back so far (like pyserial's in_waiting)
+    ############################################################
+    @property
+    def in_waiting(self):
+        nowUs = self.clock.now // 1000
+        self.robot.advance(nowUs)
+        self.received += self.robot.takeTransmitted(nowUs)
+        return len(self.received)
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.received))
+        buf[:n] = self.received[:n]
+        del self.received[:n]
+        return n
+
+    def close(self):
+        # Let the robot drain its buffers and reach the failsafe after the last frame
+        self.robot.advance(self.clock.now // 1000 + 500000)
+
+
+############################################################
+## @brief  Snap a value onto the joystick's 16-bit grid
+############################################################
+def quantizeAxis(value):
+    step = round(value * DriveCurves.AXIS_STEPS)
+    if step > DriveCurves.AXIS_STEPS - 1:
+        step = DriveCurves.AXIS_STEPS - 1
+    elif step < -DriveCurves.AXIS_STEPS:
+        step = -DriveCurves.AXIS_STEPS
+    return step / float(DriveCurves.AXIS_STEPS)
+
+
+############################################################
+## @brief  Generate a match-like gamepad trace
+## @param  seconds - trace length
+## @param  seed - random seed (same seed, same trace)
+## @return list of (timestamp ns, axes tuple, buttons tuple)
+############################################################
+def generateTrace(seconds, seed=0):
+    rng = random.Random(seed)
+    trace = []
+    buttons = [0] * NUM_BUTTONS
+    holdUntil = [0] * NUM_BUTTONS
+
+    for n in range(0, int(seconds * ControlScheduler.NS_PER_S // SAMPLE_PERIOD_NS)):
+        t = n * SAMPLE_PERIOD_NS
+        s = t / float(ControlScheduler.NS_PER_S)
+
+        # Sticks wander around with a little sensor noise; triggers rest at -1
+        axes = [0.0] * NUM_AXES
+        axes[0] = 0.3 * math.sin(0.7 * s) + rng.gauss(0, 0.002)
+        axes[1] = 0.9 * math.sin(1.3 * s) + rng.gauss(0, 0.002)
+        axes[2] = -1.0 + max(0.0, 2.0 * math.sin(0.4 * s) - 1.0)
+        axes[3] = 0.2 * math.sin(0.9 * s) + rng.gauss(0, 0.002)
+        axes[4] = 0.8 * math.sin(2.1 * s + 1.0) + rng.gauss(0, 0.002)
+        axes[5] = -1.0
+        axes = tuple(quantizeAxis(a) for a in axes)
+
+        # Occasional presses of the arm buttons (never the stop button)
+        for b in (DriverStation.BUTTON_IDS_ARM_AUTO[0], DriverStation.BUTTON_IDS_ARM_AUTO[1],
+                  DriverStation.BUTTON_ID_EXIT_AUTO, DriverStation.BUTTON_ID_RESET_ARM_POS,
+                  DriverStation.BUTTON_ID_SEND_PID_GAINS):
+            if buttons[b] and t >= holdUntil[b]:
+                buttons[b] = 0
+            elif not buttons[b] and rng.random() < 0.002:
+                buttons[b] = 1
+                holdUntil[b] = t + rng.randint(5, 100) * SAMPLE_PERIOD_NS
+
+        trace.append((t, axes, tuple(buttons)))
+
+    return trace
+
+
+############################################################
+## @brief  Load a trace from a flight recorder file
+## @return list of (timestamp ns, axes tuple, buttons tuple), starting at 0
+############################################################
+def loadRecordingTrace(path):
+    trace = []
+    start = None
+    for r in FlightRecorder.readRecords(path):
+        if start is None:
+            start = r.timestampNs
+        axes = tuple(quantizeAxis(a) for a in r.axes)
+        trace.append((r.timestampNs - start, axes, r.buttons))
+    return trace
+
+
+############################################################
+## @brief  Apply the difference between two snapshots straight to a gamepad (no event queue)
+############################################################
+def applySnapshot(gamepad, axes, buttons):
+    for i in range(0, len(axes)):
+        if gamepad.axes[i] != axes[i]:
+            gamepad.handleEvent(pygame.event.Event(pygame.JOYAXISMOTION, instance_id=0, axis=i, value=axes[i]))
+    for i in range(0, len(buttons)):
+        if gamepad.buttons[i] != buttons[i]:
+            eventType = pygame.JOYBUTTONDOWN if buttons[i] else pygame.JOYBUTTONUP
+            gamepad.handleEvent(pygame.event.Event(eventType, instance_id=0, button=i))
+
+
+############################################################
+## @brief  Post the difference between two snapshots as gamepad events
+## @param  previous - [axes, buttons] last posted; updated in place
+############################################################
+def postSnapshot(previous, axes, buttons):
+    (lastAxes, lastButtons) = previous
+    for i in range(0, len(axes)):
+        if lastAxes[i] != axes[i]:
+            pygame.event.post(pygame.event.Event(pygame.JOYAXISMOTION, instance_id=0, axis=i, value=axes[i]))
+            lastAxes[i] = axes[i]
+    for i in range(0, len(buttons)):
+        if lastButtons[i] != buttons[i]:
+            eventType = pygame.JOYBUTTONDOWN if buttons[i] else pygame.JOYBUTTONUP
+            pygame.event.post(pygame.event.Event(eventType, instance_id=0, button=i))
+            lastButtons[i] = buttons[i]
+
+
+############################################################
+## @brief  Run a trace through the production pipeline
+## @param  trace - list of (timestamp ns, axes, buttons)
+## @param  ser - serial stand-in that captures the output
+## @param  rateHz - control loop rate
+## @param  keepAliveMs - keep-alive interval
+## @param  clock - SimClock to run on (a new one by default)
+## @param  adaptive - run with a LinkBudget.RateController
+## @param  linkBaud - link rate the rate controller budgets for
+## @param  telemetry - read the robot's telemetry every cycle (ser needs in_waiting and readinto)
+## @return dict with the run statistics
+############################################################
+def runTrace(trace, ser, rateHz=DriverStation.CONTROL_LOOP_RATE_HZ, keepAliveMs=DriverStation.KEEP_ALIVE_MS,
+             clock=None, adaptive=False, linkBaud=DriverStation.SERIAL_BAUD, telemetry=False):
+
+    if clock is None:
+        clock = SimClock()
+    GamepadInput.initJoystickOnly()
+    GamepadInput.allowJoystickEventsOnly()
+    pygame.event.clear()
+
+    scheduler = ControlScheduler.ControlScheduler(rateHz, keepAliveMs, clock, clock.sleep)
+    gamepad = GamepadInput.ControllerState(None, len(trace[0][1]), len(trace[0][2]), clock=clock)
+    rate = LinkBudget.RateController(linkBaud, clock=clock) if adaptive else None
+    pipeline = DriverStation.CommandPipeline(DriveCurves.CurveTables(), rateController=rate)
+    encoder = FrameEncoder.FrameEncoder(DriverStation.PID_ERROR_OR_MEASUREMENT, DriverStation.pidGains())
+    receiver = Telemetry.TelemetryReceiver(clock=clock) if telemetry else None
+    metrics = StageMetrics.LoopMetrics()
+    writer = SerialWriter.DirectWriter(ser)
+    writer.start()
+    log = StationLog.StationLog(console=False)
+    loop = DriverStation.ControlLoop(scheduler, gamepad, pipeline, encoder, ser, writer, metrics, log, receiver,
+                                     report=lambda line: None)
+
+    endNs = trace[-1][0]
+    index = 0
+    previous = [list(gamepad.axes), list(gamepad.buttons)]
+
+    wallStart = time.perf_counter()
+    while clock.now <= endNs and not loop.done:
+
+        scheduler.waitNextCycle()
+
+        # Deliver every sample up to now as gamepad events
+        while index < len(trace) and trace[index][0] <= clock.now:
+            postSnapshot(previous, trace[index][1], trace[index][2])
+            index += 1
+
+        loop.runCycle()
+
+    neutralBursts = loop.neutralBursts
+    loop.shutdown()
+    wallSeconds = time.perf_counter() - wallStart
+    frames = metrics.framesSent
+
+    return {'cycles': scheduler.cycles,
+            'frames': frames,
+            'neutralBursts': neutralBursts,
+            'simSeconds': clock.now / float(ControlScheduler.NS_PER_S),
+            'wallSeconds': wallSeconds,
+            'framesPerSecond': frames / wallSeconds if wallSeconds > 0 else 0.0,
+            'cyclesPerSecond': scheduler.cycles / wallSeconds if wallSeconds > 0 else 0.0,
+            'rate': rate.summary() if rate is not None else None,
+            'telemetry': receiver.summary() if receiver is not None else None}
+
+
+def main():
+
+    args = sys.argv[1:]
+
+    def option(name, default=None):
+        if name in args:
+            return args[args.index(name) + 1]
+        return default
+
+    if option('--recording') is not None:
+        trace = loadRecordingTrace(option('--recording'))
+    else:
+        trace = generateTrace(float(option('--seconds', 180)), int(option('--seed', 0)))
+
+    if '--robot' in args:
+        clock = SimClock()
+        ser = RobotSerial(clock, float(option('--corrupt', 0.0)), int(option('--seed', 0)),
+                          int(option('--link-baud', RobotSimulator.BAUD_RATE)))
+    else:
+        clock = None
+        ser = PtySerial() if '--pty' in args else FakeSerial()
+    stats = runTrace(trace, ser, clock=clock, adaptive='--adaptive' in args,
+                     linkBaud=int(option('--link-baud', DriverStation.SERIAL_BAUD)), telemetry='--robot' in args)
+    ser.close()
+
+    print("Simulated {simSeconds:.1f}s in {wallSeconds:.3f}s: {cycles} cycles, {frames} frames, "
+          "{neutralBursts} neutral bursts".format(**stats))
+    print("Throughput: {framesPerSecond:.0f} frames/s, {cyclesPerSecond:.0f} cycles/s".format(**stats))
+    print("Wire output: {} bytes in {} writes".format(len(ser.output), ser.writes))
+    if stats['rate'] is not None:
+        print("Link budget:", stats['rate'])
+    if '--robot' in args:
+        print("Robot:", ser.robot.summary())
+        print("Robot", stats['telemetry'])
+        print("Bytes corrupted on the link:", ser.bytesCorrupted)
+
+    if option('--save') is not None:
+        with open(option('--save'), 'wb') as f:
+            f.write(ser.output)
+
+    if option('--expect') is not None:
+        with open(option('--expect'), 'rb') as f:
+            expected = f.read()
+        if expected == bytes(ser.output):
+            print("Wire output matches", option('--expect'))
+        else:
+            mismatch = next((i for i in range(0, min(len(expected), len(ser.output)))
+                             if expected[i] != ser.output[i]), min(len(expected), len(ser.output)))
+            print("Wire output differs from", option('--expect'), "at byte", mismatch)
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+import array
+import signal
+import threading
+import time
+
+################################################################################
+## Per-stage latency instrumentation for the control loop
+##
+## Every stage of a control cycle feeds a fixed-bucket latency histogram. The
+## buckets are powers of two in nanoseconds and live in a preallocated array,
+## so recording a sample is a clock read, a bit_length() and an increment.
+##
+## Counters for frames, reliable (mode change/PID) frames, watchdog trips and
+## bytes are kept alongside. A summary can be printed periodically, on SIGUSR1
+## (SIGBREAK / Ctrl-Break on Windows), and dumped to a file. The loop only
+## flags that a summary is due; a reporter thread formats it, hands it to the
+## report function (e.g. StationLog.message) and writes the dump file.
+################################################################################
+
+# Bucket i holds samples in [2^(i-1), 2^i) ns; the last bucket also holds anything longer
+NUM_BUCKETS = 40
+
+# Stage indices, in the order they run in a cycle
+STAGE_EVENTS = 0    # gamepad.update() (replaces pygame.event.pump())
+STAGE_WATCHDOG = 1  # gamepad watchdog check
+STAGE_COMPUTE = 2   # CommandPipeline.nextFrame()
+STAGE_PRINT = 3     # queuing the log record (StationLog)
+STAGE_WRITE = 4     # handing the frame to the transmit thread
+STAGE_RECORD = 5    # flight recorder
+STAGE_CYCLE = 6     # whole cycle, excluding the scheduler wait
+STAGE_SERIAL = 7    # ser.write() in the transmit thread
+STAGE_NAMES = ['events', 'watchdog', 'compute', 'print', 'write', 'record', 'cycle', 'ser.write']
+
+
+class LatencyHistogram:
+
+    def __init__(self):
+        self.buckets = array.array('Q', [0] * NUM_BUCKETS)
+        self.count = 0
+        self.totalNs = 0
+        self.maxNs = 0
+
+    ############################################################
+    ## @brief  Add one sample
+    ## @param  ns - duration in nanoseconds
+    ############################################################
+    def record(self, ns):
+        i = ns.bit_length()
+        if i >= NUM_BUCKETS:
+            i = NUM_BUCKETS - 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.totalNs += ns
+        if ns > self.maxNs:
+            self.maxNs = ns
+
+    ############################################################
+    ## @brief  Approximate percentile (upper edge of the bucket)
+    ## @param  fraction - 0.0 to 1.0
+    ## @return nanoseconds
+    ############################################################
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for i in range(0, NUM_BUCKETS):
+            seen += self.buckets[i]
+            if seen >= target:
+                return min(1 << i, self.maxNs)
+        return self.maxNs
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.totalNs / float(self.count)
+
+
+class LoopMetrics:
+
+    ############################################################
+    ## @brief  Set up the histograms and counters
+    ## @param  summaryPeriodS - report a summary this often (0 to disable)
+    ## @param  dumpPath - file written by dump() (and with every summary), or None
+    ## @param  report - function called with the summary text, from the reporter thread
+    ############################################################
+    def __init__(self, summaryPeriodS=0, dumpPath=None, report=print):
+        self.clock = time.perf_counter_ns
+        self.histograms = [LatencyHistogram() for name in STAGE_NAMES]
+        self.summaryPeriodNs = int(summaryPeriodS * 1e9)
+        self.dumpPath = dumpPath
+        self.report = report
+        self.reportDue = False
+        self.wake = threading.Event()
+        self.reporter = None    # started with the first summary
+        self.closing = False
+
+        self.cycleStart = 0
+        self.stageStart = 0
+        self.startNs = self.clock()
+        self.nextSummaryNs = self.startNs + self.summaryPeriodNs
+        self.summaryRequested = False
+
+        # Counters
+        self.framesSent = 0
+        self.reliableSent = 0
+        self.watchdogTrips = 0
+        self.bytesSent = 0
+
+    ############################################################
+    ## @brief  Mark the start of a cycle (after the scheduler wait)
+    ############################################################
+    def beginCycle(self):
+        now = self.clock()
+        self.cycleStart = now
+        self.stageStart = now
+
+    ############################################################
+    ## @brief  Mark the end of a stage; the next stage starts now
+    ## @param  stage - one of the STAGE_* indices
+    ############################################################
+    def endStage(self, stage):
+        now = self.clock()
+        self.histograms[stage].record(now - self.stageStart)
+        self.stageStart = now
+
+    ############################################################
+    ## @brief  Mark the end of the cycle and wake the reporter if a summary is due
+    ############################################################
+    def endCycle(self):
+        now = self.clock()
+        self.histograms[STAGE_CYCLE].record(now - self.cycleStart)
+        if self.summaryRequested or (self.summaryPeriodNs > 0 and now >= self.nextSummaryNs):
+            self.summaryRequested = False
+            self.nextSummaryNs = now + self.summaryPeriodNs
+            if self.reporter is None:
+                self.reporter = threading.Thread(target=self.runReporter, name="LoopMetrics")
+                self.reporter.daemon = True
+                self.reporter.start()
+            self.reportDue = True
+            self.wake.set()
+
+    ############################################################
+    ## @brief  Reporter thread body: format and write a summary each time one is due
+    ##
+    ## The histograms keep changing while the summary is formatted, so a
+    ## summary can be off by the samples of the cycle in progress.
+    ############################################################
+    def runReporter(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            if self.reportDue:
+                self.reportDue = False
+                self.report(self.summary())
+                if self.dumpPath is not None:
+                    self.dump()
+            if self.closing:
+                return
+
+    ############################################################
+    ## @brief  Stop the reporter thread (summaries already due are written first)
+    ############################################################
+    def close(self):
+        reporter = self.reporter
+        if reporter is None:
+            return
+        self.closing = True
+        self.wake.set()
+        reporter.join()
+        self.reporter = None
+
+    ############################################################
+    ## @brief  Count a transmitted frame
+    ## @param  numBytes - frame length
+    ## @param  reliable - whether it was a mode change/PID frame
+    ############################################################
+    def frameSent(self, numBytes, reliable):
+        self.framesSent += 1
+        self.bytesSent += numBytes
+        if reliable:
+            self.reliableSent += 1
+
+    def watchdogTripped(self, numBytes):
+        self.watchdogTrips += 1
+        self.bytesSent += numBytes
+
+    ############################################################
+    ## @brief  Print a summary at the end of the next cycle when the signal arrives
+    ############################################################
+    def installSignalHandler(self):
+        sig = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+        if sig is None:
+            return
+        def handler(signum, frame):
+            self.summaryRequested = True
+        signal.signal(sig, handler)
+
+    ############################################################
+    ## @brief  Text summary of all histograms and counters
+    ############################################################
+    def summary(self):
+        elapsedS = (self.clock() - self.startNs) / 1e9
+        if elapsedS <= 0:
+            elapsedS = 1e-9
+        lines = ["{:<10}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+            "stage", "count", "mean us", "p50 us", "p99 us", "max us")]
+        for i in range(0, len(STAGE_NAMES)):
+            h = self.histograms[i]
+            if h.count == 0:
+                continue
+            lines.append("{:<10}{:>10}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                STAGE_NAMES[i], h.count, h.mean() / 1000.0, h.percentile(0.5) / 1000.0,
+                h.percentile(0.99) / 1000.0, h.maxNs / 1000.0))
+        lines.append("frames: {} ({:.1f}/s), resends/mode changes: {}, watchdog trips: {}, "
+                     "bytes: {} ({:.0f} B/s)".format(
+                         self.framesSent, self.framesSent / elapsedS, self.reliableSent,
+                         self.watchdogTrips, self.bytesSent, self.bytesSent / elapsedS))
+        return "\n".join(lines)
+
+    ############################################################
+    ## @brief  Write the summary and raw bucket counts to dumpPath
+    ############################################################
+    def dump(self, path=None):
+        if path is None:
+            path = self.dumpPath
+        with open(path, 'w') as f:
+            f.write(self.summary())
+            f.write("\n\nbuckets (upper edge ns: count)\n")
+            for i in range(0, len(STAGE_NAMES)):
+                h = self.histograms[i]
+                f.write("{}: {}\n".format(STAGE_NAMES[i], " ".join(
+                    "{}:{}".format(1 << b, h.buckets[b]) for b in range(0, NUM_BUCKETS) if h.buckets[b])))
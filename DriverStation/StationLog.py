@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import collections
+import sys
+import threading
+import time
+
+################################################################################
+## Background console/file logging for the control loop
+##
+## The control loop never formats or writes text itself. frame() and message()
+## append a small tuple to a bounded deque (append is atomic, no lock, no
+## system call) and return; if the consumer has fallen LOG_QUEUE_SIZE records
+## behind, the record is counted as dropped instead of waiting.
+##
+## A consumer thread wakes every FLUSH_PERIOD_S and:
+##   - aggregates transmitted frames per source (robot) into one line per
+##     summary period: "Sent N frames in T s, last L: .., R: .., A: .., loopCounter: .."
+##     (a period of 0 prints every frame, as the loop used to)
+##   - collapses identical consecutive messages into "<message> (repeated N more times)",
+##     reported at most once per summary period
+##   - writes at most MAX_MESSAGES_PER_FLUSH messages per wake-up and counts
+##     the rest as suppressed
+##   - writes to the console and/or a log file
+##
+## A slow terminal or disk therefore only delays the log, never a frame.
+################################################################################
+
+LOG_QUEUE_SIZE = 1024       # records waiting for the consumer before new ones are dropped
+FLUSH_PERIOD_S = 0.1        # how often the consumer drains the queue
+MAX_MESSAGES_PER_FLUSH = 20 # messages written per wake-up; the rest are only counted
+
+# Record kinds
+RECORD_FRAME = 0
+RECORD_MESSAGE = 1
+
+
+class StationLog:
+
+    ############################################################
+    ## @brief  Create the logger (call start() to run the consumer)
+    ## @param  console - write to stdout
+    ## @param  path - log file to append to, or None
+    ## @param  frameSummaryS - seconds between frame summary lines per source, 0 = every frame
+    ############################################################
+    def __init__(self, console=True, path=None, frameSummaryS=1.0):
+        self.console = console
+        self.file = open(path, 'a') if path is not None else None
+        self.frameSummaryNs = int(frameSummaryS * 1e9)
+        self.queue = collections.deque()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="StationLog")
+        self.thread.daemon = True
+
+        # Consumer state
+        self.frames = {}            # source -> [count, first tNs, last record]
+        self.lastMessage = None
+        self.repeats = 0
+        self.repeatsSinceNs = 0
+        self.messagesThisFlush = 0
+
+        # Counters
+        self.recordsDropped = 0
+        self.messagesSuppressed = 0
+        self.linesWritten = 0
+
+    def start(self):
+        self.thread.start()
+
+    ############################################################
+    ## @brief  Log a transmitted frame (never blocks)
+    ## @param  tNs - cycle timestamp (monotonic ns)
+    ## @param  left, right, arm - commands sent
+    ## @param  loopCounter - CommandPipeline.loopCounter
+    ## @param  source - prefix of the robot the frame went to
+    ############################################################
+    def frame(self, tNs, left, right, arm, loopCounter, source=''):
+        if len(self.queue) >= LOG_QUEUE_SIZE:
+            self.recordsDropped += 1
+            return
+        self.queue.append((RECORD_FRAME, source, tNs, left, right, arm, loopCounter))
+
+    ############################################################
+    ## @brief  Log a line of text (never blocks)
+    ## @param  text - already formatted; use for status lines that are cheap to build
+    ############################################################
+    def message(self, text):
+        if len(self.queue) >= LOG_QUEUE_SIZE:
+            self.recordsDropped += 1
+            return
+        self.queue.append((RECORD_MESSAGE, text))
+
+    ############################################################
+    ## @brief  Thread body: drain and write until stopped, then flush the rest
+    ############################################################
+    def run(self):
+        while not self.stopping.wait(FLUSH_PERIOD_S):
+            self.drain(time.monotonic_ns(), False)
+        self.drain(time.monotonic_ns(), True)
+
+    ############################################################
+    ## @brief  Format everything queued so far
+    ## @param  nowNs - current time, to decide which frame summaries are due
+    ## @param  final - write all pending summaries
+    ############################################################
+    def drain(self, nowNs, final):
+        queue = self.queue
+        lines = []
+        self.messagesThisFlush = 0
+        suppressed = self.messagesSuppressed
+        while queue:
+            record = queue.popleft()
+            if record[0] == RECORD_FRAME:
+                self.addFrame(record, lines)
+            else:
+                self.addMessage(record[1], nowNs, lines)
+        if self.messagesSuppressed != suppressed:
+            lines.append("({} messages suppressed)".format(self.messagesSuppressed - suppressed))
+        if self.repeats and nowNs - self.repeatsSinceNs >= self.frameSummaryNs:
+            self.flushRepeats(lines)
+
+        for (source, pending) in list(self.frames.items()):
+            if final or nowNs - pending[1] >= self.frameSummaryNs:
+                lines.append(self.frameSummary(source, pending))
+                del self.frames[source]
+        if final:
+            self.flushRepeats(lines)
+            if self.recordsDropped:
+                lines.append("Log -- {} records dropped (queue full)".format(self.recordsDropped))
+        self.write(lines)
+
+    def addFrame(self, record, lines):
+        if self.frameSummaryNs <= 0:
+            (kind, source, tNs, left, right, arm, loopCounter) = record
+            lines.append("{}Sending... L: {}, R: {}, A: {}, loopCounter: {}".format(
+                source, left, right, arm, loopCounter))
+            return
+        pending = self.frames.get(record[1])
+        if pending is None:
+            self.frames[record[1]] = [1, record[2], record]
+        else:
+            pending[0] += 1
+            pending[2] = record
+
+    def frameSummary(self, source, pending):
+        (count, firstNs, record) = pending
+        (kind, source, tNs, left, right, arm, loopCounter) = record
+        return "{}Sent {} frames in {:.1f}s, last L: {}, R: {}, A: {}, loopCounter: {}".format(
+            source, count, (tNs - firstNs) / 1e9, left, right, arm, loopCounter)
+
+    ############################################################
+    ## @brief  Add a message, collapsing repeats of the previous one
+    ############################################################
+    def addMessage(self, text, nowNs, lines):
+        if text == self.lastMessage:
+            if not self.repeats:
+                self.repeatsSinceNs = nowNs
+            self.repeats += 1
+            return
+        self.flushRepeats(lines)
+        self.lastMessage = text
+        if self.messagesThisFlush >= MAX_MESSAGES_PER_FLUSH:
+            self.messagesSuppressed += 1
+            return
+        self.messagesThisFlush += 1
+        lines.append(text)
+
+    def flushRepeats(self, lines):
+        if self.repeats:
+            lines.append("{} (repeated {} more times)".format(self.lastMessage, self.repeats))
+            self.repeats = 0
+
+    def write(self, lines):
+        if not lines:
+            return
+        text = "\n".join(lines) + "\n"
+        if self.console:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        if self.file is not None:
+            self.file.write(text)
+            self.file.flush()
+        self.linesWritten += len(lines)
+
+    ############################################################
+    ## @brief  Write everything still queued and stop the consumer
+    ## @param  timeout - seconds to wait for the consumer to finish
+    ############################################################
+    def close(self, timeout=1.0):
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        if self.thread.ident is not None:
+            self.thread.join(timeout)
+        else:
+            self.drain(time.monotonic_ns(), True)   # never started
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+
+import array
+import collections
+import struct
+import sys
+import time
+
+import LinkProtocol
+
+################################################################################
+## Telemetry sent back by the robot, and the driver station's receive path
+##
+## The firmware sends a telemetry frame every TELEMETRY_PERIOD_MS, framed like
+## a v2 control frame (see LinkProtocol.py) so both protocols share one
+## parser and one CRC:
+##
+##   254, <0:3 | seq:5>, 7, 0, TELEMETRY_SIZE, <payload>, <crc>
+##
+## Payload, little-endian:
+##   uint32 robot millis()
+##   uint16 loop count (command frames processed, wraps)
+##   int32  arm encoder, relative to the zero point
+##   int16  arm PID setpoint (encoder counts)
+##   int16  arm output (microseconds written to the arm ESC)
+##   uint8  flags (FLAG_FAILSAFE, FLAG_ARM_ANGLE_MODE)
+##   uint8  left, right, arm of the last command frame processed
+##   uint16 ms since that frame was processed
+##
+## The robot only queues a frame when its transmit buffer has room for it, so
+## telemetry never delays the firmware loop. With protocol v2 the same stream
+## carries the command ACKs.
+##
+## On the driver station, TelemetryReceiver.poll() reads whatever the port has
+## with one non-blocking bulk read into a ring buffer and parses complete
+## frames in place, so it can run every control cycle. It keeps the latest
+## sample and rolling statistics (link round-trip time, arm PID error and
+## output, telemetry interval). The round-trip time pairs the echoed command
+## with the time it was handed to the link, minus the robot's time since it
+## processed it; when the same values were sent several times it reports the
+## latest send that fits.
+##
+## Usage: python Telemetry.py [PORT]   (prints the robot's telemetry, read-only)
+################################################################################
+
+TELEMETRY_FORMAT = struct.Struct('<IHihhBBBBH')
+TELEMETRY_SIZE = TELEMETRY_FORMAT.size
+TELEMETRY_FRAME_SIZE = LinkProtocol.CONTROL_HEADER_SIZE + TELEMETRY_SIZE + 1
+TELEMETRY_PERIOD_MS = 50
+
+FLAG_FAILSAFE = 1
+FLAG_ARM_ANGLE_MODE = 2
+
+RING_SIZE = 4096            # receive ring buffer, a power of two
+STATS_WINDOW = 100          # samples in the rolling statistics (5s of telemetry)
+SENT_HISTORY = 64           # command frames remembered for the round-trip time
+
+Sample = collections.namedtuple('Sample', ['receivedNs', 'robotMs', 'loopCount', 'encoder', 'setpoint',
+                                           'armUs', 'failsafe', 'armAngleMode', 'left', 'right', 'arm',
+                                           'commandAgeMs'])
+
+
+############################################################
+## @brief  Build a telemetry frame (what the firmware sends)
+############################################################
+def encodeTelemetry(seq, robotMs, loopCount, encoder, setpoint, armUs, flags, left, right, arm, commandAgeMs):
+    payload = TELEMETRY_FORMAT.pack(robotMs & 0xFFFFFFFF, loopCount & 0xFFFF, encoder, setpoint, armUs,
+                                    flags, left, right, arm, min(commandAgeMs, 0xFFFF))
+    return LinkProtocol.encodeControl(seq, LinkProtocol.CONTROL_TELEMETRY, 0, payload)
+
+
+################################################################################
+## @brief  Fixed-size byte ring filled straight from the serial port
+################################################################################
+class RingBuffer:
+
+    def __init__(self, size=RING_SIZE):
+        if size & (size - 1):
+            raise ValueError("Ring buffer size must be a power of two")
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.size = size
+        self.mask = size - 1
+        self.head = 0   # next byte to parse (free-running)
+        self.tail = 0   # next byte to fill (free-running)
+
+    def available(self):
+        return self.tail - self.head
+
+    def space(self):
+        return self.size - (self.tail - self.head)
+
+    ############################################################
+    ## @brief  Read up to count bytes from the port without allocating
+    ## @return number of bytes read
+    ############################################################
+    def fill(self, ser, count):
+        total = 0
+        count = min(count, self.space())
+        while count > 0:
+            start = self.tail & self.mask
+            chunk = min(count, self.size - start)
+            n = ser.readinto(self.view[start:start + chunk])
+            if not n:
+                break
+            self.tail += n
+            total += n
+            count -= n
+        return total
+
+    ############################################################
+    ## @brief  Append bytes that were already read
+    ## @return number of bytes stored (the rest did not fit)
+    ############################################################
+    def write(self, data):
+        count = min(len(data), self.space())
+        pos = 0
+        while pos < count:
+            start = self.tail & self.mask
+            chunk = min(count - pos, self.size - start)
+            self.buf[start:start + chunk] = data[pos:pos + chunk]
+            self.tail += chunk
+            pos += chunk
+        return count
+
+    def peek(self, offset):
+        return self.buf[(self.head + offset) & self.mask]
+
+    ############################################################
+    ## @brief  Copy n bytes starting at offset into out (a contiguous buffer)
+    ############################################################
+    def copy(self, offset, n, out):
+        start = (self.head + offset) & self.mask
+        first = min(n, self.size - start)
+        out[0:first] = self.view[start:start + first]
+        if first < n:
+            out[first:n] = self.view[0:n - first]
+
+    def consume(self, n):
+        self.head += n
+
+
+################################################################################
+## @brief  Mean/min/max over the last `window` values
+################################################################################
+class RollingStats:
+
+    def __init__(self, window=STATS_WINDOW):
+        self.values = array.array('d', [0.0] * window)
+        self.window = window
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        i = self.count % self.window
+        if self.count >= self.window:
+            self.total -= self.values[i]
+        self.values[i] = value
+        self.total += value
+        self.count += 1
+
+    def filled(self):
+        return min(self.count, self.window)
+
+    def mean(self):
+        n = self.filled()
+        return self.total / n if n else 0.0
+
+    def min(self):
+        n = self.filled()
+        return min(self.values[:n]) if n else 0.0
+
+    def max(self):
+        n = self.filled()
+        return max(self.values[:n]) if n else 0.0
+
+    def format(self, unit=''):
+        if not self.count:
+            return "-"
+        return "{:.1f}{} ({:.1f}-{:.1f})".format(self.mean(), unit, self.min(), self.max())
+
+
+################################################################################
+## @brief  Non-blocking receive pipeline for everything the robot sends back
+################################################################################
+class TelemetryReceiver:
+
+    ############################################################
+    ## @param  ackHandler - called with the cmdSeq of each v2 ACK (FrameEncoderV2.ackReceived), or None
+    ## @param  clock - monotonic nanosecond clock (replaceable for simulation)
+    ############################################################
+    def __init__(self, ackHandler=None, clock=time.monotonic_ns):
+        self.ring = RingBuffer()
+        self.payload = bytearray(TELEMETRY_SIZE)
+        self.ackHandler = ackHandler
+        self.clock = clock
+
+        self.latest = None
+        self.lastSeq = None
+
+        # Command frames handed to the link: packed (left, right, arm) and when
+        self.sentKeys = array.array('l', [-1] * SENT_HISTORY)
+        self.sentNs = array.array('q', [0] * SENT_HISTORY)
+        self.sentIndex = 0
+
+        # Rolling statistics
+        self.rttMs = RollingStats()
+        self.pidError = RollingStats()      # setpoint - encoder, in angle mode
+        self.armUs = RollingStats()
+        self.intervalMs = RollingStats()    # robot time between telemetry frames
+
+        # Counters
+        self.bytesReceived = 0
+        self.samples = 0
+        self.acks = 0
+        self.crcErrors = 0
+        self.seqGaps = 0
+        self.skippedBytes = 0
+        self.failsafeSamples = 0
+
+    ############################################################
+    ## @brief  Read and parse whatever the port has, without blocking
+    ## @param  ser - pyserial port (or anything with in_waiting and readinto)
+    ## @return number of telemetry samples received
+    ############################################################
+    def poll(self, ser):
+        waiting = ser.in_waiting
+        if waiting:
+            self.bytesReceived += self.ring.fill(ser, waiting)
+        return self.parse()
+
+    ############################################################
+    ## @brief  Parse bytes that were read elsewhere (e.g. by the asyncio runtime)
+    ## @return number of telemetry samples received
+    ############################################################
+    def feed(self, data):
+        received = 0
+        view = memoryview(data)
+        while view:
+            n = self.ring.write(view)
+            view = view[n:]
+            self.bytesReceived += n
+            received += self.parse()
+        return received
+
+    ############################################################
+    ## @brief  Remember when a command frame was handed to the link
+    ############################################################
+    def noteSent(self, left, right, arm):
+        i = self.sentIndex
+        self.sentKeys[i] = (left << 16) | (right << 8) | arm
+        self.sentNs[i] = self.clock()
+        self.sentIndex = (i + 1) % SENT_HISTORY
+
+    def parse(self):
+        ring = self.ring
+        table = LinkProtocol.CRC8_TABLE
+        received = 0
+
+        while True:
+            available = ring.available()
+            if available == 0:
+                break
+            if ring.peek(0) != LinkProtocol.SYNC_V2:
+                ring.consume(1)
+                self.skippedBytes += 1
+                continue
+            if available < 2:
+                break
+
+            header = ring.peek(1)
+            mask = header >> 5
+            if mask == 0:
+                if available < LinkProtocol.CONTROL_HEADER_SIZE:
+                    break
+                end = LinkProtocol.CONTROL_HEADER_SIZE + ring.peek(4)
+            else:
+                end = 2 + (mask & 1) + ((mask >> 1) & 1) + (mask >> 2)
+            if available <= end:
+                break
+
+            crc = 0
+            for i in range(1, end):
+                crc = table[crc ^ ring.peek(i)]
+            if crc != ring.peek(end):
+                self.crcErrors += 1
+                ring.consume(1)
+                continue
+
+            if mask == 0:
+                code = ring.peek(2)
+                if code == LinkProtocol.CONTROL_TELEMETRY and end - LinkProtocol.CONTROL_HEADER_SIZE == TELEMETRY_SIZE:
+                    ring.copy(LinkProtocol.CONTROL_HEADER_SIZE, TELEMETRY_SIZE, self.payload)
+                    self.telemetryReceived(header & LinkProtocol.SEQ_MASK)
+                    received += 1
+                elif code == LinkProtocol.CONTROL_ACK:
+                    self.acks += 1
+                    if self.ackHandler is not None:
+                        self.ackHandler(ring.peek(3))
+            ring.consume(end + 1)
+
+        return received
+
+    def telemetryReceived(self, seq):
+        now = self.clock()
+        (robotMs, loopCount, encoder, setpoint, armUs, flags, left, right, arm, commandAgeMs) = \
+            TELEMETRY_FORMAT.unpack_from(self.payload)
+
+        if self.lastSeq is not None:
+            self.seqGaps += (seq - self.lastSeq - 1) & LinkProtocol.SEQ_MASK
+        self.lastSeq = seq
+
+        previous = self.latest
+        sample = Sample(now, robotMs, loopCount, encoder, setpoint, armUs, bool(flags & FLAG_FAILSAFE),
+                        bool(flags & FLAG_ARM_ANGLE_MODE), left, right, arm, commandAgeMs)
+        self.latest = sample
+        self.samples += 1
+
+        if previous is not None:
+            self.intervalMs.add((robotMs - previous.robotMs) & 0xFFFFFFFF)
+        self.armUs.add(armUs)
+        if sample.armAngleMode:
+            self.pidError.add(setpoint - encoder)
+        if sample.failsafe:
+            self.failsafeSamples += 1
+            return
+
+        # Round trip: the latest send of the echoed values that was before the robot processed them
+        processedNs = now - commandAgeMs * 1000000
+        key = (left << 16) | (right << 8) | arm
+        for back in range(1, SENT_HISTORY + 1):
+            i = (self.sentIndex - back) % SENT_HISTORY
+            if self.sentKeys[i] == key and self.sentNs[i] <= processedNs:
+                self.rttMs.add((processedNs - self.sentNs[i]) / 1e6)
+                break
+
+    ############################################################
+    ## @return ms since the last telemetry frame, or None if none has arrived
+    ############################################################
+    def ageMs(self):
+        if self.latest is None:
+            return None
+        return (self.clock() - self.latest.receivedNs) / 1e6
+
+    ############################################################
+    ## @brief  One-line view of the latest sample
+    ############################################################
+    def status(self):
+        s = self.latest
+        if s is None:
+            return "no telemetry"
+        return "{} enc={} setpoint={} arm={}us loop={} | rtt {}".format(
+            "FAILSAFE" if s.failsafe else ("angle" if s.armAngleMode else "motor"),
+            s.encoder, s.setpoint, s.armUs, s.loopCount, self.rttMs.format('ms'))
+
+    def summary(self):
+        return "telemetry: {} samples, interval {}, rtt {}, pid error {}, arm {} | " \
+               "acks: {}, crcErrors: {}, seqGaps: {}, skipped: {}, failsafe samples: {}".format(
+                   self.samples, self.intervalMs.format('ms'), self.rttMs.format('ms'),
+                   self.pidError.format(), self.armUs.format('us'), self.acks, self.crcErrors,
+                   self.seqGaps, self.skippedBytes, self.failsafeSamples)
+
+
+def main():
+    import serial
+    import DriverStation
+
+    args = sys.argv[1:]
+    ser = serial.Serial(args[0] if args else DriverStation.comPort, DriverStation.SERIAL_BAUD, timeout=0)
+    receiver = TelemetryReceiver()
+    try:
+        while True:
+            if receiver.poll(ser):
+                print(receiver.status())
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        print(receiver.summary())
+    finally:
+        ser.close()
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
@@ -1,138 +1,421 @@
 #!/usr/bin/env python
-# Code taken from http://www.pygame.org/docs/ref/joystick.html
+# Based on the example at http://www.pygame.org/docs/ref/joystick.html
 
+import sys
+import time
 import pygame
 
+################################################################################
+## Gamepad monitor that can run next to the driver station
+##
+## - Joysticks are opened once, and again only when one is plugged in.
+## - The process sleeps in pygame.event.wait() until the gamepad reports a
+##   change; the screen is redrawn at most MAX_FPS times per second.
+## - Static labels are rendered once. Values are drawn from a cache of
+##   per-character glyph surfaces, only when their text changed, and only the
+##   changed rectangles are pushed to the display.
+## - Each axis shows its event rate (how often the gamepad reports it) and the
+##   update latency (time from reading its event to the value being on screen,
+##   mean/max over the last RATE_WINDOW_S).
+################################################################################
+
 # Define some colors
 BLACK    = (   0,   0,   0)
 WHITE    = ( 255, 255, 255)
 
-# This is a simple class that will help us print to the screen
-# It has nothing to do with the joysticks, just outputing the
-# information.
-class TextPrint:
-    def __init__(self):
-        self.reset()
-        self.font = pygame.font.Font(None, 20)
-
-    def disp(self, screen, textString):
-        textBitmap = self.font.render(textString, True, BLACK)
-        screen.blit(textBitmap, [self.x, self.y])
-        self.y += self.line_height
-        
-    def reset(self):
-        self.x = 10
-        self.y = 10
-        self.line_height = 15
-        
-    def indent(self):
-        self.x += 10
-        
-    def unindent(self):
-        self.x -= 10
-    
-
-pygame.init()
- 
-# Set the width and height of the screen [width,height]
-size = [500, 700]
-screen = pygame.display.set_mode(size)
-
-pygame.display.set_caption("My Game")
-
-#Loop until the user clicks the close button.
-done = False
-
-# Used to manage how fast the screen updates
-clock = pygame.time.Clock()
-
-# Initialize the joysticks
-pygame.joystick.init()
-    
-# Get ready to print
-textPrint = TextPrint()
-
-# -------- Main Program Loop -----------
-while done==False:
-    # EVENT PROCESSING STEP
-    for event in pygame.event.get(): # User did something
-        if event.type == pygame.QUIT: # If user clicked close
-            done=True # Flag that we are done so we exit this loop
-        
-        # Possible joystick actions: JOYAXISMOTION JOYBALLMOTION JOYBUTTONDOWN JOYBUTTONUP JOYHATMOTION
-        if event.type == pygame.JOYBUTTONDOWN:
-            print("Joystick button pressed.")
-        if event.type == pygame.JOYBUTTONUP:
-            print("Joystick button released.")
-            
- 
-    # DRAWING STEP
-    # First, clear the screen to white. Don't put other drawing commands
-    # above this, or they will be erased with this command.
-    screen.fill(WHITE)
-    textPrint.reset()
-
-    # Get count of joysticks
-    joystick_count = pygame.joystick.get_count()
-
-    textPrint.disp(screen, "Number of joysticks: {}".format(joystick_count) )
-    textPrint.indent()
-    
-    # For each joystick:
-    for i in range(joystick_count):
-        joystick = pygame.joystick.Joystick(i)
+SCREEN_SIZE = [500, 700]
+FONT_SIZE = 20
+LINE_HEIGHT = 15
+INDENT = 10
+
+MAX_FPS = 30            # Redraw at most this often
+RATE_WINDOW_S = 1.0     # Rate and latency readouts cover this long
+
+NS_PER_S = 1000000000
+
+# Characters value fields can contain; anything else is rendered on first use
+VALUE_CHARS = "0123456789-+.,()/ ms"
+
+EXPOSE_EVENTS = [pygame.VIDEOEXPOSE, getattr(pygame, 'WINDOWEXPOSED', pygame.VIDEOEXPOSE)]
+MONITOR_EVENTS = [pygame.QUIT, pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP,
+                  pygame.JOYHATMOTION, pygame.JOYDEVICEADDED, pygame.JOYDEVICEREMOVED] + EXPOSE_EVENTS
+
+
+################################################################################
+## @brief  Rendered text, kept so nothing is rendered twice
+################################################################################
+class GlyphCache:
+
+    def __init__(self, font, color, background):
+        self.font = font
+        self.color = color
+        self.background = background
+        self.labels = {}
+        self.glyphs = {}
+        for ch in VALUE_CHARS:
+            self.glyph(ch)
+        # Fixed cell width so values do not shift around as digits change
+        self.cellWidth = max(self.glyphs[ch].get_width() for ch in "0123456789-+.")
+        self.height = font.get_linesize()
+
+    def glyph(self, ch):
+        surface = self.glyphs.get(ch)
+        if surface is None:
+            surface = self.font.render(ch, True, self.color, self.background)
+            self.glyphs[ch] = surface
+        return surface
+
+    ############################################################
+    ## @brief  Surface for a static label
+    ############################################################
+    def label(self, text):
+        surface = self.labels.get(text)
+        if surface is None:
+            surface = self.font.render(text, True, self.color, self.background)
+            self.labels[text] = surface
+        return surface
+
+    ############################################################
+    ## @brief  Draw a value into a fixed-width cell row
+    ## @return the rectangle that was drawn
+    ############################################################
+    def drawValue(self, screen, rect, text):
+        screen.fill(self.background, rect)
+        x = rect.x
+        for ch in text:
+            if ch != ' ':
+                screen.blit(self.glyph(ch), (x, rect.y))
+            x += self.cellWidth
+        return rect
+
+
+################################################################################
+## @brief  A value on screen and the text it currently shows
+################################################################################
+class Field:
+
+    def __init__(self, glyphs, x, y, numChars):
+        self.rect = pygame.Rect(x, y, glyphs.cellWidth * numChars, glyphs.height)
+        self.numChars = numChars
+        self.text = None
+
+    ############################################################
+    ## @return the dirty rectangle, or None if the text did not change
+    ############################################################
+    def draw(self, screen, glyphs, text):
+        text = text[:self.numChars]
+        if text == self.text:
+            return None
+        self.text = text
+        return glyphs.drawValue(screen, self.rect, text)
+
+
+################################################################################
+## @brief  One joystick's section of the screen and its statistics
+################################################################################
+class JoystickView:
+
+    def __init__(self, joystick):
+        self.joystick = joystick
+        self.instanceId = joystick.get_instance_id()
+        self.name = joystick.get_name()
+        numAxes = joystick.get_numaxes()
+        self.axes = [joystick.get_axis(i) for i in range(0, numAxes)]
+        self.buttons = [joystick.get_button(i) for i in range(0, joystick.get_numbuttons())]
+        self.hats = [joystick.get_hat(i) for i in range(0, joystick.get_numhats())]
+
+        # Per-axis statistics
+        self.axisEvents = [0] * numAxes
+        self.axisRates = [0.0] * numAxes
+        self.pendingNs = [None] * numAxes       # when an axis change not yet on screen was read
+        self.latencySumNs = [0] * numAxes
+        self.latencyCount = [0] * numAxes
+        self.latencyMaxNs = [0] * numAxes
+        self.latencyMeanMs = [0.0] * numAxes
+        self.latencyPeakMs = [0.0] * numAxes
+
+        self.axisFields = []
+        self.rateFields = []
+        self.latencyFields = []
+        self.buttonFields = []
+        self.hatFields = []
+
+    ############################################################
+    ## @brief  Draw the static labels and create the value fields
+    ## @return y below this section
+    ############################################################
+    def layout(self, screen, glyphs, x, y, index):
+        def label(text, lx, ly):
+            screen.blit(glyphs.label(text), (lx, ly))
+
+        label("Joystick {}".format(index), x, y)
+        y += LINE_HEIGHT
+        x += INDENT
+        label("Joystick name: {}".format(self.name), x, y)
+        y += LINE_HEIGHT
+
+        label("Number of axes: {}".format(len(self.axes)), x, y)
+        valueX = x + INDENT + glyphs.label("Axis 00 value: ").get_width()
+        label("rate/s", valueX + 9 * glyphs.cellWidth, y)
+        label("latency ms (mean/max)", valueX + 16 * glyphs.cellWidth, y)
+        y += LINE_HEIGHT
+        for i in range(0, len(self.axes)):
+            label("Axis {} value:".format(i), x + INDENT, y)
+            self.axisFields.append(Field(glyphs, valueX, y, 7))
+            self.rateFields.append(Field(glyphs, valueX + 9 * glyphs.cellWidth, y, 5))
+            self.latencyFields.append(Field(glyphs, valueX + 16 * glyphs.cellWidth, y, 11))
+            y += LINE_HEIGHT
+
+        label("Number of buttons: {}".format(len(self.buttons)), x, y)
+        y += LINE_HEIGHT
+        valueX = x + INDENT + glyphs.label("Button 00 value: ").get_width()
+        for i in range(0, len(self.buttons)):
+            label("Button {:>2} value:".format(i), x + INDENT, y)
+            self.buttonFields.append(Field(glyphs, valueX, y, 1))
+            y += LINE_HEIGHT
+
+        label("Number of hats: {}".format(len(self.hats)), x, y)
+        y += LINE_HEIGHT
+        valueX = x + INDENT + glyphs.label("Hat 0 value: ").get_width()
+        for i in range(0, len(self.hats)):
+            label("Hat {} value:".format(i), x + INDENT, y)
+            self.hatFields.append(Field(glyphs, valueX, y, 8))
+            y += LINE_HEIGHT
+        return y
+
+    ############################################################
+    ## @brief  Apply one joystick event
+    ## @return true if something on screen changed
+    ############################################################
+    def handleEvent(self, event, nowNs):
+        if event.type == pygame.JOYAXISMOTION:
+            axis = event.axis
+            self.axisEvents[axis] += 1
+            if event.value == self.axes[axis]:
+                return False
+            self.axes[axis] = event.value
+            if self.pendingNs[axis] is None:
+                self.pendingNs[axis] = nowNs
+        elif event.type == pygame.JOYBUTTONDOWN or event.type == pygame.JOYBUTTONUP:
+            self.buttons[event.button] = 1 if event.type == pygame.JOYBUTTONDOWN else 0
+        elif event.type == pygame.JOYHATMOTION:
+            self.hats[event.hat] = event.value
+        return True
+
+    ############################################################
+    ## @brief  Draw the values that changed
+    ## @param  dirty - list the changed rectangles are added to
+    ############################################################
+    def draw(self, screen, glyphs, dirty):
+        for i in range(0, len(self.axes)):
+            rect = self.axisFields[i].draw(screen, glyphs, "{:>6.3f}".format(self.axes[i]))
+            if rect is not None:
+                dirty.append(rect)
+            rect = self.rateFields[i].draw(screen, glyphs, "{:>5.0f}".format(self.axisRates[i]))
+            if rect is not None:
+                dirty.append(rect)
+            rect = self.latencyFields[i].draw(screen, glyphs, "{:>5.1f}/{:<5.1f}".format(
+                self.latencyMeanMs[i], self.latencyPeakMs[i]))
+            if rect is not None:
+                dirty.append(rect)
+        for i in range(0, len(self.buttons)):
+            rect = self.buttonFields[i].draw(screen, glyphs, str(self.buttons[i]))
+            if rect is not None:
+                dirty.append(rect)
+        for i in range(0, len(self.hats)):
+            rect = self.hatFields[i].draw(screen, glyphs, str(self.hats[i]))
+            if rect is not None:
+                dirty.append(rect)
+
+    ############################################################
+    ## @brief  The pending axis changes are now on screen
+    ############################################################
+    def shown(self, nowNs):
+        for i in range(0, len(self.axes)):
+            if self.pendingNs[i] is not None:
+                latency = nowNs - self.pendingNs[i]
+                self.pendingNs[i] = None
+                self.latencySumNs[i] += latency
+                self.latencyCount[i] += 1
+                if latency > self.latencyMaxNs[i]:
+                    self.latencyMaxNs[i] = latency
+
+    ############################################################
+    ## @brief  Turn the counts of the last window into rates and latencies
+    ############################################################
+    def updateRates(self, elapsedS):
+        for i in range(0, len(self.axes)):
+            self.axisRates[i] = self.axisEvents[i] / elapsedS
+            self.axisEvents[i] = 0
+            if self.latencyCount[i]:
+                self.latencyMeanMs[i] = self.latencySumNs[i] / self.latencyCount[i] / 1e6
+                self.latencyPeakMs[i] = self.latencyMaxNs[i] / 1e6
+            else:
+                self.latencyMeanMs[i] = 0.0
+                self.latencyPeakMs[i] = 0.0
+            self.latencySumNs[i] = 0
+            self.latencyCount[i] = 0
+            self.latencyMaxNs[i] = 0
+
+
+################################################################################
+## @brief  The monitor window
+################################################################################
+class GamepadMonitor:
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.glyphs = GlyphCache(pygame.font.Font(None, FONT_SIZE), BLACK, WHITE)
+        self.views = []
+        self.dirty = []
+        self.redrawAll = True
+        self.changed = True
+        self.frames = 0
+        for i in range(0, pygame.joystick.get_count()):
+            self.open(i)
+
+    def open(self, deviceIndex):
+        joystick = pygame.joystick.Joystick(deviceIndex)
         joystick.init()
-    
-        textPrint.disp(screen, "Joystick {}".format(i) )
-        textPrint.indent()
-    
-        # Get the name from the OS for the controller/joystick
-        name = joystick.get_name()
-        textPrint.disp(screen, "Joystick name: {}".format(name) )
-        
-        # Usually axis run in pairs, up/down for one, and left/right for
-        # the other.
-        axes = joystick.get_numaxes()
-        textPrint.disp(screen, "Number of axes: {}".format(axes) )
-        textPrint.indent()
-        
-        for i in range( axes ):
-            axis = joystick.get_axis( i )
-            textPrint.disp(screen, "Axis {} value: {:>6.3f}".format(i, axis) )
-        textPrint.unindent()
-            
-        buttons = joystick.get_numbuttons()
-        textPrint.disp(screen, "Number of buttons: {}".format(buttons) )
-        textPrint.indent()
-
-        for i in range( buttons ):
-            button = joystick.get_button( i )
-            textPrint.disp(screen, "Button {:>2} value: {}".format(i,button) )
-        textPrint.unindent()
-            
-        # Hat switch. All or nothing for direction, not like joysticks.
-        # Value comes back in an array.
-        hats = joystick.get_numhats()
-        textPrint.disp(screen, "Number of hats: {}".format(hats) )
-        textPrint.indent()
-
-        for i in range( hats ):
-            hat = joystick.get_hat( i )
-            textPrint.disp(screen, "Hat {} value: {}".format(i, str(hat)) )
-        textPrint.unindent()
-        
-        textPrint.unindent()
-
-    
-    # ALL CODE TO DRAW SHOULD GO ABOVE THIS COMMENT
-    
-    # Go ahead and update the screen with what we've drawn.
-    pygame.display.flip()
-
-    # Limit to 20 frames per second
-    clock.tick(20)
-    
-# Close the window and quit.
-# If you forget this line, the program will 'hang'
-# on exit if running from IDLE.
-pygame.quit ()
\ No newline at end of file
+        for view in self.views:
+            if view.instanceId == joystick.get_instance_id():
+                return
+        self.views.append(JoystickView(joystick))
+        self.redrawAll = True
+
+    def find(self, instanceId):
+        for view in self.views:
+            if view.instanceId == instanceId:
+                return view
+        return None
+
+    ############################################################
+    ## @brief  Apply an event
+    ## @return false when the window was closed
+    ############################################################
+    def handleEvent(self, event, nowNs):
+        if event.type == pygame.QUIT:
+            return False
+        if event.type == pygame.JOYDEVICEADDED:
+            self.open(event.device_index)
+        elif event.type == pygame.JOYDEVICEREMOVED:
+            view = self.find(event.instance_id)
+            if view is not None:
+                self.views.remove(view)
+                self.redrawAll = True
+        elif event.type in EXPOSE_EVENTS:
+            self.redrawAll = True
+        else:
+            if event.type == pygame.JOYBUTTONDOWN:
+                print("Joystick button pressed.")
+            elif event.type == pygame.JOYBUTTONUP:
+                print("Joystick button released.")
+            view = self.find(event.instance_id)
+            if view is not None and view.handleEvent(event, nowNs):
+                self.changed = True
+        return True
+
+    ############################################################
+    ## @brief  Lay the screen out again (joystick added/removed, window exposed)
+    ############################################################
+    def layout(self):
+        screen = self.screen
+        glyphs = self.glyphs
+        screen.fill(WHITE)
+        screen.blit(glyphs.label("Number of joysticks: {}".format(len(self.views))), (10, 10))
+        y = 10 + LINE_HEIGHT
+        for (i, view) in enumerate(self.views):
+            view.axisFields = []
+            view.rateFields = []
+            view.latencyFields = []
+            view.buttonFields = []
+            view.hatFields = []
+            y = view.layout(screen, glyphs, 10 + INDENT, y, i)
+        screen.blit(glyphs.label("frames drawn:"), (10, SCREEN_SIZE[1] - 2 * LINE_HEIGHT))
+        self.frameField = Field(glyphs, 10 + glyphs.label("frames drawn: ").get_width(),
+                                SCREEN_SIZE[1] - 2 * LINE_HEIGHT, 10)
+
+    ############################################################
+    ## @brief  Draw what changed and push only those rectangles to the display
+    ############################################################
+    def draw(self, nowNs):
+        if self.redrawAll:
+            self.layout()
+        dirty = self.dirty
+        for view in self.views:
+            view.draw(self.screen, self.glyphs, dirty)
+        self.frames += 1
+        rect = self.frameField.draw(self.screen, self.glyphs, str(self.frames))
+        if rect is not None:
+            dirty.append(rect)
+
+        if self.redrawAll:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+        del dirty[:]
+        self.redrawAll = False
+        self.changed = False
+
+        shownNs = time.monotonic_ns()
+        for view in self.views:
+            view.shown(shownNs)
+
+    def updateRates(self, elapsedS):
+        for view in self.views:
+            view.updateRates(elapsedS)
+        self.changed = True
+
+
+def main():
+
+    pygame.init()
+
+    # Set the width and height of the screen [width,height]
+    screen = pygame.display.set_mode(SCREEN_SIZE)
+    pygame.display.set_caption("Gamepad monitor")
+
+    # Nothing but these events wakes the monitor up
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(MONITOR_EVENTS)
+
+    monitor = GamepadMonitor(screen)
+    framePeriodNs = NS_PER_S // MAX_FPS
+    windowNs = int(RATE_WINDOW_S * NS_PER_S)
+    now = time.monotonic_ns()
+    nextFrameNs = now
+    nextRatesNs = now + windowNs
+    done = False
+
+    # -------- Main Program Loop -----------
+    while not done:
+        # Sleep until an event arrives, the next frame is allowed, or the rates are due
+        now = time.monotonic_ns()
+        wakeNs = nextRatesNs
+        if monitor.changed or monitor.redrawAll:
+            wakeNs = min(wakeNs, nextFrameNs)
+        timeoutMs = max(0, (wakeNs - now + 999999) // 1000000)
+        events = [pygame.event.wait(timeoutMs)] if timeoutMs > 0 else []
+        events += pygame.event.get()
+
+        now = time.monotonic_ns()
+        for event in events:
+            if event.type != pygame.NOEVENT and not monitor.handleEvent(event, now):
+                done = True
+
+        if now >= nextRatesNs:
+            monitor.updateRates((now - nextRatesNs + windowNs) / float(NS_PER_S))
+            nextRatesNs = now + windowNs
+
+        if (monitor.changed or monitor.redrawAll) and now >= nextFrameNs:
+            monitor.draw(now)
+            nextFrameNs = now + framePeriodNs
+
+    # Close the window and quit.
+    # If you forget this line, the program will 'hang'
+    # on exit if running from IDLE.
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
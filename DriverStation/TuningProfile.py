@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+
+import collections
+import configparser
+import inspect
+import os
+import sys
+import threading
+import time
+import types
+
+import DriveCurves
+import InputConditioning
+
+################################################################################
+## Hot-reloadable tuning profiles
+##
+## The values a team retunes between rounds -- button ids, arm presets, PID
+## gains, drive/arm curve constants and input conditioning -- can be set in an
+## INI file (see profile.example.ini). Anything the file leaves out keeps the
+## value hard-coded in DriverStation.py.
+##
+## A profile is validated as a whole (every bad value is reported, not just the
+## first; conditioning chains are dry-run over their whole input range) and
+## compiled into a ControlMap: the curve tables, conditioning chains
+## and lookup values the control loop uses, built once and never modified.
+##
+## ProfileWatcher polls the file from a background thread. When it has changed
+## (and stayed unchanged for one poll, so a half-saved file is not picked up),
+## the new map is compiled in that thread -- building the curve tables takes a
+## few hundred ms -- and left in `pending`. The control loop takes it at the
+## start of a cycle and swaps it in with a few attribute assignments, so no
+## cycle ever waits for a build. A profile that fails to load or validate is
+## reported and the running map is kept; one that still fails in the loop is
+## rolled back by DriverStation.ControlLoop.
+################################################################################
+
+PROFILE_POLL_S = 0.5    # how often the watcher checks the file
+
+EXP_RANGE = (1.0, 4.0)      # exponential growth coefficients
+ENDPOINT_RANGE = (0, 127)   # curve endpoints and base commands, +/- from neutral
+ARM_POS_RANGE = (0, 254)    # arm presets are sent as the arm command
+RESERVED_RANGE = (123, 126) # protocol v1 reserved values (DriverStation.RESERVED_VALUES_MIN/MAX)
+PID_MODES = ('E', 'M')
+
+# (section, key, setting) in file order; the curve settings are CurveTables' keyword arguments
+FIELDS = (
+    ('buttons', 'arm_auto', 'armAutoButtons'),
+    ('buttons', 'exit_auto', 'exitAutoButton'),
+    ('buttons', 'reset_arm_pos', 'resetArmPosButton'),
+    ('buttons', 'send_pid_gains', 'sendPidGainsButton'),
+    ('buttons', 'stop_program', 'stopProgramButton'),
+    ('buttons', 'arm_manual_axis', 'armManualAxis'),
+    ('arm', 'pos_down', 'armPosDown'),
+    ('arm', 'pos_over_bumps', 'armPosOverBumps'),
+    ('arm', 'pos_up', 'armPosUp'),
+    ('arm', 'exp', 'armExpConst'),
+    ('arm', 'endpoint', 'armEndpoint'),
+    ('arm', 'deadband', 'armDeadband'),
+    ('arm', 'base', 'armBaseCmd'),
+    ('pid', 'error_or_measurement', 'pidMode'),
+    ('pid', 'p', 'pidP'),
+    ('pid', 'i', 'pidI'),
+    ('pid', 'd', 'pidD'),
+    ('pid', 'arm_scale_factor', 'armScaleFactor'),
+    ('drive', 'y_exp', 'yExpConst'),
+    ('drive', 'y_endpoint', 'yEndpoint'),
+    ('drive', 'r_exp', 'rExpConst'),
+    ('drive', 'r_endpoint', 'rEndpoint'),
+    ('drive', 'deadband', 'deadband'),
+    ('drive', 'left_base', 'leftMtrBaseCmd'),
+    ('drive', 'right_base', 'rightMtrBaseCmd'),
+)
+CONDITIONING_SECTION = 'conditioning'   # one key per channel: stages separated by ',', arguments by spaces
+
+CURVE_DEFAULTS = {name: parameter.default
+                  for (name, parameter) in inspect.signature(DriveCurves.CurveTables.__init__).parameters.items()
+                  if name != 'self'}
+CURVE_SETTINGS = tuple(CURVE_DEFAULTS)
+BUTTON_SETTINGS = ('exitAutoButton', 'resetArmPosButton', 'sendPidGainsButton', 'stopProgramButton')
+
+Buttons = collections.namedtuple('Buttons', 'armAuto exitAuto resetArmPos sendPidGains stopProgram armManualAxis')
+
+################################################################################
+## Everything the control loop reads from a profile, precomputed
+##   version      - 1 for the startup map, +1 for every map compiled after it
+##   source       - file the settings came from, or None for the built-in defaults
+##   settings     - read-only mapping of setting name -> value
+##   curves       - DriveCurves.CurveTables
+##   conditioning - InputConditioning.Conditioning, or None
+##   buttons      - Buttons
+##   armPositions - (down, over bumps, up) presets
+##   pidMode, pidGains - arguments of the encoders' setPidGains()
+##   changes      - text describing what changed from the previous map
+##   buildMs      - compile time
+################################################################################
+ControlMap = collections.namedtuple('ControlMap', 'version source settings curves conditioning buttons '
+                                                  'armPositions pidMode pidGains changes buildMs')
+
+
+############################################################
+## @brief  Built-in settings: DriverStation's constants plus CurveTables' defaults
+## @param  constants - dict of the DriverStation settings (DriverStation.profileDefaults())
+## @return dict of setting name -> value
+############################################################
+def defaultSettings(constants):
+    settings = dict(CURVE_DEFAULTS)
+    settings.update(constants)
+    return settings
+
+
+############################################################
+## @brief  Read a profile over the defaults and validate it
+## @param  path - INI file
+## @param  defaults - defaultSettings() result
+## @param  limits - (number of axes, number of buttons) of the gamepad, or None to skip that check
+## @return dict of setting name -> value
+## @throws ValueError listing every problem, IOError if the file cannot be read
+############################################################
+def load(path, defaults, limits=None):
+    parser = configparser.ConfigParser(inline_comment_prefixes=(';', '#'))
+    parser.optionxform = str    # keep conditioning channel names such as armOut
+    with open(path) as f:
+        try:
+            parser.read_file(f)
+        except configparser.Error as e:
+            raise ValueError("Profile " + path + ": " + str(e).replace('\n', ' '))
+
+    settings = dict(defaults)
+    errors = []
+    known = {}
+    for (section, key, name) in FIELDS:
+        known.setdefault(section, {})[key] = name
+    for section in parser.sections():
+        if section == CONDITIONING_SECTION:
+            continue
+        if section not in known:
+            errors.append("unknown section [" + section + "]")
+            continue
+        for (key, text) in parser[section].items():
+            if key not in known[section]:
+                errors.append("unknown setting " + section + "." + key)
+                continue
+            name = known[section][key]
+            try:
+                settings[name] = parseValue(name, text)
+            except ValueError as e:
+                errors.append(section + "." + key + ": " + str(e))
+
+    if parser.has_section(CONDITIONING_SECTION):
+        spec = {}
+        for (channel, text) in parser[CONDITIONING_SECTION].items():
+            try:
+                spec[channel] = parseStages(text)
+            except ValueError as e:
+                errors.append(CONDITIONING_SECTION + "." + channel + ": " + str(e))
+        settings['conditioning'] = spec
+
+    errors += validate(settings, limits)
+    if errors:
+        raise ValueError("Profile " + path + ":\n  " + "\n  ".join(errors))
+    return settings
+
+
+############################################################
+## @brief  Convert one INI value to the type of its setting
+############################################################
+def parseValue(name, text):
+    text = text.strip()
+    if name == 'armAutoButtons':
+        return tuple(int(s) for s in text.split(','))
+    if name in ('pidMode', 'pidP', 'pidI', 'pidD', 'armScaleFactor'):
+        return text
+    if name in ('yExpConst', 'rExpConst', 'armExpConst', 'deadband', 'armDeadband'):
+        return float(text)
+    return int(text)
+
+
+############################################################
+## @brief  Parse a conditioning chain, e.g. "deadband 0.05, ema 0.5"
+## @return stage spec list for InputConditioning
+############################################################
+def parseStages(text):
+    spec = []
+    for stage in text.split(','):
+        words = stage.split()
+        if words:
+            spec.append(tuple([words[0]] + [number(w) for w in words[1:]]))
+    return spec
+
+
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+############################################################
+## @brief  Check a complete set of settings
+## @param  limits - (number of axes, number of buttons), or None
+## @return list of problems (empty if the settings are usable)
+############################################################
+def validate(settings, limits=None):
+    errors = []
+    (numAxes, numButtons) = limits if limits is not None else (None, None)
+
+    def where(name):
+        for (section, key, field) in FIELDS:
+            if field == name:
+                return section + "." + key
+        return name
+
+    def inRange(name, low, high):
+        value = settings[name]
+        if not low <= value <= high:
+            errors.append("{}: {} is outside {} to {}".format(where(name), value, low, high))
+            return False
+        return True
+
+    # Buttons: distinct, and present on the gamepad
+    if len(settings['armAutoButtons']) != 2:
+        errors.append(where('armAutoButtons') + ": needs two buttons")
+    buttons = list(settings['armAutoButtons']) + [settings[name] for name in BUTTON_SETTINGS]
+    if len(set(buttons)) != len(buttons):
+        errors.append("buttons: the same button is used twice (" + ", ".join(str(b) for b in buttons) + ")")
+    for button in buttons:
+        if button < 0 or (numButtons is not None and button >= numButtons):
+            errors.append("buttons: button {} is not on the gamepad".format(button))
+    axis = settings['armManualAxis']
+    if axis < 0 or (numAxes is not None and axis >= numAxes):
+        errors.append("{}: axis {} is not on the gamepad".format(where('armManualAxis'), axis))
+
+    # Arm presets travel as arm commands, so they must stay clear of the reserved values
+    for name in ('armPosDown', 'armPosOverBumps', 'armPosUp'):
+        if inRange(name, *ARM_POS_RANGE) and RESERVED_RANGE[0] <= settings[name] <= RESERVED_RANGE[1]:
+            errors.append("{}: {} is a reserved value ({} to {})".format(where(name), settings[name],
+                                                                          *RESERVED_RANGE))
+
+    # PID gains are sent as strings and parsed as doubles by the robot
+    if settings['pidMode'] not in PID_MODES:
+        errors.append("{}: must be one of {}".format(where('pidMode'), ", ".join(PID_MODES)))
+    for name in ('pidP', 'pidI', 'pidD', 'armScaleFactor'):
+        try:
+            float(settings[name])
+        except ValueError:
+            errors.append("{}: '{}' is not a number".format(where(name), settings[name]))
+        if len(settings[name]) > 255:
+            errors.append(where(name) + ": longer than 255 characters")
+
+    # Curves
+    for name in ('yExpConst', 'rExpConst', 'armExpConst'):
+        inRange(name, *EXP_RANGE)
+    for name in ('yEndpoint', 'rEndpoint', 'armEndpoint', 'leftMtrBaseCmd', 'rightMtrBaseCmd', 'armBaseCmd'):
+        inRange(name, *ENDPOINT_RANGE)
+    for name in ('deadband', 'armDeadband'):
+        if not 0.0 <= settings[name] < 1.0:
+            errors.append("{}: {} is outside 0 to 1".format(where(name), settings[name]))
+
+    # Conditioning: builds, and every chain's output is usable by the pipeline
+    try:
+        conditioning = InputConditioning.build(settings['conditioning'])
+    except Exception as e:
+        errors.append(CONDITIONING_SECTION + ": " + str(e))
+    else:
+        if conditioning is not None:
+            errors += [CONDITIONING_SECTION + "." + problem for problem in conditioning.check()]
+    return errors
+
+
+############################################################
+## @brief  Describe the settings that differ between two profiles
+############################################################
+def describeChanges(old, new):
+    changes = []
+    for (section, key, name) in FIELDS:
+        if old.get(name) != new.get(name):
+            changes.append("{}.{} {} -> {}".format(section, key, old.get(name), new.get(name)))
+    if old.get('conditioning') != new.get('conditioning'):
+        changes.append(CONDITIONING_SECTION + " changed")
+    return ", ".join(changes) if changes else "no changes"
+
+
+################################################################################
+## @brief  Turns validated settings into ControlMaps
+##
+## Curve tables are the expensive part, so the last ones are reused while the
+## curve settings stay the same (e.g. when only a PID gain or button changed).
+################################################################################
+class MapCompiler:
+
+    def __init__(self):
+        self.version = 0
+        self.settings = {}
+        self.curveKey = None
+        self.curves = None
+
+    ############################################################
+    ## @param  settings - validated settings
+    ## @param  source - file they came from, or None
+    ## @return ControlMap
+    ############################################################
+    def compile(self, settings, source=None):
+        start = time.perf_counter()
+        curveKey = tuple(settings[name] for name in CURVE_SETTINGS)
+        if curveKey != self.curveKey:
+            self.curves = DriveCurves.CurveTables(**{name: settings[name] for name in CURVE_SETTINGS})
+            self.curveKey = curveKey
+        conditioning = InputConditioning.build(settings['conditioning'])
+
+        changes = describeChanges(self.settings, settings) if self.version else "startup"
+        self.version += 1
+        self.settings = dict(settings)
+        return ControlMap(
+            version=self.version,
+            source=source,
+            settings=types.MappingProxyType(dict(settings)),
+            curves=self.curves,
+            conditioning=conditioning,
+            buttons=Buttons(tuple(settings['armAutoButtons']), settings['exitAutoButton'],
+                            settings['resetArmPosButton'], settings['sendPidGainsButton'],
+                            settings['stopProgramButton'], settings['armManualAxis']),
+            armPositions=(settings['armPosDown'], settings['armPosOverBumps'], settings['armPosUp']),
+            pidMode=settings['pidMode'],
+            pidGains=(settings['pidP'], settings['pidI'], settings['pidD'], settings['armScaleFactor']),
+            changes=changes,
+            buildMs=(time.perf_counter() - start) * 1000.0)
+
+
+################################################################################
+## @brief  Watches a profile file and compiles a new ControlMap when it changes
+################################################################################
+class ProfileWatcher:
+
+    ############################################################
+    ## @param  path - profile file (need not exist yet)
+    ## @param  defaults - defaultSettings() result, used for anything the file leaves out
+    ## @param  report - function called with a line of text when a profile is rejected
+    ## @param  limits - (number of axes, number of buttons) of the gamepad, or None
+    ## @param  pollS - seconds between checks of the file
+    ############################################################
+    def __init__(self, path, defaults, report=print, limits=None, pollS=PROFILE_POLL_S):
+        self.path = path
+        self.defaults = defaults
+        self.report = report
+        self.limits = limits
+        self.pollS = pollS
+        self.compiler = MapCompiler()
+        self.lock = threading.Lock()
+        self.pending = None         # newest ControlMap not yet taken by the loop
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ProfileWatcher")
+        self.thread.daemon = True
+        self.loadedStat = None
+        self.seenStat = None
+        self.rejected = 0
+
+    ############################################################
+    ## @brief  Compile the startup map (the file if it is valid, else the defaults)
+    ## @return ControlMap
+    ############################################################
+    def loadNow(self):
+        stat = self.stat()
+        self.loadedStat = stat
+        self.seenStat = stat
+        if stat is not None:
+            controls = self.compileFile()
+            if controls is not None:
+                return controls
+        return self.compiler.compile(self.defaults)
+
+    def start(self):
+        self.thread.start()
+
+    def stat(self):
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return (info.st_mtime_ns, info.st_size)
+
+    ############################################################
+    ## @brief  Thread body: compile the file once it has changed and settled
+    ############################################################
+    def run(self):
+        while not self.stopping.wait(self.pollS):
+            stat = self.stat()
+            settled = stat == self.seenStat
+            self.seenStat = stat
+            if stat is None or stat == self.loadedStat or not settled:
+                continue
+            self.loadedStat = stat
+            controls = self.compileFile()
+            if controls is not None:
+                with self.lock:
+                    self.pending = controls
+
+    def compileFile(self):
+        try:
+            settings = load(self.path, self.defaults, self.limits)
+        except (ValueError, IOError) as e:
+            self.rejected += 1
+            self.report("Profile -- rejected, keeping v{}: {}".format(self.compiler.version, e))
+            return None
+        try:
+            return self.compiler.compile(settings, self.path)
+        except Exception as e:
+            self.rejected += 1
+            self.report("Profile -- failed to compile, keeping v{}: {}".format(self.compiler.version, e))
+            return None
+
+    ############################################################
+    ## @brief  Hand the newest compiled map to the loop (check `pending` first, it is cheaper)
+    ## @return ControlMap, or None
+    ############################################################
+    def take(self):
+        with self.lock:
+            controls = self.pending
+            self.pending = None
+        return controls
+
+    def close(self):
+        self.stopping.set()
+        if self.thread.ident is not None:
+            self.thread.join()
+
+
+############################################################
+## @brief  One-line description of a map for the log
+############################################################
+def describe(controls):
+    source = os.path.basename(controls.source) if controls.source is not None else "built-in defaults"
+    return "Profile -- v{} from {} (compiled in {:.0f}ms): {}".format(
+        controls.version, source, controls.buildMs, controls.changes)
+
+
+############################################################
+## @brief  Validate a profile and print what it would change
+############################################################
+def main():
+    import DriverStation
+
+    path = sys.argv[1] if len(sys.argv) > 1 else DriverStation.PROFILE_FILE
+    defaults = defaultSettings(DriverStation.profileDefaults())
+    try:
+        settings = load(path, defaults)
+    except (ValueError, IOError) as e:
+        print(e)
+        return 1
+    compiler = MapCompiler()
+    compiler.compile(defaults)
+    print(describe(compiler.compile(settings, path)))
+
+
+if __name__ == '__main__':
+    sys.exit(int(main() or 0))
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The driver station modules import each other by name from DriverStation/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Headless pygame for the gamepad tests
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import AsyncRuntime
+import ControlScheduler
+import LinkProtocol
+import StationLog
+
+
+class Port:
+    port = 'test'
+
+
+def test_each_v1_link_gets_its_own_encoder():
+    (encoderA, pipelineA) = AsyncRuntime.setUpLink(Port(), LinkProtocol.PROTOCOL_V1, False)
+    (encoderB, pipelineB) = AsyncRuntime.setUpLink(Port(), LinkProtocol.PROTOCOL_V1, False)
+    assert encoderA is not encoderB
+
+    # A frame packed for one robot must not change under the other's
+    frameA = encoderA.command(10, 20, 30)
+    encoderB.command(200, 210, 220)
+    assert bytes(frameA) == bytes((255, 10, 20, 30))
+
+
+class Gamepad:
+    axes = [0.0] * 6
+    buttons = [0] * 11
+    connected = True
+    quitRequested = False
+
+    def update(self):
+        pass
+
+    def watchdogTripped(self):
+        return False
+
+
+class BrokenTransport:
+    def __init__(self):
+        self.writes = 0
+        self.closed = False
+
+    async def write(self, data):
+        self.writes += 1
+        raise OSError(5, "Input/output error")
+
+    async def read(self):
+        await asyncio.sleep(3600)
+
+    def outWaiting(self):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_write_stops_the_runtime_and_cleans_up():
+    (encoder, pipeline) = AsyncRuntime.setUpLink(Port(), LinkProtocol.PROTOCOL_V1, False)
+    transport = BrokenTransport()
+    log = StationLog.StationLog(console=False)
+    runtime = AsyncRuntime.DriverStationRuntime(transport, Gamepad(), pipeline, encoder,
+                                                ControlScheduler.ControlScheduler(1000, 50), log=log)
+
+    async def runBriefly():
+        await asyncio.wait_for(runtime.run(), 2.0)
+
+    with pytest.raises(OSError):
+        asyncio.run(runBriefly())
+    assert transport.closed
+    # The first frame failed, then the neutral burst was still tried once
+    assert transport.writes == 2
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import ControlBus
+
+
+@pytest.fixture
+def busName():
+    return 'bbtest_' + str(os.getpid())
+
+
+def test_live_bus_is_not_taken_over(busName):
+    writer = ControlBus.ControlBusWriter(busName, 6, 11)
+    try:
+        with pytest.raises(FileExistsError):
+            ControlBus.ControlBusWriter(busName, 6, 11)
+        reader = ControlBus.ControlBusReader(busName)
+        assert reader.numAxes == 6
+        reader.close()
+    finally:
+        writer.close()
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="Windows frees a block with its last handle")
+def test_block_of_a_dead_writer_is_replaced(busName):
+    crashed = ControlBus.ControlBusWriter(busName, 6, 11)
+    # Pretend the block was created by a run that has exited since
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    ControlBus.HEADER_FORMAT.pack_into(crashed.buf, 0, ControlBus.MAGIC, ControlBus.VERSION, 6, 11, 0, dead.pid)
+    crashed.buf = None
+    crashed.shm.close()
+
+    writer = ControlBus.ControlBusWriter(busName, 4, 8)
+    try:
+        reader = ControlBus.ControlBusReader(busName)
+        assert reader.numAxes == 4
+        reader.close()
+    finally:
+        writer.close()
+
+
+def test_force_replaces_a_live_bus(busName):
+    first = ControlBus.ControlBusWriter(busName, 6, 11)
+    second = ControlBus.ControlBusWriter(busName, 4, 8, force=True)
+    try:
+        reader = ControlBus.ControlBusReader(busName)
+        assert reader.numAxes == 4
+        reader.close()
+    finally:
+        first.buf = None
+        first.shm.close()
+        second.close()
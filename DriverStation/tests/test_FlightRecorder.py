@@ -0,0 +1,27 @@
+import FlightRecorder
+
+
+def test_records_read_back(tmp_path):
+    path = str(tmp_path / "match.bbfr")
+    recorder = FlightRecorder.FlightRecorder(path, 6, 11, capacity=4)
+    recorder.record(1000, [0.0, 0.5, 0.0, 0.0, -0.5, 0.0], [0] * 4 + [1] + [0] * 6, 100, 150, 127, 1,
+                    bytes((255, 100, 150, 127)))
+    recorder.close()
+    records = list(FlightRecorder.readRecords(path))
+    assert len(records) == 1
+    record = records[0]
+    assert record.timestampNs == 1000
+    assert tuple(record.axes) == (0.0, 0.5, 0.0, 0.0, -0.5, 0.0)
+    assert record.buttons == (0,) * 4 + (1,) + (0,) * 6
+    assert (record.left, record.right, record.arm) == (100, 150, 127)
+    assert bytes(record.frame) == bytes((255, 100, 150, 127))
+
+
+def test_gamepad_with_fewer_axes_and_buttons_after_reconnect(tmp_path):
+    path = str(tmp_path / "match.bbfr")
+    recorder = FlightRecorder.FlightRecorder(path, 6, 11)
+    recorder.record(1, [0.25] * 4, [1] * 8, 127, 127, 127, 1, bytes((255, 127, 127, 127)))
+    recorder.close()
+    records = list(FlightRecorder.readRecords(path))
+    assert tuple(records[0].axes) == (0.25,) * 4 + (0.0,) * 2
+    assert records[0].buttons == (1,) * 8 + (0,) * 3
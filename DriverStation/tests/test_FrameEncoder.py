@@ -0,0 +1,46 @@
+import FrameEncoder
+
+GAINS = ("0.43", "0.0001", "0.05", "20")
+
+
+def test_command_frame_round_trip():
+    encoder = FrameEncoder.FrameEncoder('E', GAINS)
+    decoder = FrameEncoder.FrameDecoder()
+    frames = []
+    for (left, right, arm) in ((127, 127, 125), (0, 254, 127), (200, 54, 80)):
+        frames += decoder.feed(bytes(encoder.command(left, right, arm)))
+    assert frames == [('cmd', 127, 127, 125), ('cmd', 0, 254, 127), ('cmd', 200, 54, 80)]
+
+
+def test_pid_setup_round_trip_in_any_chunking():
+    encoder = FrameEncoder.FrameEncoder('M', GAINS)
+    stream = bytes(encoder.command(126, 126, 126)) + bytes(encoder.command(1, 2, 3))
+    for chunk in (1, 2, 5, len(stream)):
+        decoder = FrameEncoder.FrameDecoder()
+        frames = []
+        for i in range(0, len(stream), chunk):
+            frames += decoder.feed(stream[i:i + chunk])
+        assert frames == [('setup', 'M', list(GAINS)), ('cmd', 1, 2, 3)]
+        assert decoder.checksumErrors == 0
+
+
+def test_corrupt_setup_checksum_is_rejected():
+    encoder = FrameEncoder.FrameEncoder('E', GAINS)
+    packet = bytearray(encoder.command(126, 126, 126))
+    packet[-1] ^= 0x01
+    decoder = FrameEncoder.FrameDecoder()
+    assert decoder.feed(bytes(packet)) == []
+    assert decoder.checksumErrors == 1
+
+
+def test_neutral_burst_leaves_auto_then_zeroes():
+    decoder = FrameEncoder.FrameDecoder()
+    frames = decoder.feed(FrameEncoder.FrameEncoder().neutral())
+    assert frames == [('cmd', 127, 127, 125)] * 3 + [('cmd', 127, 127, 127)] * 3
+
+
+def test_garbage_before_a_frame_is_skipped():
+    decoder = FrameEncoder.FrameDecoder()
+    assert decoder.feed(bytes((1, 2, 3)) + bytes(FrameEncoder.FrameEncoder().command(10, 20, 30))) == \
+        [('cmd', 10, 20, 30)]
+    assert decoder.skippedBytes == 3
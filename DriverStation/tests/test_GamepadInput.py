@@ -0,0 +1,94 @@
+import pygame
+import pytest
+
+import GamepadInput
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def gamepad():
+    GamepadInput.initJoystickOnly()
+    GamepadInput.allowJoystickEventsOnly()
+    pygame.event.clear()
+    clock = FakeClock()
+    lines = []
+    state = GamepadInput.ControllerState(None, numAxes=6, numButtons=11, instanceId=0, clock=clock,
+                                         report=lines.append)
+    state.fakeClock = clock
+    state.lines = lines
+    yield state
+    pygame.event.clear()
+    pygame.quit()
+
+
+def post(eventType, **attributes):
+    pygame.event.post(pygame.event.Event(eventType, **attributes))
+
+
+def test_axis_and_button_events_update_the_snapshot(gamepad):
+    post(pygame.JOYAXISMOTION, instance_id=0, axis=1, value=0.5)
+    post(pygame.JOYAXISMOTION, instance_id=0, axis=4, value=-0.25)
+    post(pygame.JOYBUTTONDOWN, instance_id=0, button=4)
+    post(pygame.JOYBUTTONDOWN, instance_id=0, button=7)
+    post(pygame.JOYBUTTONUP, instance_id=0, button=7)
+    gamepad.update()
+    assert gamepad.axes == [0.0, 0.5, 0.0, 0.0, -0.25, 0.0]
+    assert gamepad.buttons[4] == 1
+    assert gamepad.buttons[7] == 0
+    assert gamepad.eventCount == 5
+
+
+def test_events_from_another_gamepad_are_ignored(gamepad):
+    post(pygame.JOYAXISMOTION, instance_id=1, axis=1, value=0.5)
+    post(pygame.JOYBUTTONDOWN, instance_id=1, button=4)
+    gamepad.update()
+    assert gamepad.axes[1] == 0.0
+    assert gamepad.buttons[4] == 0
+
+
+def test_watchdog_trips_when_nothing_changes(gamepad):
+    timeoutNs = GamepadInput.WATCHDOG_TIMEOUT_MS * GamepadInput.NS_PER_MS
+    gamepad.fakeClock.now = timeoutNs
+    assert not gamepad.watchdogTripped()
+    gamepad.fakeClock.now = timeoutNs + 1
+    assert gamepad.watchdogTripped()
+
+    # Any change feeds the watchdog
+    post(pygame.JOYAXISMOTION, instance_id=0, axis=0, value=0.01)
+    gamepad.update()
+    assert not gamepad.watchdogTripped()
+
+
+def test_repeated_axis_value_does_not_feed_the_watchdog(gamepad):
+    post(pygame.JOYAXISMOTION, instance_id=0, axis=0, value=0.0)
+    gamepad.fakeClock.now = GamepadInput.WATCHDOG_TIMEOUT_MS * GamepadInput.NS_PER_MS + 1
+    gamepad.update()
+    assert gamepad.watchdogTripped()
+
+
+def test_unplugged_gamepad_trips_the_watchdog_and_zeroes_the_snapshot(gamepad):
+    post(pygame.JOYAXISMOTION, instance_id=0, axis=1, value=0.9)
+    post(pygame.JOYBUTTONDOWN, instance_id=0, button=5)
+    gamepad.update()
+    post(pygame.JOYDEVICEREMOVED, instance_id=0)
+    gamepad.update()
+    assert gamepad.watchdogTripped()
+    assert gamepad.disconnects == 1
+    assert gamepad.axes == [0.0] * 6
+    assert gamepad.buttons == [0] * 11
+    # Reported through the callback, not printed on the loop thread
+    assert gamepad.lines == ["Joystick disconnected"]
+
+
+def test_quit_event_requests_stop(gamepad):
+    post(pygame.QUIT)
+    gamepad.update()
+    assert gamepad.quitRequested
@@ -0,0 +1,83 @@
+import pytest
+
+import DriveCurves
+import DriverStation
+import FrameEncoder
+import InputConditioning
+import LinkProtocol
+
+# Every stage type, with arguments for each kind of channel (None = not allowed there)
+AXIS_STAGES = [('deadband', 0.1), ('expo', 1.5), ('expo', 2.0, 0.8), ('ema', 0.3), ('slew', 0.05),
+               ('clamp', -0.5, 0.5), ('reserved', -0.1, 0.1)]
+OUTPUT_STAGES = [('deadband', 10), ('ema', 0.3), ('ema', 0.5), ('slew', 20, 127), ('slew', 7.5, 127),
+                 ('clamp', 10, 240), ('clamp', -50, 1000), ('reserved', 123, 126)]
+
+CURVES = DriveCurves.CurveTables()
+
+SWEEP = [DriveCurves.axisValue(i) for i in range(0, DriveCurves.AXIS_TABLE_SIZE, 997)] + [1.0, -1.0]
+
+
+def runSweep(spec, commandChannel):
+    # v1 sends the tables' 255 at full deflection unconditioned; a conditioned command never exceeds 254
+    driveLimit = 254 if commandChannel else 255
+    limits = {'left': 254 if 'left' in spec else driveLimit, 'right': 254 if 'right' in spec else driveLimit}
+    pipeline = DriverStation.CommandPipeline(CURVES, commandChannel,
+                                             conditioning=InputConditioning.build(spec))
+    if commandChannel:
+        encoder = LinkProtocol.FrameEncoderV2()
+    else:
+        encoder = FrameEncoder.FrameEncoder()
+    buttons = [0] * 11
+    for x in SWEEP:
+        axes = [0.0, x, x, 0.0, -x, 0.0]
+        frame = pipeline.nextFrame(axes, buttons, True, encoder)
+        assert frame is not None
+        pipeline.markSent()
+        assert type(pipeline.leftCmd) is int and 0 <= pipeline.leftCmd <= limits['left']
+        assert type(pipeline.rightCmd) is int and 0 <= pipeline.rightCmd <= limits['right']
+        assert type(pipeline.armCmd) is int and 0 <= pipeline.armCmd <= 254
+
+
+@pytest.mark.parametrize('commandChannel', [False, True])
+@pytest.mark.parametrize('channel', InputConditioning.AXIS_CHANNELS + InputConditioning.OUTPUT_CHANNELS)
+def test_every_stage_on_every_channel_yields_valid_commands(channel, commandChannel):
+    stages = AXIS_STAGES if channel in InputConditioning.AXIS_CHANNELS else OUTPUT_STAGES
+    for stage in stages:
+        runSweep({channel: [stage]}, commandChannel)
+    # And all of them chained
+    runSweep({channel: stages}, commandChannel)
+
+
+@pytest.mark.parametrize('channel', InputConditioning.OUTPUT_CHANNELS)
+def test_expo_is_rejected_on_command_channels(channel):
+    with pytest.raises(ValueError):
+        InputConditioning.build({channel: [('expo', 1.5)]})
+
+
+def test_expo_is_normalized():
+    expo = InputConditioning.Expo(1.5)
+    assert expo.process(1.0) == pytest.approx(1.0)
+    assert expo.process(-1.0) == pytest.approx(-1.0)
+    assert expo.process(0.0) == 0.0
+    assert InputConditioning.Expo(1.5, 0.5).process(1.0) == pytest.approx(0.5)
+    with pytest.raises(ValueError):
+        InputConditioning.Expo(1.5, 127)
+
+
+@pytest.mark.parametrize('commandChannel', [False, True])
+@pytest.mark.parametrize('channel', InputConditioning.OUTPUT_CHANNELS)
+def test_centred_stick_sends_neutral_from_the_first_frame(channel, commandChannel):
+    # The tables put a centred stick at 127 (128 on the drive channels after the 255 - x inversion)
+    for stage in OUTPUT_STAGES:
+        conditioning = InputConditioning.build({channel: [stage]})
+        pipeline = DriverStation.CommandPipeline(CURVES, commandChannel, conditioning=conditioning)
+        encoder = LinkProtocol.FrameEncoderV2() if commandChannel else FrameEncoder.FrameEncoder()
+        for cycle in range(0, 3):
+            if cycle == 2:
+                conditioning.reset()
+            pipeline.nextFrame([0.0] * 6, [0] * 11, True, encoder)
+            pipeline.markSent()
+            # v1 sends the mode change in the arm byte at first
+            values = (pipeline.leftCmd, pipeline.rightCmd, pipeline.armCmd if commandChannel else 127)
+            for value in values:
+                assert abs(value - 127) <= 1, (stage, cycle, value)
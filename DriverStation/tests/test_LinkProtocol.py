@@ -0,0 +1,82 @@
+import LinkProtocol
+
+GAINS = ("0.43", "0.0001", "0.05", "20")
+
+
+def v2Receiver():
+    receiver = LinkProtocol.ReferenceReceiver()
+    receiver.feed(LinkProtocol.HELLO)
+    assert receiver.takeReply() == LinkProtocol.HELLO
+    return receiver
+
+
+def test_crc8_check_value():
+    assert LinkProtocol.crc8(b"123456789") == 0xF4
+
+
+def test_only_changed_channels_are_sent():
+    encoder = LinkProtocol.FrameEncoderV2()
+    decoder = LinkProtocol.FrameDecoderV2(v1Frames=False)
+    frames = decoder.feed(bytes(encoder.command(100, 150, 200)))
+    frames += decoder.feed(bytes(encoder.command(101, 150, 200)))
+    frames += decoder.feed(bytes(encoder.command(101, 150, 199)))
+    frames += decoder.feed(bytes(encoder.command(101, 150, 199)))
+    assert [frame[2:] for frame in frames] == [(7, 100, 150, 200), (1, 101, None, None),
+                                                (4, None, None, 199), (7, 101, 150, 199)]
+    assert [frame[1] for frame in frames] == [0, 1, 2, 3]
+
+
+def test_corrupt_frame_is_rejected():
+    encoder = LinkProtocol.FrameEncoderV2()
+    receiver = v2Receiver()
+    frame = bytearray(encoder.command(100, 150, 200))
+    frame[2] ^= 0x01
+    assert receiver.feed(bytes(frame)) == []
+    assert receiver.decoder.crcErrors == 1
+    assert receiver.feed(bytes(encoder.command(100, 150, 200))) == [('drive', 100, 150, 200)]
+
+
+def test_command_is_resent_until_acked():
+    encoder = LinkProtocol.FrameEncoderV2('E', GAINS)
+    receiver = v2Receiver()
+    events = receiver.feed(bytes(encoder.command(127, 127, 127, LinkProtocol.CONTROL_SET_PID_GAINS)))
+    assert events == [('command', LinkProtocol.CONTROL_SET_PID_GAINS, ('E', list(GAINS))),
+                      ('drive', 127, 127, 127)]
+
+    # The ACK is lost: the command goes out again but is only ACKed, not executed twice
+    receiver.takeReply()
+    events = receiver.feed(bytes(encoder.command(127, 127, 127)))
+    assert events == [('drive', 127, 127, 127)]
+    assert receiver.duplicateCommands == 1
+
+    encoder.processReplies(receiver.takeReply())
+    assert encoder.pending is None
+    assert encoder.commandsAcked == 1
+    assert receiver.feed(bytes(encoder.command(127, 127, 127))) == [('drive', 127, 127, 127)]
+    assert receiver.duplicateCommands == 1
+
+
+def test_lost_delta_is_repaired_within_one_keep_alive_period():
+    encoder = LinkProtocol.FrameEncoderV2()
+    receiver = v2Receiver()
+    receiver.feed(bytes(encoder.command(100, 150, 200)))
+    receiver.feed(bytes(encoder.command(101, 150, 200)))
+
+    # The frame carrying the new right value never arrives
+    encoder.command(102, 50, 200)
+
+    # The left stick keeps moving, so every following frame has a change to send
+    for i in range(0, LinkProtocol.FULL_FRAME_INTERVAL):
+        receiver.feed(bytes(encoder.command(103 + i, 50, 200)))
+        if receiver.right == 50:
+            break
+    assert (receiver.left, receiver.right, receiver.arm) == (103 + i, 50, 200)
+    assert receiver.seqGaps == 1
+
+
+def test_keep_alive_sends_all_channels():
+    encoder = LinkProtocol.FrameEncoderV2()
+    decoder = LinkProtocol.FrameDecoderV2(v1Frames=False)
+    decoder.feed(bytes(encoder.command(100, 150, 200)))
+    frames = decoder.feed(bytes(encoder.command(101, 150, 200, keepAlive=True)))
+    assert frames[0][2:] == (7, 101, 150, 200)
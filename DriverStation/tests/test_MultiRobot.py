@@ -0,0 +1,124 @@
+import asyncio
+
+import pygame
+import pytest
+
+import AsyncRuntime
+import ControlScheduler
+import GamepadInput
+import LinkProtocol
+import MultiRobot
+import StationLog
+
+
+@pytest.fixture
+def events():
+    GamepadInput.initJoystickOnly()
+    GamepadInput.allowJoystickEventsOnly()
+    pygame.event.clear()
+    yield
+    pygame.event.clear()
+    pygame.quit()
+
+
+class Gamepad:
+    axes = [0.0] * 6
+    buttons = [0] * 11
+    quitRequested = False
+
+    def __init__(self, guid, connected=True):
+        self.guid = guid
+        self.connected = connected
+        self.added = []
+
+    def update(self):
+        pass
+
+    def handleEvent(self, event):
+        if event.type == pygame.JOYDEVICEADDED:
+            self.added.append(event.device_index)
+
+    def watchdogTripped(self):
+        return False
+
+
+class Runtime:
+    def __init__(self, gamepad):
+        self.gamepad = gamepad
+
+
+def dispatchAdded(gamepads, guid):
+    lines = []
+    multi = MultiRobot.MultiRobotRuntime([Runtime(gamepad) for gamepad in gamepads], lines.append)
+    pygame.event.post(pygame.event.Event(pygame.JOYDEVICEADDED, device_index=3, guid=guid))
+    multi.dispatchEvents()
+    return lines
+
+
+def test_replugged_joystick_goes_to_the_gamepad_that_lost_that_model(events):
+    xbox = Gamepad('xbox', connected=False)
+    logitech = Gamepad('logitech', connected=False)
+    assert dispatchAdded([xbox, logitech], 'logitech') == []
+    assert (xbox.added, logitech.added) == ([], [3])
+
+
+def test_replugged_joystick_that_fits_two_robots_is_not_assigned(events):
+    first = Gamepad('xbox', connected=False)
+    second = Gamepad('xbox', connected=False)
+    connected = Gamepad('xbox')
+    lines = dispatchAdded([first, second, connected], 'xbox')
+    assert (first.added, second.added, connected.added) == ([], [], [])
+    assert len(lines) == 1 and "not assigned" in lines[0]
+
+
+class Port:
+    port = 'test'
+
+
+class Transport:
+    def __init__(self, failAfter=None):
+        self.failAfter = failAfter
+        self.writes = 0
+        self.closed = False
+
+    async def write(self, data):
+        self.writes += 1
+        if self.failAfter is not None and self.writes > self.failAfter:
+            raise OSError(5, "Input/output error")
+
+    async def read(self):
+        await asyncio.sleep(3600)
+
+    def outWaiting(self):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def test_crashed_robot_is_reported_and_the_others_keep_running(events):
+    log = StationLog.StationLog(console=False)
+    transports = {'broken': Transport(failAfter=3), 'healthy': Transport()}
+    runtimes = []
+    for name in transports:
+        (encoder, pipeline) = AsyncRuntime.setUpLink(Port(), LinkProtocol.PROTOCOL_V1, False)
+        runtimes.append(AsyncRuntime.DriverStationRuntime(
+            transports[name], Gamepad('xbox'), pipeline, encoder, ControlScheduler.ControlScheduler(1000, 50),
+            name=name, log=log))
+    lines = []
+    multi = MultiRobot.MultiRobotRuntime(runtimes, lines.append)
+    multi.scheduler = ControlScheduler.ControlScheduler(1000, 50)
+
+    async def runUntilHealthyHasSentMore():
+        task = asyncio.ensure_future(multi.run())
+        while transports['healthy'].writes < 20:
+            await asyncio.sleep(0.001)
+        assert not task.done()
+        runtimes[1].stop()
+        await asyncio.wait_for(task, 2.0)
+
+    asyncio.run(runUntilHealthyHasSentMore())
+    assert [name for (name, error) in multi.failures] == ['broken']
+    assert isinstance(multi.failures[0][1], OSError)
+    assert any(line.startswith("broken: Robot stopped") for line in lines)
+    assert transports['broken'].closed and transports['healthy'].closed
@@ -0,0 +1,16 @@
+import DriverStation
+import PidTuner
+import TuningProfile
+
+
+def test_pid_section_loads_back_as_the_profile_gains(tmp_path):
+    path = tmp_path / 'profile.ini'
+    path.write_text(PidTuner.pidSection('M', ("0.9", "0.005", "0.03", "25")) + "\n")
+    settings = PidTuner.loadSettings(str(path))
+    assert (settings['pidMode'], settings['pidP'], settings['pidI'], settings['pidD'],
+            settings['armScaleFactor']) == ('M', "0.9", "0.005", "0.03", "25")
+
+
+def test_missing_profile_starts_from_the_built_in_gains(tmp_path):
+    settings = PidTuner.loadSettings(str(tmp_path / 'missing.ini'))
+    assert settings == TuningProfile.defaultSettings(DriverStation.profileDefaults())
@@ -0,0 +1,75 @@
+import pytest
+
+import FrameEncoder
+import RobotSimulator
+
+GAINS = ("1.5", "0.2", "0.05", "30")
+
+# setup() blinks the board LED for 800ms before loop() reads the port
+BOOTED_US = 1000000
+
+
+def booted(gains=GAINS):
+    robot = RobotSimulator.RobotSimulator()
+    robot.advance(BOOTED_US)
+    return (robot, FrameEncoder.FrameEncoder('M', gains))
+
+
+def test_command_frames_set_the_motor_outputs():
+    (robot, encoder) = booted()
+    robot.receive(bytes(encoder.command(0, 254, 200)))
+    robot.advance(BOOTED_US + 10000)
+    assert (robot.leftUs, robot.rightUs, robot.armUs) == (1000, 2000, 1787)
+    assert robot.ledColor == RobotSimulator.BLUE
+
+    robot.receive(bytes(encoder.command(127, 127, 127)))
+    robot.advance(BOOTED_US + 20000)
+    assert (robot.leftUs, robot.rightUs, robot.armUs) == (1500, 1500, 1500)
+    assert robot.framesProcessed == 2
+    assert robot.bodiesDropped == 0 and robot.bytesSkipped == 0
+
+
+def test_outputs_fall_back_to_neutral_250ms_after_the_last_frame():
+    (robot, encoder) = booted()
+    # Nothing has been sent yet, so the robot is already idling
+    assert robot.inFailsafe
+    entries = robot.failsafeEntries
+    robot.receive(bytes(encoder.command(0, 254, 0)))
+    robot.advance(BOOTED_US + 240000)
+    assert (robot.leftUs, robot.rightUs, robot.armUs) == (1000, 2000, 1000)
+    assert not robot.inFailsafe
+
+    robot.advance(BOOTED_US + 260000)
+    assert (robot.leftUs, robot.rightUs, robot.armUs) == (1500, 1500, 1500)
+    assert robot.failsafeEntries == entries + 1
+    assert robot.ledColor == RobotSimulator.RED
+
+
+def test_setup_packet_sets_the_pid_gains():
+    (robot, encoder) = booted()
+    robot.receive(bytes(encoder.command(126, 126, 126)) + bytes(encoder.command(10, 20, 30)))
+    # The firmware blinks purple for 500ms after a good packet before it reads on
+    robot.advance(BOOTED_US + 600000)
+    assert robot.setupsAccepted == 1 and robot.setupChecksumErrors == 0
+    assert robot.armScale == 30.0
+    assert not robot.pid.pOnE
+    assert (robot.pid.kp, robot.pid.ki, robot.pid.kd) == pytest.approx((1.5, 0.02, 0.5))
+    assert robot.framesProcessed == 1
+    assert robot.lastCommand == (10, 20, 30)
+
+
+def test_setup_packet_with_a_bad_checksum_is_rejected():
+    (robot, encoder) = booted()
+    packet = bytearray(encoder.command(126, 126, 126))
+    packet[-1] ^= 0x01
+    robot.receive(bytes(packet))
+    robot.advance(BOOTED_US + 2000000)
+    assert robot.setupChecksumErrors == 1 and robot.setupsAccepted == 0
+    # The default gains stay in place
+    assert robot.armScale == 20.0
+    assert robot.pid.kp == 0.43
+
+    # ... and the robot still drives on the next frame
+    robot.receive(bytes(encoder.command(0, 254, 127)))
+    robot.advance(BOOTED_US + 2010000)
+    assert (robot.leftUs, robot.rightUs) == (1000, 2000)
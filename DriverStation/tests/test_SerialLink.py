@@ -0,0 +1,58 @@
+import collections
+
+import LinkProtocol
+import SerialLink
+
+Port = collections.namedtuple('Port', ['device', 'description', 'manufacturer', 'product', 'vid'])
+
+UART = Port('/dev/ttyS0', 'ttyS0', None, None, None)
+USB = Port('/dev/ttyUSB0', 'USB Serial', 'Prolific', None, 0x067B)
+FTDI = Port('/dev/ttyUSB1', 'FT231X USB UART', 'FTDI', None, 0x0403)
+XBEE = Port('/dev/ttyUSB2', 'XBee Explorer', 'SparkFun', None, 0x1234)
+
+
+def test_find_port_prefers_configured_then_xbee():
+    assert SerialLink.findPort('/dev/ttyUSB0', [UART, USB, FTDI, XBEE]) == '/dev/ttyUSB0'
+    assert SerialLink.findPort('COM5', [UART, USB, FTDI, XBEE]) == '/dev/ttyUSB2'
+    assert SerialLink.findPort('COM5', [UART, USB, FTDI]) == '/dev/ttyUSB1'
+
+
+def test_find_port_ignores_other_usb_adapters_unless_asked():
+    assert SerialLink.findPort('COM5', [UART, USB]) is None
+    assert SerialLink.findPort('COM5', [UART, USB], anyUsb=True) == '/dev/ttyUSB0'
+    assert SerialLink.findPort('COM5', [UART], anyUsb=True) is None
+
+
+class SilentPort:
+    timeout = 1
+    in_waiting = 0
+
+    def __init__(self):
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def read(self, size=1):
+        return b''
+
+
+def test_first_frame_is_timed_after_the_handshake():
+    lines = []
+    clock = iter(range(0, 10 ** 12, 10 ** 6))
+    link = SerialLink.SerialLink('COM5', 57600, discover=False, report=lines.append, startNs=0,
+                                 clock=lambda: next(clock))
+    link.ser = SilentPort()
+    link.openedNs = 0
+
+    assert LinkProtocol.negotiate(link, attempts=2, timeoutS=0.001) == LinkProtocol.PROTOCOL_V1
+    assert link.firstWriteNs is None
+    assert lines == []
+
+    link.linkReady()
+    link.write(b'\xff\x7f\x7f\x7f')
+    link.write(b'\xff\x7f\x7f\x7f')
+    assert link.firstWriteNs > link.readyNs
+    assert len(lines) == 1 and lines[0].startswith("Serial -- first frame")
+    assert link.ser.written == LinkProtocol.HELLO * 2 + b'\xff\x7f\x7f\x7f' * 2
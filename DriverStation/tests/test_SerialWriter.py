@@ -0,0 +1,53 @@
+import threading
+
+import SerialWriter
+
+
+class RecordingPort:
+
+    def __init__(self):
+        self.frames = []
+        self.release = threading.Event()
+
+    def write(self, data):
+        self.release.wait()     # hold the writer so frames pile up in the queue
+        self.frames.append(bytes(data))
+        return len(data)
+
+
+def writeAll(sends):
+    port = RecordingPort()
+    writer = SerialWriter.SerialWriter(port)
+    writer.start()
+    for (frame, coalesce) in sends:
+        writer.sendReliable(frame, coalesce)
+    port.release.set()
+    writer.stop()
+    return (port.frames, writer)
+
+
+def test_identical_mode_change_repeats_are_all_written():
+    enterAuto = bytes((255, 127, 127, 124))
+    (frames, writer) = writeAll([(enterAuto, False)] * 3)
+    assert frames == [enterAuto] * 3
+    assert writer.reliableCoalesced == 0
+
+
+def test_repeated_neutral_bursts_are_coalesced():
+    neutral = bytes((255, 127, 127, 125)) * 3 + bytes((255, 127, 127, 127)) * 3
+    (frames, writer) = writeAll([(neutral, True)] * 4)
+    # The first burst may already be in the writer's hands when the others arrive
+    assert frames in ([neutral], [neutral, neutral])
+    assert writer.reliableCoalesced == 4 - len(frames)
+
+
+def test_drive_frame_is_replaced_by_a_newer_one():
+    port = RecordingPort()
+    writer = SerialWriter.SerialWriter(port)
+    writer.start()
+    writer.sendReliable(bytes((255, 1, 1, 1)))
+    writer.sendDrive(bytes((255, 2, 2, 2)))
+    assert writer.sendDrive(bytes((255, 3, 3, 3)))
+    port.release.set()
+    writer.stop()
+    assert port.frames == [bytes((255, 1, 1, 1)), bytes((255, 3, 3, 3))]
@@ -0,0 +1,40 @@
+import DriverStation
+import FrameEncoder
+import SimHarness
+
+
+def decode(output):
+    return FrameEncoder.FrameDecoder().feed(bytes(output))
+
+
+def test_trace_runs_through_the_control_loop():
+    ser = SimHarness.FakeSerial()
+    stats = SimHarness.runTrace(SimHarness.generateTrace(5.0, seed=1), ser)
+    frames = decode(ser.output)
+    assert stats['frames'] > 0
+    assert stats['neutralBursts'] == 0
+
+    # Starts in manual arm mode, ends with the shutdown's neutral burst
+    assert frames[0][3] == DriverStation.RESERVED_VALUE_ENTER_ARM_MANUAL
+    assert frames[-6:] == [('cmd', 127, 127, 125)] * 3 + [('cmd', 127, 127, 127)] * 3
+
+
+def test_stop_button_ends_the_run_and_zeroes_the_robot():
+    neutralAxes = (0.0,) * SimHarness.NUM_AXES
+    released = (0,) * SimHarness.NUM_BUTTONS
+    stop = tuple(1 if i == DriverStation.BUTTON_ID_STOP_PROGRAM else 0 for i in range(SimHarness.NUM_BUTTONS))
+    trace = [(0, neutralAxes, released), (100000000, neutralAxes, stop), (2000000000, neutralAxes, released)]
+    ser = SimHarness.FakeSerial()
+    stats = SimHarness.runTrace(trace, ser)
+    assert stats['simSeconds'] < 0.2
+    assert decode(ser.output)[-1] == ('cmd', 127, 127, 127)
+
+
+def test_same_trace_same_wire_output():
+    trace = SimHarness.generateTrace(3.0, seed=7)
+    outputs = []
+    for i in range(2):
+        ser = SimHarness.FakeSerial()
+        SimHarness.runTrace(trace, ser)
+        outputs.append(bytes(ser.output))
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,54 @@
+import threading
+
+import StageMetrics
+
+
+def test_histogram_percentiles():
+    h = StageMetrics.LatencyHistogram()
+    for ns in (100, 200, 300, 5000):
+        h.record(ns)
+    assert h.count == 4
+    assert h.maxNs == 5000
+    assert h.percentile(0.5) == 256
+    assert h.percentile(1.0) == 5000
+
+
+def test_summary_is_written_off_the_loop_thread(tmp_path):
+    reports = []
+    reportThreads = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def report(text):
+        reportThreads.append(threading.current_thread())
+        started.set()
+        release.wait()      # a slow console must not hold up the loop
+        reports.append(text)
+
+    dumpPath = str(tmp_path / "metrics.txt")
+    metrics = StageMetrics.LoopMetrics(0, dumpPath, report)
+    metrics.beginCycle()
+    metrics.endStage(StageMetrics.STAGE_EVENTS)
+    metrics.summaryRequested = True     # as the SIGUSR1 handler does
+    metrics.endCycle()
+    assert started.wait(5)
+    assert reports == []                # endCycle() returned while the report was still blocked
+
+    metrics.beginCycle()
+    metrics.endCycle()                  # no summary due: the loop does not touch the reporter
+    release.set()
+    metrics.close()
+    assert len(reports) == 1
+    assert reportThreads[0] is not threading.current_thread()
+    with open(dumpPath) as f:
+        assert f.read().startswith("stage")
+
+
+def test_close_writes_a_summary_that_is_already_due():
+    reports = []
+    metrics = StageMetrics.LoopMetrics(0, None, reports.append)
+    metrics.beginCycle()
+    metrics.summaryRequested = True
+    metrics.endCycle()
+    metrics.close()
+    assert len(reports) == 1
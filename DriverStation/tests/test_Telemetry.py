@@ -0,0 +1,70 @@
+import FrameEncoder
+import RobotSimulator
+import Telemetry
+
+
+class Port:
+    def __init__(self, data):
+        self.data = bytearray(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.data))
+        buf[0:n] = self.data[0:n]
+        del self.data[0:n]
+        return n
+
+
+def robotTelemetry(seconds=1.0):
+    robot = RobotSimulator.RobotSimulator()
+    encoder = FrameEncoder.FrameEncoder()
+    # Past the boot blink, then a command frame every 20ms
+    robot.advance(1000000)
+    for i in range(0, int(seconds * 50)):
+        robot.receive(bytes(encoder.command(10, 20, 30)))
+        robot.advance(1000000 + (i + 1) * 20000)
+    data = robot.takeTransmitted()
+    size = Telemetry.TELEMETRY_FRAME_SIZE
+    assert len(data) % size == 0
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_robot_telemetry_round_trip():
+    frames = robotTelemetry()
+    receiver = Telemetry.TelemetryReceiver()
+    port = Port(b''.join(frames))
+    assert receiver.poll(port) == len(frames)
+    assert port.in_waiting == 0
+    assert (receiver.crcErrors, receiver.seqGaps, receiver.skippedBytes) == (0, 0, 0)
+
+    sample = receiver.latest
+    assert (sample.left, sample.right, sample.arm) == (10, 20, 30)
+    assert not sample.failsafe and not sample.armAngleMode
+    assert sample.armUs == RobotSimulator.arduinoMap(30, 0, 254, 1000, 2000)
+    assert sample.commandAgeMs <= 20
+    assert receiver.intervalMs.mean() == Telemetry.TELEMETRY_PERIOD_MS
+
+
+def test_corrupted_frames_are_dropped_and_the_stream_resyncs():
+    frames = robotTelemetry()
+    assert len(frames) > 10
+    lengthCorrupted = bytearray(frames[3])
+    lengthCorrupted[4] ^= 0x40      # claims a longer payload
+    crcCorrupted = bytearray(frames[7])
+    crcCorrupted[-1] ^= 0x01
+    frames[3] = bytes(lengthCorrupted)
+    frames[7] = bytes(crcCorrupted)
+
+    receiver = Telemetry.TelemetryReceiver()
+    # Arriving in small pieces, as from a serial port polled every cycle
+    stream = b''.join(frames)
+    received = 0
+    for i in range(0, len(stream), 7):
+        received += receiver.poll(Port(stream[i:i + 7]))
+    assert received == len(frames) - 2
+    assert receiver.crcErrors >= 2
+    assert receiver.seqGaps == 2
+    assert (receiver.latest.left, receiver.latest.right, receiver.latest.arm) == (10, 20, 30)
@@ -0,0 +1,120 @@
+import ControlScheduler
+import DriverStation
+import FrameEncoder
+import SerialWriter
+import SimHarness
+import StageMetrics
+import StationLog
+import TuningProfile
+
+# Builds, but the average turns into NaN on the first value, which cannot become a motor command
+CRASHING_CONDITIONING = {'left': [('ema', 0.5, float('inf'))]}
+
+
+def defaults():
+    return TuningProfile.defaultSettings(DriverStation.profileDefaults())
+
+
+def test_validate_dry_runs_the_conditioning():
+    settings = defaults()
+    settings['conditioning'] = {'y': [('deadband', 0.1), ('expo', 1.5)], 'left': [('ema', 0.3)]}
+    assert TuningProfile.validate(settings) == []
+
+    # ... and a centred stick sends neutral from the first cycle
+    controls = TuningProfile.MapCompiler().compile(settings)
+    pipeline = DriverStation.CommandPipeline(controls.curves, True, controls=controls)
+    pipeline.nextFrame([0.0] * 6, [0] * 11, True, FrameEncoder.FrameEncoder())
+    assert (pipeline.leftCmd, pipeline.rightCmd) == (127, 128)   # the tables centre the drive at 128
+
+    settings['conditioning'] = CRASHING_CONDITIONING
+    errors = TuningProfile.validate(settings)
+    assert len(errors) == 1 and errors[0].startswith("conditioning.left: input 0 raises ValueError")
+
+    # Stateless axis stages fail while they are folded into a table
+    settings['conditioning'] = {'y': [('expo', -5)]}
+    errors = TuningProfile.validate(settings)
+    assert len(errors) == 1 and errors[0].startswith("conditioning: 'y' fails on the joystick range")
+
+
+def test_rejected_profile_keeps_the_running_map(tmp_path):
+    path = tmp_path / 'profile.ini'
+    path.write_text("[conditioning]\nleft = ema 0.5 inf\n")
+    lines = []
+    watcher = TuningProfile.ProfileWatcher(str(path), defaults(), lines.append)
+    controls = watcher.loadNow()
+    assert controls.source is None
+    assert watcher.rejected == 1
+    assert "conditioning.left" in lines[0]
+
+
+def test_swap_keeps_the_running_conditioning_state():
+    compiler = TuningProfile.MapCompiler()
+    settings = defaults()
+    settings['conditioning'] = {'y': [('ema', 0.5)], 'left': [('slew', 5)]}
+    first = compiler.compile(settings)
+    pipeline = DriverStation.CommandPipeline(first.curves, True, controls=first)
+    encoder = FrameEncoder.FrameEncoder()
+    fullStick = [0.0, 1.0, 0.0, 0.0, 0.0, 0.0]
+    for i in range(0, 100):
+        pipeline.nextFrame(fullStick, [0] * 11, True, encoder)
+        pipeline.markSent()
+    steady = (pipeline.leftCmd, pipeline.rightCmd)
+
+    # Same stages with other constants, and a changed arm preset: no step on the next cycle
+    settings['conditioning'] = {'y': [('ema', 0.6)], 'left': [('slew', 8)]}
+    settings['armPosUp'] = 90
+    pipeline.applyControlMap(compiler.compile(settings))
+    pipeline.nextFrame(fullStick, [0] * 11, True, encoder)
+    assert (pipeline.leftCmd, pipeline.rightCmd) == steady
+
+
+class Gamepad:
+    axes = [0.0] * 6
+    buttons = [0] * 11
+    connected = True
+    quitRequested = False
+
+    def update(self):
+        pass
+
+    def watchdogTripped(self):
+        return False
+
+
+class Profiles:
+    def __init__(self):
+        self.pending = None
+        self.rejected = 0
+
+    def take(self):
+        (controls, self.pending) = (self.pending, None)
+        return controls
+
+
+def test_map_that_fails_in_the_loop_is_rolled_back():
+    compiler = TuningProfile.MapCompiler()
+    good = compiler.compile(defaults())
+    settings = defaults()
+    settings['conditioning'] = CRASHING_CONDITIONING
+    bad = compiler.compile(settings)    # skips validate(), as a stage that only fails in the loop would
+
+    clock = SimHarness.SimClock()
+    scheduler = ControlScheduler.ControlScheduler(100, 50, clock, clock.sleep)
+    pipeline = DriverStation.CommandPipeline(good.curves, controls=good)
+    ser = SimHarness.FakeSerial()
+    log = StationLog.StationLog(console=False)
+    profiles = Profiles()
+    loop = DriverStation.ControlLoop(scheduler, Gamepad(), pipeline, FrameEncoder.FrameEncoder(), ser,
+                                     SerialWriter.DirectWriter(ser), StageMetrics.LoopMetrics(), log,
+                                     profiles=profiles, report=lambda line: None)
+
+    profiles.pending = bad
+    for i in range(0, 5):
+        scheduler.waitNextCycle()
+        loop.runCycle()
+    assert not loop.done
+    assert pipeline.controls is good
+    assert profiles.rejected == 1
+    messages = [record[1] for record in log.queue if record[0] == StationLog.RECORD_MESSAGE]
+    assert any("v2 failed in the control loop" in m and "back to v1" in m for m in messages)
+    assert ser.writes > 0
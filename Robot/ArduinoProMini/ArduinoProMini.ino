@@ -85,6 +85,24 @@ bool waitingForStartByte = true;
 //Local testing
 int loopCount = 0;
 
+// Telemetry sent back to the driver station (see DriverStation/Telemetry.py).
+// Framed like a link protocol v2 control frame:
+//   254, seq, 7, 0, <payload length>, <payload>, <CRC-8 over everything after 254>
+// Set TELEMETRY_PERIOD_MS to 0 to disable it.
+#define TELEMETRY_PERIOD_MS 50
+const byte telemetrySync = 254;
+const byte telemetryCode = 7;
+const byte telemetryPayloadSize = 20;
+const byte telemetryFrameSize = 5 + telemetryPayloadSize + 1;
+unsigned long lastTelemetry = 0;
+byte telemetrySeq = 0;
+bool inFailsafe = false;
+int armOutputUs = 1500;
+byte lastLeft = 127;
+byte lastRight = 127;
+byte lastArm = 127;
+unsigned long lastCmdTime = 0;
+
 /*=================================SET UP=====================================*/
 void setup() {
   //57600 baud, pin 13 is an indicator LED
@@ -149,12 +167,24 @@ void loop() {
  
   if (millis() - lastTimeRX > 250) {
     idle();
+  } else {
+    inFailsafe = false;
+  }
+
+  if (TELEMETRY_PERIOD_MS > 0 && millis() - lastTelemetry >= TELEMETRY_PERIOD_MS) {
+    sendTelemetry();
   }
 }
 
 
 /*============================CUSTOM FUNC=====================================*/
 void processCmd(int left, int right, int arm) {
+  ++loopCount;
+  lastLeft = left;
+  lastRight = right;
+  lastArm = arm;
+  lastCmdTime = millis();
+
   // Debug output
 //  Serial.print("L: ");
 //  Serial.print(left);
@@ -165,7 +195,7 @@ void processCmd(int left, int right, int arm) {
 //  Serial.print(", Enc:");
 //  Serial.print(inttEnc.read());
 //  Serial.print(", Count:");
-//  Serial.print(++loopCount);
+//  Serial.print(loopCount);
 //  Serial.println("");
 
   // Indicate that we have signal by illuminating the on-board LED
@@ -221,12 +251,14 @@ void setArmAngle(int arm) {
   if (armMicroseconds > 2000) armMicroseconds = 2000;
   if (armMicroseconds < 1000) armMicroseconds = 1000;
 
-  armSrvo.writeMicroseconds((int) armMicroseconds);
+  armOutputUs = (int) armMicroseconds;
+  armSrvo.writeMicroseconds(armOutputUs);
   setLEDColor(YELLOW);
 }
 
 void moveArm(int arm) {
   arm = map(arm, 0, 254, 1000, 2000);
+  armOutputUs = arm;
   armSrvo.writeMicroseconds(arm);
 
   if (arm > 1505) {
@@ -251,12 +283,71 @@ void idle() {
   rightSrvo.writeMicroseconds(1500);
   leftSrvo.writeMicroseconds(1500);
   armSrvo.writeMicroseconds(1500);
+  armOutputUs = 1500;
+  inFailsafe = true;
 
   // Indicate that we have lost comms by turning off the on-board LED
   digitalWrite(boardLedPin, LOW);
   setLEDColor(RED);
 }
 
+// CRC-8, polynomial 0x07 (same as the driver station's link protocol v2)
+byte crc8Update(byte crc, byte data) {
+  crc ^= data;
+  for (byte bit = 0; bit < 8; ++bit) {
+    crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+  }
+  return crc;
+}
+
+// Queue one telemetry frame, little-endian:
+//   uint32 millis, uint16 loopCount, int32 encoder, int16 setpoint, int16 arm output (us),
+//   uint8 flags (1 = failsafe, 2 = arm angle mode), uint8 last left/right/arm,
+//   uint16 ms since the last command frame
+// Skipped when the transmit buffer has no room, so it never blocks the loop.
+void sendTelemetry() {
+  lastTelemetry = millis();
+  if (Serial.availableForWrite() < telemetryFrameSize) {
+    return;
+  }
+
+  byte frame[telemetryFrameSize];
+  unsigned long now = millis();
+  int32_t encoder = inttEnc.read() - armZeroPoint;
+  int setpoint = (int) myPID_Setpoint;
+  unsigned long commandAge = now - lastCmdTime;
+  if (commandAge > 0xFFFF) commandAge = 0xFFFF;
+  byte flags = (inFailsafe ? 1 : 0) | (armAngleMode ? 2 : 0);
+
+  byte i = 0;
+  frame[i++] = telemetrySync;
+  frame[i++] = telemetrySeq;
+  frame[i++] = telemetryCode;
+  frame[i++] = 0;
+  frame[i++] = telemetryPayloadSize;
+  for (byte b = 0; b < 4; ++b) frame[i++] = now >> (8 * b);
+  frame[i++] = loopCount;
+  frame[i++] = loopCount >> 8;
+  for (byte b = 0; b < 4; ++b) frame[i++] = encoder >> (8 * b);
+  frame[i++] = setpoint;
+  frame[i++] = setpoint >> 8;
+  frame[i++] = armOutputUs;
+  frame[i++] = armOutputUs >> 8;
+  frame[i++] = flags;
+  frame[i++] = lastLeft;
+  frame[i++] = lastRight;
+  frame[i++] = lastArm;
+  frame[i++] = commandAge;
+  frame[i++] = commandAge >> 8;
+
+  byte crc = 0;
+  for (byte b = 1; b < i; ++b) crc = crc8Update(crc, frame[b]);
+  frame[i++] = crc;
+
+  Serial.write(frame, i);
+  telemetrySeq = (telemetrySeq + 1) & 0x1F;
+}
+
 void setLEDColor(LEDColor color) {
   switch (color) {
     case OFF: